@@ -0,0 +1,90 @@
+# Streaming load of zip/tar study archives, members are decoded in memory while the archive is read
+
+import io
+import os
+import tarfile
+import zipfile
+import threading
+import numpy as np
+import pydicom
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple, Optional
+from volume_loader import ParallelDICOMLoader, Volume, sortSlices, storedDtype, volumeGeometry, decodeDataset, rescaleParameters
+
+def isArchive(path: str) -> bool:
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+def iterArchiveMembers(path: str) -> Iterator[Tuple[str, bytes]]:
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield (info.filename, archive.read(info))
+    else:
+        # Stream mode reads the (possibly compressed) tar sequentially without seeking back
+        with tarfile.open(path, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield (member.name, archive.extractfile(member).read())
+
+def decodeMember(data: bytes) -> Optional[Tuple[pydicom.Dataset, np.ndarray]]:
+    try:
+        dataset = pydicom.dcmread(io.BytesIO(data))
+    except pydicom.errors.InvalidDicomError:
+        return None
+    if "PixelData" not in dataset or "ImagePositionPatient" not in dataset or "PixelSpacing" not in dataset:
+        return None
+    # Kept in stored form, whether the rescale is applied is decided once the whole series is known
+    pixels = decodeDataset(dataset, storedDtype(dataset), rescale=False)
+    del dataset.PixelData
+    return (dataset, pixels)
+
+def assembleVolume(loader: ParallelDICOMLoader, keys: List[str], headers: List[pydicom.Dataset], slices: dict, release: bool = False) -> Volume:
+    # Stacks decoded slices (key -> stored pixels) in sorted order with the dtype and rescale the
+    # loader would have used for the same series on disk
+    first = headers[0]
+    (spacing, origin, direction) = volumeGeometry(headers)
+    rescale = loader.getVolumeRescale(headers)
+    array = np.empty((len(headers), int(first.Rows), int(first.Columns)), dtype=loader.getVolumeDtype(headers))
+    for (index, (key, header)) in enumerate(zip(keys, headers)):
+        # Released slices keep peak memory close to one volume
+        pixels = slices.pop(key) if release else slices[key]
+        (slope, intercept) = rescaleParameters(header)
+        if rescale == (1.0, 0.0) and (slope != 1 or intercept != 0):
+            pixels = pixels * slope + intercept
+        array[index] = pixels
+    volume = Volume(array, spacing, origin, direction)
+    volume.setRescale(*rescale)
+    return volume
+
+class ArchiveDICOMLoader(object):
+    def __init__(self, num_workers: Optional[int] = None, max_pending: int = 64, loader: Optional[ParallelDICOMLoader] = None) -> None:
+        self.numWorkers = num_workers or os.cpu_count() or 1
+        # Decides the volume dtype and rescale (keep_stored_values) like for series read from disk
+        self.loader = loader if loader is not None else ParallelDICOMLoader(num_workers=num_workers)
+        # Bounds the number of compressed members waiting for a decoder
+        self.maxPending = max_pending
+
+    def loadArchive(self, path: str) -> Volume:
+        pending = threading.BoundedSemaphore(self.maxPending)
+        futures = []
+
+        def decode(data: bytes) -> Optional[Tuple[pydicom.Dataset, np.ndarray]]:
+            try:
+                return decodeMember(data)
+            finally:
+                pending.release()
+
+        # Reading/decompressing the archive on this thread overlaps with decoding on the pool
+        with ThreadPoolExecutor(max_workers=self.numWorkers) as executor:
+            for (name, data) in iterArchiveMembers(path):
+                pending.acquire()
+                futures.append((name, executor.submit(decode, data)))
+            results = [(name, future.result()) for (name, future) in futures]
+
+        results = [(name, result) for (name, result) in results if result is not None]
+        if len(results) == 0:
+            raise ValueError("No DICOM images found in {}".format(path))
+        slices = dict((name, pixels) for (name, (_, pixels)) in results)
+        (names, headers) = sortSlices([name for (name, _) in results], [dataset for (_, (dataset, _)) in results])
+        return assembleVolume(self.loader, names, headers, slices, release=True)
@@ -0,0 +1,55 @@
+# Crop the background air around the patient before the volume reaches the reslice filters
+
+import numpy as np
+from typing import Dict, Tuple
+from volume_loader import Volume
+
+def findBodyBoundingBox(volume: Volume, threshold: float = -500.0, stride: int = 4, margin: int = 4) -> Tuple[int, int, int, int, int, int]:
+    # (x0, x1, y0, y1, z0, z1) in voxel indices, upper bounds exclusive. The in-plane box comes from a
+    # max projection over every stride-th slice, the z range from a per-slice max over a strided grid.
+    # The threshold is in modality units (HU for CT).
+    array = volume.array
+    threshold = volume.toStoredValues(threshold)
+    if volume.rescaleSlope < 0:
+        array = -array
+        threshold = -threshold
+    (nz, ny, nx) = array.shape
+    projection = array[::stride].max(axis=0) > threshold
+    if not projection.any():
+        return (0, nx, 0, ny, 0, nz)
+    ys = np.flatnonzero(projection.any(axis=1))
+    xs = np.flatnonzero(projection.any(axis=0))
+    sliceMax = array[:, ys[0]:ys[-1] + 1:stride, xs[0]:xs[-1] + 1:stride].max(axis=(1, 2))
+    zs = np.flatnonzero(sliceMax > threshold)
+    if len(zs) == 0:
+        return (0, nx, 0, ny, 0, nz)
+    # The strided projections can miss thin structures at the edge, the margin covers them
+    return (
+        max(0, int(xs[0]) - margin), min(nx, int(xs[-1]) + 1 + margin),
+        max(0, int(ys[0]) - margin), min(ny, int(ys[-1]) + 1 + margin),
+        max(0, int(zs[0]) - stride), min(nz, int(zs[-1]) + 1 + stride)
+    )
+
+def cropVolume(volume: Volume, box: Tuple[int, int, int, int, int, int]) -> Volume:
+    (x0, x1, y0, y1, z0, z1) = box
+    (sx, sy, sz) = volume.spacing
+    (ox, oy, oz) = volume.origin
+    # Shifting the origin by the cropped voxels keeps every remaining voxel at its world position
+    array = np.ascontiguousarray(volume.array[z0:z1, y0:y1, x0:x1])
+    cropped = Volume(array, volume.spacing, (ox + x0*sx, oy + y0*sy, oz + z0*sz), volume.direction)
+    cropped.setRescale(volume.rescaleSlope, volume.rescaleIntercept)
+    return cropped
+
+def autoCropVolume(volume: Volume, threshold: float = -500.0, stride: int = 4, margin: int = 4) -> Tuple[Volume, Dict]:
+    box = findBodyBoundingBox(volume, threshold, stride, margin)
+    (nz, ny, nx) = volume.array.shape
+    if box == (0, nx, 0, ny, 0, nz):
+        return (volume, {"box": box, "original_bytes": volume.array.nbytes, "cropped_bytes": volume.array.nbytes, "saved_fraction": 0.0})
+    cropped = cropVolume(volume, box)
+    report = {
+        "box": box,
+        "original_bytes": volume.array.nbytes,
+        "cropped_bytes": cropped.array.nbytes,
+        "saved_fraction": 1.0 - cropped.array.nbytes / volume.array.nbytes
+    }
+    return (cropped, report)
@@ -0,0 +1,519 @@
+# Benchmarks for the volume loading and reslicing paths used by MPRViewer
+
+import time
+import vtk
+import numpy as np
+from vtkmodules.util import numpy_support
+from typing import Callable, List, Optional, Tuple
+from volume_loader import ParallelDICOMLoader, Volume, listDicomFiles
+from volume_cache import VolumeCache, studyKey, directoryFingerprint
+from progressive_loader import ProgressiveLoader
+from first_paint import FirstPaintLoader
+from bricked_volume import BrickedVolumeStore, BrickCache, BrickCodec, CompressedBrickVolume
+from numpy_reslice import PythonImageReslice
+from dicomweb import LocalDICOMwebServer, WADORSRetriever
+from memory_ingest import DicomByteIngestor
+from auto_crop import autoCropVolume
+from volume_pyramid import VolumePyramid
+from shared_volume import SharedVolumeRegistry, sharedVolumeKey
+from study_cache import StudyCache, StudyEntry
+from minmax_index import MinMaxBrickIndex, slabMaximumIntensity, histogramInRange
+from volume_histogram import VolumeHistogram
+from multiphase import MultiPhaseLoader
+from slice_cache import SliceCache, CachedReslice
+from reslice_engine import RESLICE_ENGINES, createResliceEngine
+from compressed_decoder import CompressedDICOMLoader, codecName, readTransferSyntax
+
+def timeit(function: Callable, repeat: int = 3) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def report(name: str, timings: List[float], baseline: Optional[float] = None) -> None:
+    best = min(timings)
+    line = "{:<40} best {:8.3f} s   mean {:8.3f} s".format(name, best, sum(timings)/len(timings))
+    if baseline is not None:
+        line += "   speedup x{:.2f}".format(baseline/best)
+    print(line)
+
+def benchmarkDICOMLoaders(path_to_dir: str, repeat: int = 3, workers: List[int] = [2, 4, 8]) -> None:
+    def loadWithVTKReader() -> vtk.vtkImageData:
+        reader = vtk.vtkDICOMImageReader()
+        reader.SetDirectoryName(path_to_dir)
+        reader.Update()
+        return reader.GetOutput()
+
+    reference = loadWithVTKReader()
+    baseline = timeit(loadWithVTKReader, repeat)
+    report("vtkDICOMImageReader", baseline)
+
+    for numWorkers in workers:
+        for useProcesses in (False, True):
+            loader = ParallelDICOMLoader(num_workers=numWorkers, use_processes=useProcesses)
+            timings = timeit(lambda: loader.loadDirectory(path_to_dir), repeat)
+            report("{} x {}".format("processes" if useProcesses else "threads", numWorkers), timings, min(baseline))
+
+    # Check that the reslice pipeline gets the same geometry as before
+    imageData = ParallelDICOMLoader().loadDirectory(path_to_dir).toImageData()
+    print("dimensions", reference.GetDimensions(), imageData.GetDimensions())
+    print("spacing   ", reference.GetSpacing(), imageData.GetSpacing())
+    print("origin    ", reference.GetOrigin(), imageData.GetOrigin())
+    assert reference.GetDimensions() == imageData.GetDimensions(), "dimensions differ"
+    assert np.allclose(reference.GetSpacing(), imageData.GetSpacing(), rtol=1e-5), "spacing differs"
+    assert np.allclose(reference.GetOrigin(), imageData.GetOrigin()), "origin differs"
+    referenceArray = numpy_support.vtk_to_numpy(reference.GetPointData().GetScalars())
+    array = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+    difference = np.abs(referenceArray.astype(np.float64) - array).max()
+    print("max abs voxel difference", difference)
+    assert difference == 0, "voxels differ"
+
+def benchmarkVolumeCache(path_to_dir: str, cache_dir: str, repeat: int = 3) -> None:
+    cache = VolumeCache(cache_dir)
+    cache.remove(path_to_dir)
+    loader = ParallelDICOMLoader()
+
+    def openStudy() -> vtk.vtkImageData:
+        files = listDicomFiles(path_to_dir)
+        fingerprint = cache.getFingerprint(path_to_dir, files)
+        volume = cache.load(path_to_dir, fingerprint)
+        if volume is None:
+            volume = loader.loadFiles(files)
+            cache.store(path_to_dir, volume, fingerprint)
+        return volume.toImageData()
+
+    report("first open (decode + store)", timeit(openStudy, 1))
+    report("re-open (mmap)", timeit(openStudy, repeat))
+
+def benchmarkProgressiveLoading(path_to_dir: str, steps: List[int] = [2, 4, 8]) -> None:
+    loader = ParallelDICOMLoader()
+    files = listDicomFiles(path_to_dir)
+    full = timeit(lambda: loader.loadFiles(files), 1)
+    report("full load", full)
+    for step in steps:
+        progressiveLoader = ProgressiveLoader(loader, step)
+        start = time.perf_counter()
+        (volume, coarseVolume, paths) = progressiveLoader.loadCoarse(files)
+        firstFrame = time.perf_counter() - start
+        progressiveLoader.fillInBackground(volume, paths, lambda volume: None)
+        progressiveLoader.wait()
+        total = time.perf_counter() - start
+        print("step {:<3} first frame {:8.3f} s ({:5.1f}% of full)   complete {:8.3f} s".format(step, firstFrame, 100*firstFrame/min(full), total))
+
+def benchmarkFirstPaint(path_to_dir: str) -> None:
+    loader = ParallelDICOMLoader()
+    files = listDicomFiles(path_to_dir)
+    full = timeit(lambda: loader.loadFiles(files), 1)
+    report("full load", full)
+    firstPaintLoader = FirstPaintLoader(loader)
+    start = time.perf_counter()
+    (volume, planeVolumes, paths) = firstPaintLoader.loadInitialPlanes(files)
+    firstFrame = time.perf_counter() - start
+    firstPaintLoader.loadInBackground(volume, paths, lambda volume: None)
+    firstPaintLoader.wait()
+    total = time.perf_counter() - start
+    print("first paint {:8.3f} s ({:5.1f}% of full)   complete {:8.3f} s".format(firstFrame, 100*firstFrame/min(full), total))
+    # The partial reads must match the corresponding planes of the full volume
+    for (name, planeVolume) in zip(("axial", "coronal", "sagittal"), planeVolumes):
+        (ox, oy, oz) = [int(round((planeVolume.origin[i] - volume.origin[i])/volume.spacing[i])) for i in range(3)]
+        (nz, ny, nx) = planeVolume.array.shape
+        difference = np.abs(volume.array[oz:oz + nz, oy:oy + ny, ox:ox + nx].astype(np.float64) - planeVolume.array).max()
+        print("{:<9} max abs difference {}".format(name, difference))
+
+def orthogonalAxes(center: Tuple[float, float, float]) -> List[vtk.vtkMatrix4x4]:
+    # Same axial, coronal and sagittal orientations as MPRViewer.show3DMPR
+    elements = [
+        (1, 0, 0, center[0], 0, 1, 0, center[1], 0, 0, 1, center[2], 0, 0, 0, 1),
+        (1, 0, 0, center[0], 0, 0, 1, center[1], 0, -1, 0, center[2], 0, 0, 0, 1),
+        (0, 0, -1, center[0], 1, 0, 0, center[1], 0, -1, 0, center[2], 0, 0, 0, 1)
+    ]
+    matrices = []
+    for element in elements:
+        matrix = vtk.vtkMatrix4x4()
+        matrix.DeepCopy(element)
+        matrices.append(matrix)
+    return matrices
+
+def benchmarkSliceLatency(reslice: object, data: object, bounds: Tuple, steps: int = 20) -> List[float]:
+    # Moves the three planes through the volume like a crosshair drag and times every update
+    (xMin, xMax, yMin, yMax, zMin, zMax) = bounds
+    timings = []
+    for step in range(steps):
+        t = (step + 0.5) / steps
+        center = (xMin + t*(xMax - xMin), yMin + t*(yMax - yMin), zMin + t*(zMax - zMin))
+        for matrix in orthogonalAxes(center):
+            reslice.SetInputData(data)
+            reslice.SetOutputDimensionality(2)
+            reslice.SetResliceAxes(matrix)
+            reslice.SetInterpolationModeToLinear()
+            start = time.perf_counter()
+            reslice.Update()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+def peakMemoryMB() -> float:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def benchmarkBrickedVolume(path_to_dir: str, brick_dir: str, cache_bytes: int = 128*1024*1024) -> None:
+    files = listDicomFiles(path_to_dir)
+    start = time.perf_counter()
+    BrickedVolumeStore.build(brick_dir, files, ParallelDICOMLoader()).close()
+    print("build {:8.3f} s   peak rss {:8.1f} MB".format(time.perf_counter() - start, peakMemoryMB()))
+    store = BrickedVolumeStore(brick_dir, BrickCache(cache_bytes))
+    geometry = store.toGeometryImageData()
+    timings = benchmarkSliceLatency(PythonImageReslice(), store, geometry.GetBounds())
+    print("slice latency p50 {:6.1f} ms   p95 {:6.1f} ms   max {:6.1f} ms".format(
+        1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95), 1000*max(timings)))
+    print("brick cache {:.1f} MB   hits {}   misses {}   peak rss {:8.1f} MB".format(
+        store.cache.bytes/1024/1024, store.cache.hits, store.cache.misses, peakMemoryMB()))
+
+def benchmarkCompressedCodecs(paths_to_dirs: List[str], workers: List[int] = [1, 4, 8]) -> None:
+    # One directory per transfer syntax, e.g. the same series transcoded with each codec
+    for path_to_dir in paths_to_dirs:
+        files = listDicomFiles(path_to_dir)
+        codec = codecName(readTransferSyntax(files[0]))
+        for numWorkers in workers:
+            loader = CompressedDICOMLoader(num_workers=numWorkers)
+            start = time.perf_counter()
+            volume = loader.loadFiles(files)
+            elapsed = time.perf_counter() - start
+            (nz, ny, nx) = volume.array.shape
+            print("{:<14} workers {:<3} {:8.3f} s   {:8.1f} frames/s   {:8.1f} MVoxel/s".format(
+                codec, numWorkers, elapsed, nz/elapsed, nz*ny*nx/elapsed/1e6))
+
+def benchmarkDICOMweb(path_to_dir: str, in_flight: List[int] = [1, 4, 8, 16]) -> None:
+    # Serves the folder from a local stand-in DICOMweb server and compares retrieval concurrency
+    server = LocalDICOMwebServer(path_to_dir)
+    server.start()
+    try:
+        (studyUid, seriesUid) = server.listSeries()[0]
+        for maxInFlight in in_flight:
+            retriever = WADORSRetriever(server.getBaseUrl(), max_in_flight=maxInFlight)
+            ingestor = DicomByteIngestor()
+            start = time.perf_counter()
+            retriever.retrieveSeries(studyUid, seriesUid, ingestor)
+            volume = ingestor.buildVolume()
+            elapsed = time.perf_counter() - start
+            retriever.close()
+            ingestor.close()
+            print("in flight {:<3} {:8.3f} s   {} slices".format(maxInFlight, elapsed, volume.array.shape[0]))
+    finally:
+        server.stop()
+
+def benchmarkAutoCrop(path_to_dir: str, threshold: float = -500.0) -> None:
+    volume = ParallelDICOMLoader().loadDirectory(path_to_dir)
+    start = time.perf_counter()
+    (cropped, cropReport) = autoCropVolume(volume, threshold)
+    print("crop {:8.3f} s   box {}   {:.1f} MB -> {:.1f} MB ({:.1f}% saved)".format(
+        time.perf_counter() - start, cropReport["box"], cropReport["original_bytes"]/1024/1024,
+        cropReport["cropped_bytes"]/1024/1024, 100*cropReport["saved_fraction"]))
+    for (name, data) in (("original", volume.toImageData()), ("cropped", cropped.toImageData())):
+        timings = benchmarkSliceLatency(vtk.vtkImageReslice(), data, data.GetBounds())
+        print("{:<9} reslice p50 {:6.2f} ms   mean {:6.2f} ms".format(name, 1000*np.percentile(timings, 50), 1000*np.mean(timings)))
+
+def benchmarkStoredValues(path_to_dir: str) -> None:
+    # Stored integer voxels with lazy rescale against modality values (float32 whenever the rescale is fractional)
+    stored = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    modality = ParallelDICOMLoader().loadDirectory(path_to_dir)
+    floating = Volume(modality.array.astype(np.float32), modality.spacing, modality.origin, modality.direction)
+    for (name, volume) in (("float32", floating), ("modality " + modality.array.dtype.name, modality), ("stored " + stored.array.dtype.name, stored)):
+        data = volume.toImageData()
+        timings = benchmarkSliceLatency(vtk.vtkImageReslice(), data, data.GetBounds())
+        print("{:<16} {:8.1f} MB   reslice p50 {:6.2f} ms   mean {:6.2f} ms".format(
+            name, volume.array.nbytes/1024/1024, 1000*np.percentile(timings, 50), 1000*np.mean(timings)))
+    difference = np.abs(stored.toModalityValues(stored.array.astype(np.float64)) - modality.array).max()
+    print("max abs difference after lazy rescale {}".format(difference))
+
+def benchmarkPyramid(path_to_dir: str, factors: Tuple[int, ...] = (2, 4)) -> None:
+    volume = ParallelDICOMLoader().loadDirectory(path_to_dir)
+    start = time.perf_counter()
+    pyramid = VolumePyramid(volume, factors).build()
+    print("pyramid build {:8.3f} s   extra {:.1f} MB on {:.1f} MB".format(
+        time.perf_counter() - start, pyramid.getNumberOfBytes()/1024/1024, volume.array.nbytes/1024/1024))
+    for level in range(pyramid.getNumberOfLevels()):
+        data = pyramid.getImageData(level)
+        timings = benchmarkSliceLatency(vtk.vtkImageReslice(), data, data.GetBounds())
+        print("level {} {:<14} reslice p50 {:6.2f} ms   p95 {:6.2f} ms".format(
+            level, str(pyramid.getLevel(level).array.shape), 1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95)))
+
+def privateMemoryMB() -> float:
+    # Pages only this process maps, shared memory segments attached by several processes are not included
+    total = 0
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            if line.startswith("Private_Clean:") or line.startswith("Private_Dirty:"):
+                total += int(line.split()[1])
+    return total / 1024
+
+def attachSharedVolume(registry_dir: str, key: str, path_to_dir: str) -> Tuple[float, float]:
+    registry = SharedVolumeRegistry(registry_dir)
+    start = time.perf_counter()
+    volume = registry.acquire(key, lambda: ParallelDICOMLoader().loadDirectory(path_to_dir))
+    elapsed = time.perf_counter() - start
+    reslice = vtk.vtkImageReslice()
+    data = volume.toImageData()
+    benchmarkSliceLatency(reslice, data, data.GetBounds(), steps=5)
+    memory = privateMemoryMB()
+    registry.release(key)
+    return (elapsed, memory)
+
+def benchmarkSharedVolumes(path_to_dir: str, registry_dir: str, viewers: int = 4) -> None:
+    # Every worker process stands for one viewer session of the same study
+    from concurrent.futures import ProcessPoolExecutor
+    key = sharedVolumeKey(path_to_dir)
+    owner = SharedVolumeRegistry(registry_dir)
+    volume = owner.acquire(key, lambda: ParallelDICOMLoader().loadDirectory(path_to_dir))
+    print("study {:.1f} MB, published by the first viewer".format(volume.array.nbytes/1024/1024))
+    with ProcessPoolExecutor(max_workers=viewers) as executor:
+        futures = [executor.submit(attachSharedVolume, registry_dir, key, path_to_dir) for _ in range(viewers)]
+        for (index, future) in enumerate(futures):
+            (elapsed, memory) = future.result()
+            print("viewer {:<3} attach {:8.4f} s   private {:8.1f} MB".format(index, elapsed, memory))
+    print("references left {}".format(owner.getReferenceCount(key)))
+    owner.release(key)
+
+def benchmarkStudyCache(paths_to_dirs: List[str], max_bytes: int = 1024*1024*1024) -> None:
+    # Opens the studies round-robin twice, the second round is served from memory as far as the budget allows
+    cache = StudyCache(max_bytes)
+    loader = ParallelDICOMLoader()
+    for run in range(2):
+        for path_to_dir in paths_to_dirs:
+            key = studyKey(path_to_dir)
+            fingerprint = directoryFingerprint(path_to_dir)
+            start = time.perf_counter()
+            entry = cache.get(key, fingerprint)
+            if entry is None:
+                volume = loader.loadDirectory(path_to_dir)
+                entry = StudyEntry(volume.toImageData(), fingerprint, (volume.rescaleSlope, volume.rescaleIntercept))
+                cache.put(key, entry)
+            print("round {} {:<40} {:8.3f} s".format(run, path_to_dir[-40:], time.perf_counter() - start))
+    print(cache.getStatistics())
+
+def benchmarkCompressedBricks(path_to_dir: str, brick_sizes: List[int] = [16, 32, 64], cache_bytes: int = 64*1024*1024) -> None:
+    # Compression ratio, build time and per-slice latency of in-RAM compressed bricks per available codec
+    volume = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    data = volume.toImageData()
+    timings = benchmarkSliceLatency(vtk.vtkImageReslice(), data, data.GetBounds())
+    print("uncompressed {:8.1f} MB   vtkImageReslice p50 {:6.1f} ms".format(volume.array.nbytes/1024/1024, 1000*np.percentile(timings, 50)))
+    for name in [codec for codec in ("blosc", "zstd", "zlib") if BrickCodec.isAvailable(codec)]:
+        for brickSize in brick_sizes:
+            start = time.perf_counter()
+            bricks = CompressedBrickVolume.fromVolume(volume, brickSize, BrickCodec(name), BrickCache(cache_bytes))
+            elapsed = time.perf_counter() - start
+            timings = benchmarkSliceLatency(PythonImageReslice(), bricks, bricks.toGeometryImageData().GetBounds())
+            print("{:<6} brick {:<3} ratio {:5.2f}   {:8.1f} MB   build {:6.2f} s   slice p50 {:6.1f} ms   p95 {:6.1f} ms   hit rate {:5.1f}%".format(
+                name, brickSize, bricks.getCompressionRatio(), bricks.getNumberOfBytes()/1024/1024, elapsed,
+                1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95),
+                100*bricks.cache.hits/max(1, bricks.cache.hits + bricks.cache.misses)))
+
+def benchmarkMinMaxIndex(path_to_dir: str, brick_sizes: List[int] = [8, 16, 32], thickness: int = 40, window: Tuple[float, float] = (400.0, 40.0)) -> None:
+    # Slab MIP and histogram queries with and without the brick index, results must match exactly
+    volume = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    (nz, _, _) = volume.array.shape
+    (z0, z1) = (max(0, nz//2 - thickness//2), min(nz, nz//2 + thickness//2))
+    (width, center) = window
+    floor = int(np.floor(volume.toStoredValues(center - width/2)))
+    (low, high) = (volume.toStoredValues(150.0), volume.toStoredValues(3000.0))
+    mipBaseline = min(timeit(lambda: np.maximum(volume.array[z0:z1].max(axis=0), floor)))
+    histogramBaseline = min(timeit(lambda: np.histogram(volume.array, 256, (low, high))))
+    print("slab MIP {} slices {:8.3f} s   histogram [150, 3000] HU {:8.3f} s".format(z1 - z0, mipBaseline, histogramBaseline))
+    for brickSize in brick_sizes:
+        start = time.perf_counter()
+        index = MinMaxBrickIndex.fromVolume(volume, brickSize)
+        elapsed = time.perf_counter() - start
+        assert np.array_equal(slabMaximumIntensity(volume.array, index, z0, z1, floor), np.maximum(volume.array[z0:z1].max(axis=0), floor))
+        assert np.array_equal(histogramInRange(volume.array, index, 256, (low, high))[0], np.histogram(volume.array, 256, (low, high))[0])
+        skipped = 1 - index.findBricks(low, high).mean()
+        print("brick {:<3} build {:6.3f} s   {:6.1f} KB   bricks skipped by histogram {:5.1f}%".format(brickSize, elapsed, index.getNumberOfBytes()/1024, 100*skipped))
+        report("  slab MIP (windowed)", timeit(lambda: slabMaximumIntensity(volume.array, index, z0, z1, floor)), mipBaseline)
+        report("  histogram", timeit(lambda: histogramInRange(volume.array, index, 256, (low, high))), histogramBaseline)
+
+def benchmarkHistogram(path_to_dir: str, workers: List[int] = [1, 2, 4, 8]) -> None:
+    # One-time histogram build against a full-volume percentile scan per window/level query
+    volume = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    scan = min(timeit(lambda: np.percentile(volume.array, [1, 99])))
+    print("np.percentile full scan {:8.3f} s".format(scan))
+    for numWorkers in workers:
+        report("histogram build, {} workers".format(numWorkers), timeit(lambda: VolumeHistogram.fromVolume(volume, numWorkers)), scan)
+    histogram = VolumeHistogram.fromVolume(volume)
+    expected = volume.toModalityValues(np.percentile(volume.array, [1, 99]))
+    print("p1/p99 from table {:.1f} / {:.1f}   exact {:.1f} / {:.1f}   {} bins".format(histogram.getPercentile(1), histogram.getPercentile(99), expected[0], expected[1], len(histogram.counts)))
+    report("auto window/level query", timeit(histogram.getAutoWindowLevel, repeat=100), scan)
+
+def benchmarkPhasePlayback(path_to_dir: str, loops: int = 3) -> None:
+    # Loops over the phases with fixed orthogonal planes, the input swap is all that changes per frame
+    start = time.perf_counter()
+    phases = MultiPhaseLoader(ParallelDICOMLoader(keep_stored_values=True)).loadDirectory(path_to_dir)
+    print("{} phases   {:8.1f} MB   load {:6.2f} s".format(phases.getNumberOfPhases(), phases.getNumberOfBytes()/1024/1024, time.perf_counter() - start))
+    data = [phases.getImageData(phase) for phase in range(phases.getNumberOfPhases())]
+    matrices = orthogonalAxes(data[0].GetCenter())
+    cache = SliceCache(256*1024*1024)
+    for (name, create) in [("vtkImageReslice", vtk.vtkImageReslice), ("CachedReslice", lambda: CachedReslice(cache))]:
+        reslices = [create() for _ in matrices]
+        for (reslice, matrix) in zip(reslices, matrices):
+            reslice.SetOutputDimensionality(2)
+            reslice.SetResliceAxes(matrix)
+            reslice.SetInterpolationModeToLinear()
+        for loop in range(loops):
+            timings = []
+            for imageData in data:
+                start = time.perf_counter()
+                for reslice in reslices:
+                    reslice.SetInputData(imageData)
+                    reslice.Update()
+                timings.append(time.perf_counter() - start)
+            print("{:<20} loop {}   frame p50 {:6.2f} ms   p95 {:6.2f} ms".format(name, loop, 1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95)))
+    print(cache.getStatistics())
+
+def obliqueAxes(center: Tuple[float, float, float], angles: Tuple[float, float, float] = (30.0, 20.0, 10.0)) -> vtk.vtkMatrix4x4:
+    # Axial orientation rotated about x, y and z, centered on center
+    transform = vtk.vtkTransform()
+    transform.Translate(center)
+    transform.RotateX(angles[0])
+    transform.RotateY(angles[1])
+    transform.RotateZ(angles[2])
+    return transform.GetMatrix()
+
+def syntheticImageData(dimensions: Tuple[int, int, int] = (97, 83, 41), spacing: Tuple[float, float, float] = (0.7, 0.7, 2.5), origin: Tuple[float, float, float] = (-33.6, 12.0, -80.0)) -> vtk.vtkImageData:
+    # CT-like int16 volume for checks that run without a study: air around an ellipsoid holding a
+    # ramp and a bright slab, odd dimensions and anisotropic spacing
+    (nx, ny, nz) = dimensions
+    (z, y, x) = np.mgrid[0:nz, 0:ny, 0:nx].astype(np.float32)
+    inside = ((x - nx/2)/(0.4*nx))**2 + ((y - ny/2)/(0.35*ny))**2 + ((z - nz/2)/(0.45*nz))**2 <= 1
+    array = np.where(inside, 40 + 8*x - 5*y + 11*z, -1000).astype(np.int16)
+    array[nz//3:nz//2, ny//4:ny//3, :] = 1200
+    return Volume(array, spacing, origin).toImageData()
+
+def checkResliceEquivalence(data: Optional[vtk.vtkImageData] = None, tolerance: float = 1.0) -> None:
+    # Every engine must reproduce vtkImageReslice up to integer rounding, for orthogonal and oblique
+    # planes and both interpolation modes (on a synthetic volume unless data is given)
+    if data is None:
+        data = syntheticImageData()
+    (xMin, xMax, yMin, yMax, zMin, zMax) = data.GetBounds()
+    centers = [data.GetCenter(), (xMin + 0.3*(xMax - xMin), yMin + 0.6*(yMax - yMin), zMin + 0.25*(zMax - zMin))]
+    matrices = [matrix for center in centers for matrix in orthogonalAxes(center) + [obliqueAxes(center)]]
+    for mode in [vtk.VTK_RESLICE_NEAREST, vtk.VTK_RESLICE_LINEAR]:
+        for matrix in matrices:
+            reference = vtk.vtkImageReslice()
+            reference.SetInputData(data)
+            reference.SetOutputDimensionality(2)
+            reference.SetResliceAxes(matrix)
+            reference.SetInterpolationMode(mode)
+            reference.Update()
+            expected = numpy_support.vtk_to_numpy(reference.GetOutput().GetPointData().GetScalars()).astype(np.float64)
+            for name in RESLICE_ENGINES:
+                reslice = PythonImageReslice(createResliceEngine(name))
+                reslice.SetInputData(data)
+                reslice.SetOutputDimensionality(2)
+                reslice.SetResliceAxes(matrix)
+                reslice.SetInterpolationMode(mode)
+                reslice.Update()
+                output = reslice.GetOutput()
+                assert output.GetDimensions() == reference.GetOutput().GetDimensions(), name
+                actual = numpy_support.vtk_to_numpy(output.GetPointData().GetScalars()).astype(np.float64)
+                difference = np.abs(actual - expected)
+                # Nearest neighbour may pick the other voxel for samples exactly half way
+                mismatches = (difference > tolerance).mean()
+                assert mismatches <= (0.001 if mode == vtk.VTK_RESLICE_NEAREST else 0.0), (name, mode, difference.max())
+    print("reslice engines equivalent on {} planes, tolerance {}".format(len(matrices), tolerance))
+
+def benchmarkResliceEngines(path_to_dir: str, steps: int = 20) -> None:
+    volume = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    data = volume.toImageData()
+    checkResliceEquivalence(data)
+    baseline = benchmarkSliceLatency(vtk.vtkImageReslice(), data, data.GetBounds(), steps)
+    print("{:<24} slice p50 {:6.1f} ms   p95 {:6.1f} ms".format("vtkImageReslice", 1000*np.percentile(baseline, 50), 1000*np.percentile(baseline, 95)))
+    for name in RESLICE_ENGINES:
+        timings = benchmarkSliceLatency(PythonImageReslice(createResliceEngine(name)), data, data.GetBounds(), steps)
+        print("{:<24} slice p50 {:6.1f} ms   p95 {:6.1f} ms".format("engine " + name, 1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95)))
+
+def benchmarkSliceCache(path_to_dir: str, window: int = 10, sweeps: int = 6, cache_bytes: int = 32*1024*1024) -> None:
+    # Wheel scrolling back and forth over the same window of axial slices, one slice spacing per step
+    volume = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    data = volume.toImageData()
+    center = data.GetCenter()
+    sliceSpacing = data.GetSpacing()[2]
+    steps = list(range(window)) + list(range(window - 1, -1, -1))
+    cache = SliceCache(cache_bytes)
+    for (name, reslice) in [("vtkImageReslice", vtk.vtkImageReslice()), ("CachedReslice", CachedReslice(cache))]:
+        matrix = orthogonalAxes(center)[0]
+        reslice.SetInputData(data)
+        reslice.SetOutputDimensionality(2)
+        reslice.SetResliceAxes(matrix)
+        reslice.SetInterpolationModeToLinear()
+        timings = []
+        for _ in range(sweeps):
+            for step in steps:
+                # The tiny drift stands in for the rounding the wheel handlers accumulate
+                matrix.SetElement(2, 3, center[2] + (step - window/2)*sliceSpacing + 1e-9*len(timings))
+                start = time.perf_counter()
+                reslice.Update()
+                timings.append(time.perf_counter() - start)
+        print("{:<16} step p50 {:6.2f} ms   p95 {:6.2f} ms".format(name, 1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95)))
+    print(cache.getStatistics())
+
+def benchmarkWheelLatency(path_to_dir: str, steps: int = 20) -> None:
+    # Wheel steps of one voxel along the axial, coronal and sagittal normals, starting either on a
+    # voxel plane (served as views on the volume) or a third of a voxel off it (interpolated)
+    volume = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    data = volume.toImageData()
+    (origin, spacing) = (data.GetOrigin(), data.GetSpacing())
+    onGrid = [origin[i] + round((data.GetCenter()[i] - origin[i]) / spacing[i])*spacing[i] for i in range(3)]
+    offGrid = [onGrid[i] + spacing[i]/3 for i in range(3)]
+    reslices = [
+        ("vtkImageReslice", lambda: vtk.vtkImageReslice()),
+        ("PythonImageReslice", lambda: PythonImageReslice(createResliceEngine("numpy"))),
+        ("CachedReslice", lambda: CachedReslice(SliceCache(0)))
+    ]
+    for (name, createReslice) in reslices:
+        for (label, center) in (("off-grid", offGrid), ("on-grid", onGrid)):
+            timings = []
+            # Axial moves along z, coronal along y, sagittal along x
+            for (matrix, axis) in zip(orthogonalAxes(center), (2, 1, 0)):
+                reslice = createReslice()
+                reslice.SetInputData(data)
+                reslice.SetOutputDimensionality(2)
+                reslice.SetResliceAxes(matrix)
+                reslice.SetInterpolationModeToLinear()
+                reslice.Update()
+                for step in range(1, steps + 1):
+                    matrix.SetElement(axis, 3, center[axis] + (step - steps/2)*spacing[axis])
+                    start = time.perf_counter()
+                    reslice.Update()
+                    timings.append(time.perf_counter() - start)
+            print("{:<20} {:<8} step p50 {:7.3f} ms   p95 {:7.3f} ms".format(name, label, 1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95)))
+
+def benchmarkInterpolationModes(path_to_dir: str, steps: int = 20) -> None:
+    # Latency of an oblique plane per interpolation mode, the viewer renders drags and wheel bursts
+    # with the interactive mode and refines to the slower one once the input is idle
+    volume = ParallelDICOMLoader(keep_stored_values=True).loadDirectory(path_to_dir)
+    data = volume.toImageData()
+    center = data.GetCenter()
+    normalSpacing = min(data.GetSpacing())
+    for (name, mode) in (("nearest", vtk.VTK_RESLICE_NEAREST), ("linear", vtk.VTK_RESLICE_LINEAR), ("cubic", vtk.VTK_RESLICE_CUBIC)):
+        matrix = obliqueAxes(center)
+        reslice = vtk.vtkImageReslice()
+        reslice.SetInputData(data)
+        reslice.SetOutputDimensionality(2)
+        reslice.SetResliceAxes(matrix)
+        reslice.SetInterpolationMode(mode)
+        reslice.Update()
+        timings = []
+        for step in range(1, steps + 1):
+            # Move along the plane normal (third column of the axes)
+            for i in range(3):
+                matrix.SetElement(i, 3, center[i] + (step - steps/2)*normalSpacing*matrix.GetElement(i, 2))
+            start = time.perf_counter()
+            reslice.Update()
+            timings.append(time.perf_counter() - start)
+        print("{:<8} step p50 {:7.3f} ms   p95 {:7.3f} ms".format(name, 1000*np.percentile(timings, 50), 1000*np.percentile(timings, 95)))
+
+if __name__ == "__main__":
+    # 1601 dicoms
+    path1 = "D:/workingspace/Python/dicom-data/1.2.840.113619.2.25.4.20352545.1711599249.29"
+    # 281 dicoms
+    path2 = "D:/workingspace/Python/dicom-data/220277460 Nguyen Thanh Dat"
+    benchmarkDICOMLoaders(path1)
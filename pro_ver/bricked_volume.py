@@ -0,0 +1,328 @@
+# Volumes stored as fixed-size compressed bricks (on disk or in RAM), with a bounded cache of decompressed bricks
+
+import os
+import json
+import zlib
+import itertools
+import threading
+import vtk
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, List, Tuple, Optional
+from volume_loader import ParallelDICOMLoader, Volume, volumeGeometry
+from minmax_index import MinMaxBrickIndex, brickRanges
+
+# Cache keys of a volume: unlike id(), a token is never handed to a later volume, whose bricks
+# would otherwise be served from the entries the dropped volume left in a shared cache
+volumeTokens = itertools.count()
+
+class BrickCache(object):
+    def __init__(self, max_bytes: int = 256*1024*1024) -> None:
+        self.maxBytes = max_bytes
+        self.bytes = 0
+        self.bricks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: object, load: Callable[[], np.ndarray]) -> np.ndarray:
+        with self.lock:
+            brick = self.bricks.get(key)
+            if brick is not None:
+                self.bricks.move_to_end(key)
+                self.hits += 1
+                return brick
+            self.misses += 1
+        brick = load()
+        with self.lock:
+            if key not in self.bricks:
+                self.bricks[key] = brick
+                self.bytes += brick.nbytes
+            while self.bytes > self.maxBytes and len(self.bricks) > 1:
+                (_, evicted) = self.bricks.popitem(last=False)
+                self.bytes -= evicted.nbytes
+        return brick
+
+    def clear(self) -> None:
+        with self.lock:
+            self.bricks.clear()
+            self.bytes = 0
+
+def shuffleBytes(array: np.ndarray) -> bytes:
+    # Groups the n-th byte of every voxel together, the high bytes of CT values are nearly constant
+    # and compress far better that way
+    return np.ascontiguousarray(array).view(np.uint8).reshape(-1, array.dtype.itemsize).T.tobytes()
+
+def unshuffleBytes(data: bytes, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+class BrickCodec(object):
+    # Lossless brick compression: blosc or zstd when installed, zlib otherwise
+    def __init__(self, name: Optional[str] = None, level: Optional[int] = None) -> None:
+        if name is None:
+            name = next(codec for codec in ("blosc", "zstd", "zlib") if BrickCodec.isAvailable(codec))
+        if not BrickCodec.isAvailable(name):
+            raise ValueError("Brick codec {} is not available".format(name))
+        self.name = name
+        self.level = level
+
+    @staticmethod
+    def isAvailable(name: str) -> bool:
+        try:
+            if name == "blosc":
+                import blosc
+            elif name == "zstd":
+                import zstandard
+            elif name != "zlib":
+                return False
+        except ImportError:
+            return False
+        return True
+
+    def compress(self, array: np.ndarray) -> bytes:
+        if self.name == "blosc":
+            import blosc
+            # blosc shuffles internally
+            return blosc.compress(np.ascontiguousarray(array).tobytes(), typesize=array.dtype.itemsize, clevel=self.level or 5, shuffle=blosc.SHUFFLE, cname="zstd")
+        if self.name == "zstd":
+            import zstandard
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(shuffleBytes(array))
+        return zlib.compress(shuffleBytes(array), self.level or 1)
+
+    def decompress(self, data: bytes, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+        if self.name == "blosc":
+            import blosc
+            return np.frombuffer(blosc.decompress(data), dtype=dtype).reshape(shape)
+        if self.name == "zstd":
+            import zstandard
+            return unshuffleBytes(zstandard.ZstdDecompressor().decompress(data), dtype, shape)
+        return unshuffleBytes(zlib.decompress(data), dtype, shape)
+
+class BrickedVolume(object):
+    # Sampler over brick_size^3 bricks (edge bricks zero padded) fetched through a shared cache of
+    # decompressed bricks; subclasses define where the compressed bricks live
+    def __init__(self, shape: Tuple[int, int, int], dtype: np.dtype, brick_size: int, spacing: Tuple, origin: Tuple, cache: Optional[BrickCache] = None) -> None:
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.brickSize = int(brick_size)
+        (nz, ny, nx) = self.shape
+        b = self.brickSize
+        self.bricksPerAxis = (-(-nx // b), -(-ny // b), -(-nz // b))
+        self.spacing = tuple(float(v) for v in spacing)
+        self.origin = tuple(float(v) for v in origin)
+        self.rescaleSlope = 1.0
+        self.rescaleIntercept = 0.0
+        self.cache = cache if cache is not None else BrickCache()
+        self.token = next(volumeTokens)
+        # Per-brick value ranges when known, bricks holding a single value are never decompressed
+        self.minMaxIndex = None
+
+    def getDimensions(self) -> Tuple[int, int, int]:
+        (nz, ny, nx) = self.shape
+        return (nx, ny, nz)
+
+    def getExtent(self) -> Tuple[int, int, int, int, int, int]:
+        (nx, ny, nz) = self.getDimensions()
+        return (0, nx - 1, 0, ny - 1, 0, nz - 1)
+
+    def getOrigin(self) -> Tuple[float, float, float]:
+        return self.origin
+
+    def getSpacing(self) -> Tuple[float, float, float]:
+        return self.spacing
+
+    def toGeometryImageData(self) -> vtk.vtkImageData:
+        # Scalar-free image so GetCenter/GetBounds work in show3DMPR
+        imageData = vtk.vtkImageData()
+        imageData.SetDimensions(self.getDimensions())
+        imageData.SetSpacing(self.getSpacing())
+        imageData.SetOrigin(self.getOrigin())
+        return imageData
+
+    def readBrick(self, brickId: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def getBrick(self, brickId: int) -> np.ndarray:
+        return self.cache.get((self.token, brickId), lambda: self.readBrick(brickId))
+
+    def sampleVoxels(self, ix: np.ndarray, iy: np.ndarray, iz: np.ndarray) -> np.ndarray:
+        # Only the bricks containing requested voxels are fetched, each exactly once
+        b = self.brickSize
+        (bricksX, bricksY, _) = self.bricksPerAxis
+        brickIds = ((iz // b) * bricksY + iy // b) * bricksX + ix // b
+        order = np.argsort(brickIds, kind="stable")
+        sortedIds = brickIds[order]
+        (uniqueIds, starts) = np.unique(sortedIds, return_index=True)
+        ends = list(starts[1:]) + [len(sortedIds)]
+        values = np.empty(len(brickIds), dtype=self.dtype)
+        if self.minMaxIndex is not None:
+            (minimum, maximum) = [level.reshape(-1) for level in self.minMaxIndex.levels[0]]
+        for (brickId, start, end) in zip(uniqueIds, starts, ends):
+            selection = order[start:end]
+            if self.minMaxIndex is not None and minimum[brickId] == maximum[brickId]:
+                values[selection] = minimum[brickId]
+                continue
+            brick = self.getBrick(int(brickId))
+            values[selection] = brick[iz[selection] % b, iy[selection] % b, ix[selection] % b]
+        return values
+
+class BrickedVolumeStore(BrickedVolume):
+    # Bricks are zlib compressed and appended to one data file; a JSON sidecar holds the geometry
+    # and the offset of every brick
+    def __init__(self, directory: str, cache: Optional[BrickCache] = None) -> None:
+        self.directory = directory
+        with open(os.path.join(directory, "bricks.json"), "r") as file:
+            self.header = json.load(file)
+        BrickedVolume.__init__(self, self.header["shape"], self.header["dtype"], self.header["brick_size"], self.header["spacing"], self.header["origin"], cache)
+        self.offsets = self.header["offsets"]
+        self.lengths = self.header["lengths"]
+        (self.rescaleSlope, self.rescaleIntercept) = self.header.get("rescale", [1.0, 0.0])
+        if "minimum" in self.header:
+            shape = tuple(reversed(self.bricksPerAxis))
+            self.minMaxIndex = MinMaxBrickIndex(np.array(self.header["minimum"], dtype=self.dtype).reshape(shape), np.array(self.header["maximum"], dtype=self.dtype).reshape(shape), self.brickSize, self.shape)
+        self.file = open(os.path.join(directory, "bricks.dat"), "rb")
+        self.fileLock = threading.Lock()
+
+    @staticmethod
+    def exists(directory: str, fingerprint: Optional[str] = None) -> bool:
+        path = os.path.join(directory, "bricks.json")
+        if not os.path.exists(path):
+            return False
+        with open(path, "r") as file:
+            return fingerprint is None or json.load(file).get("fingerprint") == fingerprint
+
+    @staticmethod
+    def build(directory: str, paths: List[str], loader: ParallelDICOMLoader, brick_size: int = 64, fingerprint: Optional[str] = None, level: int = 1) -> "BrickedVolumeStore":
+        # Decodes one slab of brick_size slices at a time, so memory stays flat for any series length
+        os.makedirs(directory, exist_ok=True)
+        (paths, headers) = loader.readHeaders(paths)
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found")
+        (spacing, origin, direction) = volumeGeometry(headers)
+        dtype = loader.getVolumeDtype(headers)
+        (slope, intercept) = loader.getVolumeRescale(headers)
+        (nx, ny, nz) = (int(headers[0].Columns), int(headers[0].Rows), len(paths))
+        b = brick_size
+        bricksPerAxis = (-(-nx // b), -(-ny // b), -(-nz // b))
+        offsets = []
+        lengths = []
+        ranges = []
+        dataPath = os.path.join(directory, "bricks.dat")
+        with open(dataPath + ".tmp", "wb") as file:
+            for bz in range(bricksPerAxis[2]):
+                slabPaths = paths[bz*b:(bz + 1)*b]
+                slab = np.zeros((b, bricksPerAxis[1]*b, bricksPerAxis[0]*b), dtype=dtype)
+                slabVolume = Volume(slab[:len(slabPaths), :ny, :nx], spacing, origin)
+                slabVolume.setRescale(slope, intercept)
+                loader.decodeInto(slabVolume, slabPaths)
+                ranges.append(brickRanges(slabVolume.array, b))
+                for by in range(bricksPerAxis[1]):
+                    for bx in range(bricksPerAxis[0]):
+                        data = zlib.compress(np.ascontiguousarray(slab[:, by*b:(by + 1)*b, bx*b:(bx + 1)*b]).tobytes(), level)
+                        offsets.append(file.tell())
+                        lengths.append(len(data))
+                        file.write(data)
+        header = {
+            "fingerprint": fingerprint,
+            "shape": [nz, ny, nx],
+            "dtype": dtype.str,
+            "spacing": list(spacing),
+            "origin": list(origin),
+            "direction": list(direction),
+            "rescale": [slope, intercept],
+            "brick_size": b,
+            "bricks_per_axis": list(bricksPerAxis),
+            "offsets": offsets,
+            "lengths": lengths,
+            "minimum": np.concatenate([r[0] for r in ranges]).reshape(-1).tolist(),
+            "maximum": np.concatenate([r[1] for r in ranges]).reshape(-1).tolist()
+        }
+        with open(os.path.join(directory, "bricks.json.tmp"), "w") as file:
+            json.dump(header, file)
+        os.replace(dataPath + ".tmp", dataPath)
+        os.replace(os.path.join(directory, "bricks.json.tmp"), os.path.join(directory, "bricks.json"))
+        return BrickedVolumeStore(directory)
+
+    def close(self) -> None:
+        self.file.close()
+        self.cache.clear()
+
+    def readBrick(self, brickId: int) -> np.ndarray:
+        with self.fileLock:
+            self.file.seek(self.offsets[brickId])
+            data = self.file.read(self.lengths[brickId])
+        b = self.brickSize
+        return np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape(b, b, b)
+
+class CompressedBrickVolume(BrickedVolume):
+    # Whole volume held in RAM as losslessly compressed bricks, decompressed on demand
+    def __init__(self, shape: Tuple[int, int, int], dtype: np.dtype, brick_size: int, spacing: Tuple, origin: Tuple, direction: Tuple, bricks: List[bytes], codec: BrickCodec, cache: Optional[BrickCache] = None) -> None:
+        BrickedVolume.__init__(self, shape, dtype, brick_size, spacing, origin, cache)
+        self.direction = tuple(direction)
+        self.bricks = bricks
+        self.codec = codec
+
+    @staticmethod
+    def compressSlab(slab: np.ndarray, brick_size: int, codec: BrickCodec) -> List[bytes]:
+        # slab holds brick_size slices padded to whole bricks in y and x
+        b = brick_size
+        (_, height, width) = slab.shape
+        return [codec.compress(slab[:, by*b:(by + 1)*b, bx*b:(bx + 1)*b]) for by in range(height // b) for bx in range(width // b)]
+
+    @staticmethod
+    def fromVolume(volume: Volume, brick_size: int = 32, codec: Optional[BrickCodec] = None, cache: Optional[BrickCache] = None) -> "CompressedBrickVolume":
+        codec = codec if codec is not None else BrickCodec()
+        (nz, ny, nx) = volume.array.shape
+        b = brick_size
+        bricks = []
+        slab = np.zeros((b, -(-ny // b)*b, -(-nx // b)*b), dtype=volume.array.dtype)
+        for z0 in range(0, nz, b):
+            slab[...] = 0
+            slab[:min(b, nz - z0), :ny, :nx] = volume.array[z0:z0 + b]
+            bricks.extend(CompressedBrickVolume.compressSlab(slab, b, codec))
+        compressed = CompressedBrickVolume(volume.array.shape, volume.array.dtype, b, volume.spacing, volume.origin, volume.direction, bricks, codec, cache)
+        compressed.rescaleSlope = volume.rescaleSlope
+        compressed.rescaleIntercept = volume.rescaleIntercept
+        compressed.minMaxIndex = MinMaxBrickIndex.fromArray(volume.array, b)
+        return compressed
+
+    @staticmethod
+    def build(paths: List[str], loader: ParallelDICOMLoader, brick_size: int = 32, codec: Optional[BrickCodec] = None, cache: Optional[BrickCache] = None) -> "CompressedBrickVolume":
+        # Decodes one slab of brick_size slices at a time, the uncompressed volume never exists in full
+        codec = codec if codec is not None else BrickCodec()
+        (paths, headers) = loader.readHeaders(paths)
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found")
+        (spacing, origin, direction) = volumeGeometry(headers)
+        dtype = loader.getVolumeDtype(headers)
+        (slope, intercept) = loader.getVolumeRescale(headers)
+        (nx, ny, nz) = (int(headers[0].Columns), int(headers[0].Rows), len(paths))
+        b = brick_size
+        bricks = []
+        ranges = []
+        slab = np.zeros((b, -(-ny // b)*b, -(-nx // b)*b), dtype=dtype)
+        for z0 in range(0, nz, b):
+            slabPaths = paths[z0:z0 + b]
+            slab[...] = 0
+            slabVolume = Volume(slab[:len(slabPaths), :ny, :nx], spacing, origin)
+            slabVolume.setRescale(slope, intercept)
+            loader.decodeInto(slabVolume, slabPaths)
+            ranges.append(brickRanges(slabVolume.array, b))
+            bricks.extend(CompressedBrickVolume.compressSlab(slab, b, codec))
+        compressed = CompressedBrickVolume((nz, ny, nx), dtype, b, spacing, origin, direction, bricks, codec, cache)
+        compressed.rescaleSlope = slope
+        compressed.rescaleIntercept = intercept
+        compressed.minMaxIndex = MinMaxBrickIndex(np.concatenate([r[0] for r in ranges]), np.concatenate([r[1] for r in ranges]), b, (nz, ny, nx))
+        return compressed
+
+    def getNumberOfBytes(self) -> int:
+        return sum(len(brick) for brick in self.bricks)
+
+    def getCompressionRatio(self) -> float:
+        (nz, ny, nx) = self.shape
+        return nz*ny*nx*self.dtype.itemsize / max(1, self.getNumberOfBytes())
+
+    def readBrick(self, brickId: int) -> np.ndarray:
+        b = self.brickSize
+        return self.codec.decompress(self.bricks[brickId], self.dtype, (b, b, b))
@@ -0,0 +1,222 @@
+# Process-pool ingest for encapsulated (compressed) DICOM pixel data, one frame per task
+
+import os
+import mmap
+import weakref
+import numpy as np
+import pydicom
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Tuple, Optional
+from volume_loader import ParallelDICOMLoader, Volume, readSliceHeader, sortSlices, sliceNormal, storedDtype, volumeGeometry, rescaleParameters
+
+if os.name == "posix":
+    import _posixshmem
+
+JPEG_LOSSLESS = ["1.2.840.10008.1.2.4.57", "1.2.840.10008.1.2.4.70"]
+JPEG_LS = ["1.2.840.10008.1.2.4.80", "1.2.840.10008.1.2.4.81"]
+JPEG_2000 = ["1.2.840.10008.1.2.4.90", "1.2.840.10008.1.2.4.91"]
+RLE_LOSSLESS = ["1.2.840.10008.1.2.5"]
+COMPRESSED_TRANSFER_SYNTAXES = JPEG_LOSSLESS + JPEG_LS + JPEG_2000 + RLE_LOSSLESS
+
+def codecName(transfer_syntax: str) -> str:
+    for (name, syntaxes) in (("JPEG-Lossless", JPEG_LOSSLESS), ("JPEG-LS", JPEG_LS), ("JPEG2000", JPEG_2000), ("RLE", RLE_LOSSLESS)):
+        if transfer_syntax in syntaxes:
+            return name
+    return "uncompressed"
+
+def readTransferSyntax(path: str) -> str:
+    return str(pydicom.dcmread(path, stop_before_pixels=True, specific_tags=["SOPInstanceUID"]).file_meta.TransferSyntaxUID)
+
+def isMultiFrame(header: pydicom.Dataset) -> bool:
+    return int(header.get("NumberOfFrames", 1) or 1) > 1
+
+def readFrameHeader(path: str) -> Optional[pydicom.Dataset]:
+    header = readSliceHeader(path)
+    if header is not None:
+        return header
+    # Enhanced multi-frame objects carry position and spacing in functional groups instead
+    try:
+        header = pydicom.dcmread(path, stop_before_pixels=True)
+    except pydicom.errors.InvalidDicomError:
+        return None
+    if isMultiFrame(header) and "PerFrameFunctionalGroupsSequence" in header and "SharedFunctionalGroupsSequence" in header:
+        return header
+    return None
+
+def frameRescaleParameters(dataset: pydicom.Dataset) -> Tuple[float, float]:
+    # Enhanced multi-frame objects keep slope/intercept in the shared functional groups
+    if "RescaleSlope" not in dataset and "SharedFunctionalGroupsSequence" in dataset:
+        groups = dataset.SharedFunctionalGroupsSequence[0]
+        if "PixelValueTransformationSequence" in groups:
+            return rescaleParameters(groups.PixelValueTransformationSequence[0])
+    return rescaleParameters(dataset)
+
+def decodeFrame(path: str, frame: int, rescale: bool = True) -> np.ndarray:
+    try:
+        # pydicom >= 3 decodes a single frame without touching the others
+        from pydicom.pixels import pixel_array
+        pixels = pixel_array(path, index=frame)
+    except ImportError:
+        pixels = pydicom.dcmread(path).pixel_array
+        if pixels.ndim == 3:
+            pixels = pixels[frame]
+    if not rescale:
+        return np.flipud(pixels)
+    (slope, intercept) = frameRescaleParameters(pydicom.dcmread(path, stop_before_pixels=True))
+    if slope != 1 or intercept != 0:
+        pixels = pixels * slope + intercept
+    return np.flipud(pixels)
+
+def decodeFrameToArray(path: str, frame: int, dtype: str, rescale: bool = True) -> np.ndarray:
+    return decodeFrame(path, frame, rescale).astype(dtype, copy=False)
+
+def unlinkSharedMemory(sharedMemory: shared_memory.SharedMemory) -> None:
+    try:
+        sharedMemory.unlink()
+    except FileNotFoundError:
+        pass
+
+def mapSharedMemory(name: str, size: int, writable: bool = False) -> mmap.mmap:
+    # Mapping of an existing segment. Arrays created with np.frombuffer pin it, so it is unmapped
+    # with the last view of the voxels (VTK arrays wrapping them included). The buffer of a
+    # SharedMemory object is not pinned by np.ndarray and goes away with the object.
+    if os.name != "posix":
+        # Named file mapping, the same one SharedMemory opens on Windows
+        return mmap.mmap(-1, size, tagname=name, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+    fd = _posixshmem.shm_open("/" + name, os.O_RDWR if writable else os.O_RDONLY)
+    try:
+        return mmap.mmap(fd, size, prot=mmap.PROT_READ | mmap.PROT_WRITE if writable else mmap.PROT_READ)
+    finally:
+        os.close(fd)
+
+def decodeFrameToSharedMemory(path: str, frame: int, name: str, shape: Tuple[int, int, int], dtype: str, index: int, rescale: bool = True) -> None:
+    # Runs in a worker process: attach to the parent's volume buffer and write one slice in place
+    sharedMemory = shared_memory.SharedMemory(name=name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=sharedMemory.buf)
+        array[index] = decodeFrame(path, frame, rescale)
+        del array
+    finally:
+        sharedMemory.close()
+
+def framePositions(path: str, header: pydicom.Dataset) -> List[Tuple[float, int, Tuple]]:
+    # (distance along the slice normal, frame index, ImagePositionPatient) of every frame in a file
+    frames = int(header.get("NumberOfFrames", 1) or 1)
+    if frames == 1 or "PerFrameFunctionalGroupsSequence" not in header:
+        normal = sliceNormal(header.get("ImageOrientationPatient", [1, 0, 0, 0, 1, 0]))
+        position = [float(v) for v in header.ImagePositionPatient]
+        distance = sum(normal[i] * position[i] for i in range(3))
+        return [(distance, frame, tuple(position)) for frame in range(frames)]
+    orientation = header.SharedFunctionalGroupsSequence[0].PlaneOrientationSequence[0].ImageOrientationPatient
+    normal = sliceNormal(orientation)
+    positions = []
+    for (frame, group) in enumerate(header.PerFrameFunctionalGroupsSequence):
+        position = [float(v) for v in group.PlanePositionSequence[0].ImagePositionPatient]
+        positions.append((sum(normal[i] * position[i] for i in range(3)), frame, tuple(position)))
+    return positions
+
+class CompressedDICOMLoader(ParallelDICOMLoader):
+    # Uncompressed series keep using the thread pool of ParallelDICOMLoader, compressed ones are
+    # decoded by worker processes (codec libraries hold the GIL) straight into shared memory
+    def __init__(self, num_workers: Optional[int] = None, keep_stored_values: bool = False) -> None:
+        ParallelDICOMLoader.__init__(self, num_workers=num_workers, use_processes=False, keep_stored_values=keep_stored_values)
+
+    def readHeaders(self, paths: List[str]) -> Tuple[List[str], List[pydicom.Dataset]]:
+        with ThreadPoolExecutor(max_workers=self.numWorkers) as executor:
+            headers = list(executor.map(readFrameHeader, paths))
+        if any(header is not None and isMultiFrame(header) for header in headers):
+            # Frames are sorted individually in loadFiles
+            pairs = [(path, header) for (path, header) in zip(paths, headers) if header is not None]
+            return ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+        return sortSlices(paths, headers)
+
+    def isCompressed(self, path: str) -> bool:
+        return readTransferSyntax(path) in COMPRESSED_TRANSFER_SYNTAXES
+
+    def allocateSharedVolume(self, shape: Tuple[int, int, int], dtype: np.dtype, spacing: Tuple, origin: Tuple, direction: Tuple) -> Volume:
+        count = int(np.prod(shape))
+        sharedMemory = shared_memory.SharedMemory(create=True, size=count*dtype.itemsize)
+        # The voxels get their own mapping, pinned by every view of the array (VTK arrays included);
+        # the SharedMemory object only keeps the name for the workers and for unlinking
+        array = np.frombuffer(mapSharedMemory(sharedMemory.name, count*dtype.itemsize, writable=True), dtype=dtype, count=count).reshape(shape)
+        sharedMemory.close()
+        volume = Volume(array, spacing, origin, direction)
+        # The mapping stays valid after unlink as long as the voxels are referenced.
+        # Progressive and first-paint loads decode in several passes, so the name is released
+        # either explicitly after a one-shot load or when the volume goes away
+        volume.sharedMemory = sharedMemory
+        weakref.finalize(volume, unlinkSharedMemory, sharedMemory)
+        return volume
+
+    def releaseSharedName(self, volume: Volume) -> None:
+        sharedMemory = getattr(volume, "sharedMemory", None)
+        if sharedMemory is not None:
+            unlinkSharedMemory(sharedMemory)
+
+    def decodeFrames(self, volume: Volume, tasks: List[Tuple[str, int, int]]) -> None:
+        # tasks are (path, frame, slice index)
+        sharedMemory = getattr(volume, "sharedMemory", None)
+        dtype = volume.array.dtype.str
+        rescale = not volume.hasStoredValues()
+        with ProcessPoolExecutor(max_workers=self.numWorkers) as executor:
+            if sharedMemory is not None:
+                futures = [executor.submit(decodeFrameToSharedMemory, path, frame, sharedMemory.name, volume.array.shape, dtype, index, rescale) for (path, frame, index) in tasks]
+                for future in futures:
+                    future.result()
+            else:
+                futures = [(index, executor.submit(decodeFrameToArray, path, frame, dtype, rescale)) for (path, frame, index) in tasks]
+                for (index, future) in futures:
+                    volume.array[index] = future.result()
+
+    def decodeInto(self, volume: Volume, paths: List[str], indices: Optional[List[int]] = None) -> None:
+        if indices is None:
+            indices = list(range(len(paths)))
+        if len(indices) == 0 or not self.isCompressed(paths[indices[0]]):
+            return ParallelDICOMLoader.decodeInto(self, volume, paths, indices)
+        self.decodeFrames(volume, [(paths[index], 0, index) for index in indices])
+
+    def allocateVolume(self, headers: List[pydicom.Dataset]) -> Volume:
+        first = headers[0]
+        if str(first.file_meta.TransferSyntaxUID) not in COMPRESSED_TRANSFER_SYNTAXES:
+            return ParallelDICOMLoader.allocateVolume(self, headers)
+        (spacing, origin, direction) = volumeGeometry(headers)
+        volume = self.allocateSharedVolume((len(headers), int(first.Rows), int(first.Columns)), self.getVolumeDtype(headers), spacing, origin, direction)
+        volume.setRescale(*self.getVolumeRescale(headers))
+        return volume
+
+    def loadFiles(self, paths: List[str]) -> Volume:
+        (paths, headers) = self.readHeaders(paths)
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found")
+        if not any(isMultiFrame(header) for header in headers):
+            volume = self.allocateVolume(headers)
+            try:
+                self.decodeInto(volume, paths)
+            finally:
+                self.releaseSharedName(volume)
+            return volume
+
+        # Multi-frame objects: every frame becomes its own task, sorted along the slice normal in the
+        # same (descending) order as sortSlices
+        frames = []
+        for (path, header) in zip(paths, headers):
+            frames.extend((distance, path, frame, position) for (distance, frame, position) in framePositions(path, header))
+        frames.sort(key=lambda item: item[0], reverse=True)
+        first = headers[0]
+        (rowSpacing, columnSpacing) = [float(v) for v in first.get("PixelSpacing", None) or first.SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0].PixelSpacing]
+        sliceSpacing = abs(frames[-1][0] - frames[0][0]) / (len(frames) - 1) if len(frames) > 1 else 1.0
+        (slope, intercept) = frameRescaleParameters(first)
+        if self.keepStoredValues:
+            dtype = storedDtype(first)
+        else:
+            dtype = np.dtype(np.float32) if slope != int(slope) or intercept != int(intercept) else np.dtype(np.int16)
+        shape = (len(frames), int(first.Rows), int(first.Columns))
+        volume = self.allocateSharedVolume(shape, dtype, (columnSpacing, rowSpacing, sliceSpacing or 1.0), (0.0, 0.0, 0.0), (1, 0, 0, 0, 1, 0, 0, 0, 1))
+        if self.keepStoredValues:
+            volume.setRescale(slope, intercept)
+        try:
+            self.decodeFrames(volume, [(path, frame, index) for (index, (_, path, frame, _)) in enumerate(frames)])
+        finally:
+            self.releaseSharedName(volume)
+        return volume
@@ -0,0 +1,181 @@
+# Concurrent DICOMweb (QIDO-RS/WADO-RS) retrieval over pooled keep-alive connections
+
+import json
+import queue
+import threading
+import http.client
+import pydicom
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional
+from volume_loader import listDicomFiles
+from memory_ingest import DicomByteIngestor
+
+class HTTPConnectionPool(object):
+    def __init__(self, base_url: str, max_connections: int = 8, timeout: float = 30.0) -> None:
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.basePath = parts.path.rstrip("/")
+        self.timeout = timeout
+        # Idle connections are reused (HTTP/1.1 keep-alive), at most max_connections exist at once
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+    def createConnection(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, path: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        self.slots.acquire()
+        try:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = self.createConnection()
+            for attempt in range(2):
+                try:
+                    connection.request("GET", self.basePath + path, headers=headers or {})
+                    response = connection.getresponse()
+                    body = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    # The server may have closed an idle keep-alive connection, retry once on a new one
+                    connection.close()
+                    if attempt == 1:
+                        raise
+                    connection = self.createConnection()
+            if response.will_close:
+                connection.close()
+            else:
+                self.idle.put(connection)
+            return (response.status, response.headers, body)
+        finally:
+            self.slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+def parseMultipart(content_type: str, body: bytes) -> List[bytes]:
+    # Minimal multipart/related parser for WADO-RS responses
+    boundary = None
+    for parameter in content_type.split(";")[1:]:
+        (key, _, value) = parameter.strip().partition("=")
+        if key.lower() == "boundary":
+            boundary = value.strip('"')
+    if boundary is None:
+        return [body]
+    parts = []
+    for chunk in body.split(b"--" + boundary.encode("ascii"))[1:]:
+        if chunk.startswith(b"--"):
+            break
+        (_, _, payload) = chunk.partition(b"\r\n\r\n")
+        if payload.endswith(b"\r\n"):
+            payload = payload[:-2]
+        parts.append(payload)
+    return parts
+
+class WADORSRetriever(object):
+    def __init__(self, base_url: str, max_in_flight: int = 8) -> None:
+        self.maxInFlight = max_in_flight
+        self.pool = HTTPConnectionPool(base_url, max_connections=max_in_flight)
+
+    def listInstances(self, study_uid: str, series_uid: str) -> List[str]:
+        (status, _, body) = self.pool.request(
+            "/studies/{}/series/{}/instances".format(study_uid, series_uid), {"Accept": "application/dicom+json"}
+        )
+        if status != 200:
+            raise IOError("QIDO-RS request failed with status {}".format(status))
+        return [instance["00080018"]["Value"][0] for instance in json.loads(body)]
+
+    def retrieveInstance(self, study_uid: str, series_uid: str, sop_uid: str) -> List[bytes]:
+        (status, headers, body) = self.pool.request(
+            "/studies/{}/series/{}/instances/{}".format(study_uid, series_uid, sop_uid),
+            {"Accept": 'multipart/related; type="application/dicom"'}
+        )
+        if status != 200:
+            raise IOError("WADO-RS request for {} failed with status {}".format(sop_uid, status))
+        return parseMultipart(headers.get("Content-Type", ""), body)
+
+    def retrieveSeries(self, study_uid: str, series_uid: str, ingestor: DicomByteIngestor) -> DicomByteIngestor:
+        # Every instance is handed to the ingestor (and starts decoding) as soon as its download finishes
+        sopUids = self.listInstances(study_uid, series_uid)
+
+        def retrieve(sop_uid: str) -> None:
+            ingestor.extend(self.retrieveInstance(study_uid, series_uid, sop_uid))
+
+        with ThreadPoolExecutor(max_workers=self.maxInFlight) as executor:
+            list(executor.map(retrieve, sopUids))
+        return ingestor
+
+    def close(self) -> None:
+        self.pool.close()
+
+class LocalDICOMwebServer(object):
+    # Stand-in DICOMweb endpoint serving the DICOM files of one folder, for tests and benchmarks
+    def __init__(self, path_to_dir: str, port: int = 0) -> None:
+        self.instances = {}
+        for path in listDicomFiles(path_to_dir):
+            try:
+                header = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=["StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID"])
+            except pydicom.errors.InvalidDicomError:
+                continue
+            key = (str(header.StudyInstanceUID), str(header.SeriesInstanceUID))
+            self.instances.setdefault(key, {})[str(header.SOPInstanceUID)] = path
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+            def send(self, status: int, content_type: str, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                parts = self.path.strip("/").split("/")
+                if len(parts) >= 5 and parts[0] == "studies" and parts[2] == "series" and parts[4] == "instances":
+                    series = server.instances.get((parts[1], parts[3]), {})
+                    if len(parts) == 5:
+                        body = json.dumps([{"00080018": {"vr": "UI", "Value": [uid]}} for uid in series]).encode("utf-8")
+                        return self.send(200, "application/dicom+json", body)
+                    if len(parts) == 6 and parts[5] in series:
+                        with open(series[parts[5]], "rb") as file:
+                            data = file.read()
+                        boundary = "DICOMwebBoundary"
+                        body = b"".join([
+                            "--{}\r\nContent-Type: application/dicom\r\n\r\n".format(boundary).encode("ascii"), data,
+                            "\r\n--{}--\r\n".format(boundary).encode("ascii")
+                        ])
+                        return self.send(200, 'multipart/related; type="application/dicom"; boundary={}'.format(boundary), body)
+                self.send(404, "text/plain", b"Not found")
+
+        self.httpServer = ThreadingHTTPServer(("127.0.0.1", port), RequestHandler)
+        self.thread = None
+
+    def getBaseUrl(self) -> str:
+        (host, port) = self.httpServer.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def listSeries(self) -> List[Tuple[str, str]]:
+        return list(self.instances.keys())
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, name="LocalDICOMwebServer", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
@@ -0,0 +1,109 @@
+# First paint: read only the voxels the three initial orthogonal planes need
+
+import math
+import threading
+import numpy as np
+import pydicom
+from pydicom.uid import ImplicitVRLittleEndian, ExplicitVRLittleEndian, ExplicitVRBigEndian
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple, Optional
+from volume_loader import ParallelDICOMLoader, Volume, decodeSlice, rescaleParameters
+
+UNCOMPRESSED_TRANSFER_SYNTAXES = [ImplicitVRLittleEndian, ExplicitVRLittleEndian, ExplicitVRBigEndian]
+
+def centerIndices(size: int) -> List[int]:
+    # The volume center lies on a voxel for odd sizes and between two voxels for even sizes
+    center = (size - 1) / 2
+    return sorted({int(math.floor(center)), int(math.ceil(center))})
+
+def rawPixelDataElement(dataset: pydicom.Dataset) -> Optional[pydicom.dataelem.RawDataElement]:
+    # The raw element only carries the file offset of the pixel data; pydicom 3 can return it
+    # without reading the deferred value, pydicom 2 reads the value on access
+    try:
+        return dataset.get_item("PixelData", keep_deferred=True)
+    except TypeError:
+        return dataset.get_item("PixelData")
+
+def mapPixelData(path: str) -> Optional[np.ndarray]:
+    # Memory-map the raw pixel data of an uncompressed file, None when it has to be decoded
+    dataset = pydicom.dcmread(path, defer_size=1024)
+    if dataset.file_meta.get("TransferSyntaxUID") not in UNCOMPRESSED_TRANSFER_SYNTAXES:
+        return None
+    if int(dataset.get("SamplesPerPixel", 1)) != 1 or int(dataset.get("NumberOfFrames", 1) or 1) != 1:
+        return None
+    bits = int(dataset.BitsAllocated)
+    if bits not in (8, 16, 32):
+        return None
+    element = rawPixelDataElement(dataset)
+    if element is None or element.value_tell is None:
+        return None
+    byteOrder = ">" if dataset.file_meta.TransferSyntaxUID == ExplicitVRBigEndian else "<"
+    dtype = np.dtype("{}{}{}".format(byteOrder, "i" if int(dataset.PixelRepresentation) == 1 else "u", bits // 8))
+    return np.memmap(path, dtype=dtype, mode="r", offset=element.value_tell, shape=(int(dataset.Rows), int(dataset.Columns)))
+
+def readPixelRegion(path: str, rows: Optional[List[int]] = None, columns: Optional[List[int]] = None, rescale: bool = True) -> np.ndarray:
+    # Rows and columns are DICOM indices, the region is returned unflipped
+    pixels = mapPixelData(path)
+    if pixels is None:
+        # Compressed pixel data cannot be addressed, decode the whole slice instead
+        pixels = np.flipud(decodeSlice(path, np.float32, rescale))
+        slope, intercept = 1.0, 0.0
+    elif not rescale:
+        slope, intercept = 1.0, 0.0
+    else:
+        slope, intercept = rescaleParameters(pydicom.dcmread(path, stop_before_pixels=True, specific_tags=["RescaleSlope", "RescaleIntercept"]))
+    if rows is not None:
+        pixels = pixels[rows, :]
+    if columns is not None:
+        pixels = pixels[:, columns]
+    region = np.array(pixels)
+    if slope != 1 or intercept != 0:
+        region = region * slope + intercept
+    return region
+
+class FirstPaintLoader(object):
+    def __init__(self, loader: ParallelDICOMLoader) -> None:
+        self.loader = loader
+        self.thread = None
+
+    def loadInitialPlanes(self, paths: List[str]) -> Tuple[Volume, List[Volume], List[str]]:
+        (paths, headers) = self.loader.readHeaders(paths)
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found")
+        # Geometry of the full volume is known from the headers alone
+        volume = self.loader.allocateVolume(headers)
+        (nz, ny, nx) = volume.array.shape
+        (sx, sy, sz) = volume.spacing
+        (ox, oy, oz) = volume.origin
+        dtype = volume.array.dtype
+        zIndices = centerIndices(nz)
+        yIndices = centerIndices(ny)
+        xIndices = centerIndices(nx)
+        # Volume y runs bottom-up while DICOM rows run top-down
+        rows = [ny - 1 - j for j in reversed(yIndices)]
+        rescale = not volume.hasStoredValues()
+
+        with ThreadPoolExecutor(max_workers=self.loader.numWorkers) as executor:
+            axial = list(executor.map(lambda k: np.flipud(readPixelRegion(paths[k], rescale=rescale)), zIndices))
+            coronal = list(executor.map(lambda path: np.flipud(readPixelRegion(path, rows=rows, rescale=rescale)), paths))
+            sagittal = list(executor.map(lambda path: np.flipud(readPixelRegion(path, columns=xIndices, rescale=rescale)), paths))
+
+        axialVolume = Volume(np.stack(axial).astype(dtype), volume.spacing, (ox, oy, oz + zIndices[0]*sz), volume.direction)
+        coronalVolume = Volume(np.stack(coronal).astype(dtype), volume.spacing, (ox, oy + yIndices[0]*sy, oz), volume.direction)
+        sagittalVolume = Volume(np.stack(sagittal).astype(dtype), volume.spacing, (ox + xIndices[0]*sx, oy, oz), volume.direction)
+        for planeVolume in (axialVolume, coronalVolume, sagittalVolume):
+            planeVolume.setRescale(volume.rescaleSlope, volume.rescaleIntercept)
+        return (volume, [axialVolume, coronalVolume, sagittalVolume], paths)
+
+    def loadInBackground(self, volume: Volume, paths: List[str], on_finished: Callable[[Volume], None]) -> threading.Thread:
+        def run() -> None:
+            self.loader.decodeInto(volume, paths)
+            on_finished(volume)
+
+        self.thread = threading.Thread(target=run, name="FirstPaintLoader", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,63 @@
+# In-memory ingestion of DICOM instances received as byte buffers (e.g. HTTP uploads)
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterable, List, Optional, Union
+from volume_loader import ParallelDICOMLoader, Volume, sortSlices
+from archive_loader import decodeMember, assembleVolume
+
+class DicomByteIngestor(object):
+    def __init__(self, num_workers: Optional[int] = None, loader: Optional[ParallelDICOMLoader] = None) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=num_workers or os.cpu_count() or 1)
+        # Decides the volume dtype and rescale (keep_stored_values) like for series read from disk
+        self.loader = loader if loader is not None else ParallelDICOMLoader(num_workers=num_workers)
+        self.lock = threading.Lock()
+        # SOPInstanceUID -> (header, pixels); duplicates from retried uploads replace each other
+        self.instances = {}
+        self.pending = []
+        self.rejected = 0
+
+    def append(self, data: Union[bytes, bytearray, memoryview]) -> Future:
+        # Decoding starts immediately on the pool, the caller can keep receiving
+        future = self.executor.submit(self.decodeInstance, bytes(data))
+        with self.lock:
+            self.pending.append(future)
+        return future
+
+    def extend(self, instances: Iterable[Union[bytes, bytearray, memoryview]]) -> List[Future]:
+        return [self.append(data) for data in instances]
+
+    def decodeInstance(self, data: bytes) -> bool:
+        result = decodeMember(data)
+        with self.lock:
+            if result is None:
+                self.rejected += 1
+                return False
+            (header, pixels) = result
+            self.instances[str(header.get("SOPInstanceUID", id(pixels)))] = (header, pixels)
+        return True
+
+    def wait(self) -> None:
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        for future in pending:
+            future.result()
+
+    def getNumberOfInstances(self) -> int:
+        with self.lock:
+            return len(self.instances)
+
+    def buildVolume(self) -> Volume:
+        self.wait()
+        with self.lock:
+            items = list(self.instances.items())
+        if len(items) == 0:
+            raise ValueError("No DICOM images received")
+        (keys, headers) = sortSlices([key for (key, _) in items], [header for (_, (header, _)) in items])
+        slices = dict((key, pixels) for (key, (_, pixels)) in items)
+        return assembleVolume(self.loader, keys, headers, slices)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
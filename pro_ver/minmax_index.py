@@ -0,0 +1,118 @@
+# Min/max index over fixed-size bricks, with coarser levels of 2x2x2 bricks each, used to skip
+# voxels that cannot contribute to a slab MIP, a histogram or a resliced value
+
+import numpy as np
+from typing import Optional, Tuple
+from volume_loader import Volume
+
+def brickRanges(array: np.ndarray, brick_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    # (minimum, maximum) per brick, edge bricks only cover the voxels that exist
+    starts = [np.arange(0, n, brick_size) for n in array.shape]
+    minimum = array
+    maximum = array
+    for (axis, indices) in enumerate(starts):
+        minimum = np.minimum.reduceat(minimum, indices, axis=axis)
+        maximum = np.maximum.reduceat(maximum, indices, axis=axis)
+    return (minimum, maximum)
+
+def lowestValue(dtype: np.dtype) -> object:
+    if np.issubdtype(dtype, np.integer):
+        return np.iinfo(dtype).min
+    return -np.inf
+
+class MinMaxBrickIndex(object):
+    def __init__(self, minimum: np.ndarray, maximum: np.ndarray, brick_size: int, shape: Tuple[int, int, int]) -> None:
+        # minimum/maximum are (bricks z, bricks y, bricks x); level i bricks span brick_size*2^i voxels
+        self.brickSize = int(brick_size)
+        self.shape = tuple(shape)
+        self.levels = [(minimum, maximum)]
+        while max(self.levels[-1][0].shape) > 1:
+            (minimum, maximum) = self.levels[-1]
+            self.levels.append((brickRanges(minimum, 2)[0], brickRanges(maximum, 2)[1]))
+
+    @staticmethod
+    def fromArray(array: np.ndarray, brick_size: int = 16, slab: int = 8) -> "MinMaxBrickIndex":
+        # A few brick layers at a time, the reductions never allocate a full size temporary
+        b = brick_size
+        layers = [brickRanges(array[z0:z0 + slab*b], b) for z0 in range(0, array.shape[0], slab*b)]
+        minimum = np.concatenate([layer[0] for layer in layers])
+        maximum = np.concatenate([layer[1] for layer in layers])
+        return MinMaxBrickIndex(minimum, maximum, b, array.shape)
+
+    @staticmethod
+    def fromVolume(volume: Volume, brick_size: int = 16) -> "MinMaxBrickIndex":
+        # Ranges are in the stored units of the volume, convert thresholds with volume.toStoredValues
+        return MinMaxBrickIndex.fromArray(volume.array, brick_size)
+
+    def getNumberOfLevels(self) -> int:
+        return len(self.levels)
+
+    def getNumberOfBytes(self) -> int:
+        return sum(minimum.nbytes + maximum.nbytes for (minimum, maximum) in self.levels)
+
+    def getRange(self) -> Tuple[object, object]:
+        (minimum, maximum) = self.levels[-1]
+        return (minimum.min(), maximum.max())
+
+    def isEmpty(self, low: float, high: float) -> bool:
+        # No voxel of the whole volume falls in [low, high], answered by the top of the hierarchy
+        (minimum, maximum) = self.getRange()
+        return maximum < low or minimum > high
+
+    def findBricks(self, low: float, high: float, level: int = 0) -> np.ndarray:
+        # Bricks that may hold values in [low, high]
+        (minimum, maximum) = self.levels[level]
+        return (maximum >= low) & (minimum <= high)
+
+    def isUniform(self, level: int = 0) -> np.ndarray:
+        # Bricks holding a single value, their voxels never have to be read
+        (minimum, maximum) = self.levels[level]
+        return minimum == maximum
+
+    def getBoxRange(self, box: Tuple[int, int, int, int, int, int]) -> Tuple[object, object]:
+        # Conservative range of the voxels in (x0, x1, y0, y1, z0, z1), upper bounds exclusive
+        (x0, x1, y0, y1, z0, z1) = box
+        b = self.brickSize
+        (minimum, maximum) = self.levels[0]
+        region = (slice(z0 // b, -(-z1 // b)), slice(y0 // b, -(-y1 // b)), slice(x0 // b, -(-x1 // b)))
+        return (minimum[region].min(), maximum[region].max())
+
+def slabMaximumIntensity(array: np.ndarray, index: MinMaxBrickIndex, z0: int, z1: int, floor: Optional[float] = None) -> np.ndarray:
+    # Axial thick-slab MIP over slices [z0, z1). Per brick column the bricks are visited from the
+    # highest maximum down and the walk stops once no brick can raise any pixel of the tile.
+    # With a floor (e.g. the low end of the window) pixels below it come out as the floor and
+    # bricks entirely below it are never read.
+    (_, ny, nx) = array.shape
+    b = index.brickSize
+    (bz0, bz1) = (z0 // b, -(-z1 // b))
+    brickMaximum = index.levels[0][1][bz0:bz1]
+    result = np.full((ny, nx), lowestValue(array.dtype) if floor is None else floor, dtype=array.dtype)
+    for by in range(brickMaximum.shape[1]):
+        ys = slice(by*b, min(ny, (by + 1)*b))
+        for bx in range(brickMaximum.shape[2]):
+            xs = slice(bx*b, min(nx, (bx + 1)*b))
+            tile = result[ys, xs]
+            column = brickMaximum[:, by, bx]
+            for k in np.argsort(column, kind="stable")[::-1]:
+                if column[k] <= tile.min():
+                    break
+                zs = slice(max(z0, (bz0 + k)*b), min(z1, (bz0 + k + 1)*b))
+                np.maximum(tile, array[zs, ys, xs].max(axis=0), out=tile)
+    return result
+
+def histogramInRange(array: np.ndarray, index: MinMaxBrickIndex, bins: int, value_range: Tuple[float, float]) -> Tuple[np.ndarray, np.ndarray]:
+    # Same result as np.histogram(array, bins, value_range): bricks without values in the range
+    # are skipped, each brick row is read from its first to its last candidate brick
+    (low, high) = value_range
+    b = index.brickSize
+    counts = np.zeros(bins, dtype=np.int64)
+    edges = np.histogram_bin_edges([], bins, value_range)
+    candidates = index.findBricks(low, high)
+    for bz in range(candidates.shape[0]):
+        if not candidates[bz].any():
+            continue
+        for by in np.flatnonzero(candidates[bz].any(axis=1)):
+            columns = np.flatnonzero(candidates[bz, by])
+            block = array[bz*b:(bz + 1)*b, by*b:(by + 1)*b, columns[0]*b:(columns[-1] + 1)*b]
+            counts += np.histogram(block, bins, value_range)[0]
+    return (counts, edges)
@@ -1,15 +1,132 @@
 # Render multi-view (multi render window)
 
 import vtk
+import numpy as np
 from vtkmodules.vtkCommonCore import vtkCommand
+from vtkmodules.util import numpy_support
+import os
 import math
-from typing import Union, List, Tuple
+import atexit
+import time
+import queue
+import threading
+from typing import Union, List, Tuple, Optional, Callable, Iterable, Dict
+from volume_loader import ParallelDICOMLoader, Volume, listDicomFiles, imageDataToVolume
+from compressed_decoder import CompressedDICOMLoader
+from volume_cache import VolumeCache, studyKey, directoryFingerprint
+from series_index import SeriesIndex
+from progressive_loader import ProgressiveLoader
+from first_paint import FirstPaintLoader
+from bricked_volume import BrickedVolumeStore, BrickCache, BrickCodec, CompressedBrickVolume
+from numpy_reslice import PythonImageReslice
+from reslice_engine import createResliceEngine
+from archive_loader import ArchiveDICOMLoader, isArchive
+from memory_ingest import DicomByteIngestor
+from dicomweb import WADORSRetriever
+from auto_crop import autoCropVolume
+from volume_pyramid import VolumePyramid, LevelOfDetailSelector
+from minmax_index import MinMaxBrickIndex, slabMaximumIntensity, histogramInRange
+from volume_histogram import VolumeHistogram, WINDOW_PRESETS
+from multiphase import MultiPhaseLoader
+from slice_cache import SliceCache, CachedReslice
+from study_cache import StudyCache, StudyEntry
+from study_prefetch import StudyPrefetcher
 
 vtkmath = vtk.vtkMath()
 
+INTERPOLATION_MODES = {
+    "nearest": vtk.VTK_RESLICE_NEAREST,
+    "linear": vtk.VTK_RESLICE_LINEAR,
+    "cubic": vtk.VTK_RESLICE_CUBIC
+}
+
 class MPRViewer(object):
-    def __init__(self) -> None:
+    def __init__(self, num_workers: Optional[int] = None, use_processes: bool = False, cache_dir: Optional[str] = None, index_path: str = ":memory:", progressive_step: int = 0, first_paint: bool = False, brick_dir: Optional[str] = None, brick_cache_bytes: int = 256*1024*1024, auto_crop: bool = False, auto_crop_threshold: float = -500.0, keep_stored_values: bool = True, pyramid_factors: Tuple[int, ...] = (2, 4), frame_time_target: float = 1/30, shared_registry_dir: Optional[str] = None, study_cache_bytes: int = 1024*1024*1024, prefetch_depth: int = 2, compressed_bricks: bool = False, brick_codec: Optional[str] = None, window_preset: Optional[str] = "auto", multi_phase: bool = False, phase_cache_bytes: int = 256*1024*1024, reslice_engine: Optional[str] = None, slice_cache_bytes: int = 96*1024*1024, interactive_interpolation: Optional[str] = "nearest", refined_interpolation: str = "linear", refine_delay: float = 0.25) -> None:
         self.colors = vtk.vtkNamedColors()
+        # JPEG-Lossless, JPEG-LS, JPEG2000 and RLE series are decoded frame by frame in a process pool
+        # With keep_stored_values voxels stay in their stored integer type, the rescale slope/intercept
+        # is applied to reslice outputs and folded into the window/level instead
+        self.loader = CompressedDICOMLoader(num_workers=num_workers, keep_stored_values=keep_stored_values) if not use_processes else ParallelDICOMLoader(num_workers=num_workers, use_processes=True, keep_stored_values=keep_stored_values)
+        self.volumeCache = VolumeCache(cache_dir) if cache_dir is not None else None
+        self.seriesIndex = SeriesIndex(index_path, num_workers=num_workers)
+        self.archiveLoader = ArchiveDICOMLoader(num_workers=num_workers, loader=self.loader)
+        self.numWorkers = num_workers
+        self.ingestor = None
+        # Crop background air (below the threshold) from fully loaded volumes
+        self.autoCrop = auto_crop
+        self.autoCropThreshold = auto_crop_threshold
+        self.autoCropReport = None
+        # Bricked volumes are never held whole in memory, there is no complete volume to crop
+        if auto_crop and (brick_dir is not None or compressed_bricks):
+            raise ValueError("auto_crop is not supported with brick_dir or compressed_bricks")
+        # Load every Nth slice first when progressive_step > 1
+        self.progressiveStep = progressive_step
+        # Render the initial planes from partial reads while the volume loads
+        self.firstPaint = first_paint
+        # Out-of-core mode: volumes live as compressed bricks on disk, reslicing fetches only crossed bricks
+        self.brickDir = brick_dir
+        self.brickCache = BrickCache(brick_cache_bytes)
+        # In-RAM mode: voxels kept as losslessly compressed bricks (blosc, zstd or zlib), the brick
+        # cache holds the decompressed bricks the three views sample
+        self.compressedBricks = compressed_bricks
+        self.brickCodec = brick_codec
+        # Plane extraction backend, a name from reslice_engine.RESLICE_ENGINES ("vtk", "numpy");
+        # None keeps plain vtkImageReslice (PythonImageReslice's own sampling for bricked volumes)
+        if reslice_engine is not None:
+            createResliceEngine(reslice_engine)
+        self.resliceEngine = reslice_engine
+        self.mainThreadTasks = queue.Queue()
+        # Downsampled levels built in the background after load, resliced during widget drags
+        self.pyramidFactors = pyramid_factors
+        self.levelOfDetail = LevelOfDetailSelector(frame_time_target)
+        # Viewer processes pointing at the same registry directory share one read-only copy per study.
+        # The registry (file locks, shared memory segments) is only imported when it is used.
+        self.sharedRegistry = None
+        self.sharedVolumeKey = None
+        if shared_registry_dir is not None:
+            from shared_volume import SharedVolumeRegistry
+            self.sharedRegistry = SharedVolumeRegistry(shared_registry_dir)
+            atexit.register(self.sharedRegistry.releaseAll)
+        # Recently shown studies stay decoded (with their pyramid) until the byte budget is exceeded
+        self.studyCache = StudyCache(study_cache_bytes) if study_cache_bytes > 0 else None
+        # (key, fingerprint) of the study on screen, None for volumes not read from a path
+        self.currentStudy = None
+        # (path_to_dir, series_uid) of the study on screen
+        self.currentSource = None
+        # Worklist prefetch decodes the next studies with a smaller, low-priority loader
+        self.prefetchDepth = prefetch_depth
+        self.prefetchLoader = CompressedDICOMLoader(num_workers=max(1, self.loader.numWorkers // 2), keep_stored_values=keep_stored_values)
+        self.prefetcher = None
+        # Window/level in modality units (HU for CT), the defaults match vtkImageProperty
+        self.colorWindow = 255.0
+        self.colorLevel = 127.5
+        # Applied to every complete volume from its histogram: "auto", a WINDOW_PRESETS name or None to keep the current one
+        self.windowPreset = window_preset
+        # 4D mode: the phases of a series share one buffer and one reslice geometry, scrubbing swaps
+        # the reslice input and slices of recently shown phases are served from the slice caches
+        self.multiPhase = multi_phase
+        # Per-view LRU caches of resliced planes, revisited planes are not resampled again.
+        # The budget is split between the three views, 0 turns caching off.
+        cacheBytes = phase_cache_bytes if multi_phase else slice_cache_bytes
+        self.sliceCaches = dict((view, SliceCache(cacheBytes // 3)) for view in ("axial", "coronal", "sagittal")) if cacheBytes > 0 else {}
+        self.phases = None
+        self.phase = 0
+        self.phaseTimer = None
+        self.phaseTimerObserver = None
+        # Interpolation while dragging or scrolling ("nearest", "linear", "cubic" or None to keep the
+        # refined one), the views are re-rendered with the refined interpolation once the input has
+        # been idle for refine_delay seconds
+        for mode in (interactive_interpolation, refined_interpolation):
+            if mode is not None and mode not in INTERPOLATION_MODES:
+                raise ValueError("Unknown interpolation {}".format(mode))
+        self.interactiveInterpolation = INTERPOLATION_MODES[interactive_interpolation] if interactive_interpolation is not None else None
+        self.refinedInterpolation = INTERPOLATION_MODES[refined_interpolation]
+        self.refineDelay = refine_delay
+        self.refineTimer = None
+        # Crosshair centers shared with the interaction handlers, which are registered with the first study
+        self.sphereWidgetCenters = {}
+        self.sphereWidgetCentersRotateLines = {}
+        self.interactionInitialized = False
         self.initialize()
 
         self.initCenterlineAxialView()
@@ -20,16 +137,29 @@ class MPRViewer(object):
         self.initWidgetsCoronalView()
         self.initWidgetsSagittalView()
 
+        self.initPipeline()
+
     def initialize(self) -> None:
-        self.reader = vtk.vtkDICOMImageReader()
+        self.imageData = None
+        self.rescaleSlope = 1.0
+        self.rescaleIntercept = 0.0
+        self.pyramid = None
+        self.minMaxIndex = None
+        self.histogram = None
+        self.interactionLevel = 0
+        self.resliceStart = 0.0
+        self.resliceTime = 0.0
         self.axial = vtk.vtkMatrix4x4()
         self.coronal = vtk.vtkMatrix4x4()
         self.sagittal = vtk.vtkMatrix4x4()
         self.rotationMatrix = vtk.vtkMatrix4x4()
         self.resultMatrix = vtk.vtkMatrix4x4()
-        self.resliceAxial = vtk.vtkImageReslice()
-        self.resliceCoronal = vtk.vtkImageReslice()
-        self.resliceSagittal = vtk.vtkImageReslice()
+        self.resliceAxial = self.createReslice("axial")
+        self.resliceCoronal = self.createReslice("coronal")
+        self.resliceSagittal = self.createReslice("sagittal")
+        for reslice in [self.resliceAxial, self.resliceCoronal, self.resliceSagittal]:
+            reslice.AddObserver(vtkCommand.StartEvent, self.startEventHandleReslice)
+            reslice.AddObserver(vtkCommand.EndEvent, self.endEventHandleReslice)
         self.actorAxial = vtk.vtkImageActor()
         self.actorCoronal = vtk.vtkImageActor()
         self.actorSagittal = vtk.vtkImageActor()
@@ -87,6 +217,32 @@ class MPRViewer(object):
             0, 0, 0, 1)
         )
     
+    def createReslice(self, view: str) -> Union[vtk.vtkImageReslice, PythonImageReslice, CachedReslice]:
+        # Every reslice gets its own engine instance, engines may keep per-view state
+        engine = createResliceEngine(self.resliceEngine) if self.resliceEngine is not None else None
+        if self.brickDir is not None or self.compressedBricks:
+            if self.resliceEngine == "vtk":
+                raise ValueError("Bricked volumes can not be resliced by the vtk engine")
+            reslice = PythonImageReslice(engine)
+        else:
+            reslice = PythonImageReslice(engine) if engine is not None else vtk.vtkImageReslice()
+        if view in self.sliceCaches:
+            return CachedReslice(self.sliceCaches[view], reslice)
+        if isinstance(reslice, vtk.vtkImageReslice):
+            # Axis-aligned planes stay views on the volume when the slice cache is off, like they
+            # are in PythonImageReslice
+            return CachedReslice(None, reslice)
+        return reslice
+
+    def clearSliceCaches(self) -> None:
+        # Cached planes keep their input volume alive, they are dropped whenever another volume is shown
+        for cache in self.sliceCaches.values():
+            cache.clear()
+
+    def getSliceCacheStatistics(self) -> dict:
+        # view -> hits, misses, hit_rate, evictions, entries and bytes of its slice cache
+        return dict((view, cache.getStatistics()) for (view, cache) in self.sliceCaches.items())
+
     def initCenterlineAxialView(self) -> None:
         greenLineAxial = vtk.vtkLineSource()
         greenLineAxial.SetPoint1(0, 500, 0)
@@ -265,12 +421,709 @@ class MPRViewer(object):
         self.sphereWidgetSagittal.SetCenter(position)
         self.linesSagittalActor.SetPosition(position)
 
-    def show3DMPR(self, path_to_dir: str) -> None:
+    def listSeries(self, path_to_dir: str) -> List[dict]:
+        self.seriesIndex.scan(path_to_dir)
+        return self.seriesIndex.listSeries(path_to_dir)
+
+    def getSeriesFiles(self, path_to_dir: str, series_uid: Optional[str] = None) -> List[str]:
+        if series_uid is None:
+            return listDicomFiles(path_to_dir)
+        self.seriesIndex.scan(path_to_dir)
+        return self.seriesIndex.getSortedFiles(series_uid, path_to_dir)
+
+    def getVolumeFingerprint(self, path_to_dir: str, files: List[str]) -> Optional[str]:
+        if self.volumeCache is None:
+            return None
+        return self.volumeCache.getFingerprint(path_to_dir, files)
+
+    def loadCachedVolume(self, path_to_dir: str, fingerprint: Optional[str], series_uid: Optional[str] = None) -> Optional[Volume]:
+        if self.volumeCache is None:
+            return None
+        return self.volumeCache.load(path_to_dir, fingerprint, series_uid)
+
+    def storeCachedVolume(self, path_to_dir: str, fingerprint: Optional[str], volume: Volume, series_uid: Optional[str] = None) -> None:
+        if self.volumeCache is not None:
+            self.volumeCache.store(path_to_dir, volume, fingerprint, series_uid)
+
+    def setVolumeRescale(self, slope: float, intercept: float) -> None:
+        self.rescaleSlope = float(slope)
+        self.rescaleIntercept = float(intercept)
+
+    def prepareVolume(self, volume: Volume) -> Volume:
+        # Load stages applied to a complete volume before it becomes the reslice input
+        self.setVolumeRescale(volume.rescaleSlope, volume.rescaleIntercept)
+        if self.autoCrop:
+            (volume, self.autoCropReport) = autoCropVolume(volume, self.autoCropThreshold)
+        return volume
+
+    def loadVolume(self, path_to_dir: str, series_uid: Optional[str] = None) -> vtk.vtkImageData:
+        files = self.getSeriesFiles(path_to_dir, series_uid)
+        fingerprint = self.getVolumeFingerprint(path_to_dir, files)
+
+        def load() -> Volume:
+            volume = self.loadCachedVolume(path_to_dir, fingerprint, series_uid)
+            if volume is None:
+                volume = self.loader.loadFiles(files)
+                self.storeCachedVolume(path_to_dir, fingerprint, volume, series_uid)
+            return self.prepareVolume(volume)
+
+        if self.sharedRegistry is None:
+            return load().toImageData()
+        # Only the first process opening the study decodes it, the others attach to its voxels
+        from shared_volume import sharedVolumeKey
+        self.releaseSharedVolume()
+        self.sharedVolumeKey = sharedVolumeKey(path_to_dir, fingerprint or directoryFingerprint(path_to_dir, files), series_uid)
+        volume = self.sharedRegistry.acquire(self.sharedVolumeKey, load)
+        self.setVolumeRescale(volume.rescaleSlope, volume.rescaleIntercept)
+        return volume.toImageData()
+
+    def acquireSharedVolume(self, path_to_dir: str, series_uid: Optional[str], fingerprint: str, imageData: vtk.vtkImageData, rescale: Tuple[float, float]) -> None:
+        # Studies shown from the study cache hold a registry reference like freshly loaded ones. The
+        # cached voxels are published only if no other viewer holds the study any more.
+        if self.sharedRegistry is None:
+            return
+        from shared_volume import sharedVolumeKey
+        volume = imageDataToVolume(imageData)
+        volume.setRescale(*rescale)
+        self.sharedVolumeKey = sharedVolumeKey(path_to_dir, fingerprint, series_uid)
+        self.sharedRegistry.acquire(self.sharedVolumeKey, lambda: volume)
+
+    def releaseSharedVolume(self) -> None:
+        # The reslices may keep rendering the attached voxels, the mapping lives as long as they do
+        if self.sharedVolumeKey is not None:
+            self.sharedRegistry.release(self.sharedVolumeKey)
+            self.sharedVolumeKey = None
+
+    def loadArchiveVolume(self, path_to_archive: str) -> vtk.vtkImageData:
+        # zip/tar studies are decoded from memory, nothing is extracted to disk
+        fingerprint = self.getVolumeFingerprint(path_to_archive, [path_to_archive])
+        volume = self.loadCachedVolume(path_to_archive, fingerprint)
+        if volume is None:
+            volume = self.archiveLoader.loadArchive(path_to_archive)
+            self.storeCachedVolume(path_to_archive, fingerprint, volume)
+        return self.prepareVolume(volume).toImageData()
+
+    def loadVolumeProgressive(self, path_to_dir: str, series_uid: Optional[str] = None) -> Tuple[vtk.vtkImageData, List[vtk.vtkImageData]]:
+        # Returns the full resolution image (geometry only until the background load is done)
+        # and the axial, coronal and sagittal inputs displayed in the meantime
+        files = self.getSeriesFiles(path_to_dir, series_uid)
+        fingerprint = self.getVolumeFingerprint(path_to_dir, files)
+        volume = self.loadCachedVolume(path_to_dir, fingerprint, series_uid)
+        if volume is not None:
+            imageData = self.prepareVolume(volume).toImageData()
+            return (imageData, [imageData]*3)
+
+        progressiveLoader = ProgressiveLoader(self.loader, self.progressiveStep)
+        (volume, coarseVolume, paths) = progressiveLoader.loadCoarse(files)
+        self.setVolumeRescale(volume.rescaleSlope, volume.rescaleIntercept)
+        imageData = volume.toImageData()
+
+        study = self.currentStudy
+
+        def onFinished(volume: Volume) -> None:
+            self.storeCachedVolume(path_to_dir, fingerprint, volume, series_uid)
+            # The crop box needs every slice, the cropped volume replaces the full one once it is in
+            (completeImageData, report) = (imageData, None)
+            if self.autoCrop:
+                (cropped, report) = autoCropVolume(volume, self.autoCropThreshold)
+                completeImageData = cropped.toImageData()
+            self.storeStudy(study, completeImageData, (volume.rescaleSlope, volume.rescaleIntercept))
+            self.runOnMainThread(lambda: self.swapInCompleteVolume(imageData, completeImageData, report))
+
+        progressiveLoader.fillInBackground(volume, paths, onFinished)
+        return (imageData, [coarseVolume.toImageData()]*3)
+
+    def loadVolumeFirstPaint(self, path_to_dir: str, series_uid: Optional[str] = None) -> Tuple[vtk.vtkImageData, List[vtk.vtkImageData]]:
+        # Each view first gets a thin volume holding just the voxels around its initial plane
+        files = self.getSeriesFiles(path_to_dir, series_uid)
+        fingerprint = self.getVolumeFingerprint(path_to_dir, files)
+        volume = self.loadCachedVolume(path_to_dir, fingerprint, series_uid)
+        if volume is not None:
+            imageData = self.prepareVolume(volume).toImageData()
+            return (imageData, [imageData]*3)
+
+        firstPaintLoader = FirstPaintLoader(self.loader)
+        (volume, planeVolumes, paths) = firstPaintLoader.loadInitialPlanes(files)
+        self.setVolumeRescale(volume.rescaleSlope, volume.rescaleIntercept)
+        imageData = volume.toImageData()
+
+        study = self.currentStudy
+
+        def onFinished(volume: Volume) -> None:
+            self.storeCachedVolume(path_to_dir, fingerprint, volume, series_uid)
+            # The crop box needs every slice, the cropped volume replaces the full one once it is in
+            (completeImageData, report) = (imageData, None)
+            if self.autoCrop:
+                (cropped, report) = autoCropVolume(volume, self.autoCropThreshold)
+                completeImageData = cropped.toImageData()
+            self.storeStudy(study, completeImageData, (volume.rescaleSlope, volume.rescaleIntercept))
+            self.runOnMainThread(lambda: self.swapInCompleteVolume(imageData, completeImageData, report))
+
+        firstPaintLoader.loadInBackground(volume, paths, onFinished)
+        return (imageData, [planeVolume.toImageData() for planeVolume in planeVolumes])
+
+    def loadVolumeBricked(self, path_to_dir: str, series_uid: Optional[str] = None) -> Tuple[vtk.vtkImageData, List[BrickedVolumeStore]]:
+        # The bricked store is built once per study and reopened afterwards
+        files = self.getSeriesFiles(path_to_dir, series_uid)
+        fingerprint = directoryFingerprint(path_to_dir, files)
+        directory = os.path.join(self.brickDir, studyKey(path_to_dir, series_uid))
+        if BrickedVolumeStore.exists(directory, fingerprint):
+            store = BrickedVolumeStore(directory, self.brickCache)
+        else:
+            BrickedVolumeStore.build(directory, files, self.loader, fingerprint=fingerprint).close()
+            store = BrickedVolumeStore(directory, self.brickCache)
+        self.setVolumeRescale(store.rescaleSlope, store.rescaleIntercept)
+        return (store.toGeometryImageData(), [store]*3)
+
+    def loadVolumeCompressedBricks(self, path_to_dir: str, series_uid: Optional[str] = None) -> Tuple[vtk.vtkImageData, List[CompressedBrickVolume]]:
+        # Series are compressed slab by slab while decoding, a disk-cached volume is compressed as a whole
+        files = self.getSeriesFiles(path_to_dir, series_uid)
+        fingerprint = self.getVolumeFingerprint(path_to_dir, files)
+        volume = self.loadCachedVolume(path_to_dir, fingerprint, series_uid)
+        codec = BrickCodec(self.brickCodec)
+        if volume is not None:
+            bricks = CompressedBrickVolume.fromVolume(volume, codec=codec, cache=self.brickCache)
+        else:
+            bricks = CompressedBrickVolume.build(files, self.loader, codec=codec, cache=self.brickCache)
+        self.setVolumeRescale(bricks.rescaleSlope, bricks.rescaleIntercept)
+        imageData = bricks.toGeometryImageData()
+        self.storeStudy(self.currentStudy, imageData, (bricks.rescaleSlope, bricks.rescaleIntercept), bricks)
+        return (imageData, [bricks]*3)
+
+    def swapInCompleteVolume(self, imageData: vtk.vtkImageData, completeImageData: Optional[vtk.vtkImageData] = None, auto_crop_report: Optional[Dict[str, object]] = None) -> None:
+        # Background loads finish after another study may have been opened, only the volume still on
+        # screen (whose geometry-only image showImageData installed) is swapped in. An auto-cropped
+        # volume replaces the full-size geometry.
+        if self.imageData is imageData:
+            if auto_crop_report is not None:
+                self.autoCropReport = auto_crop_report
+            self.setInputVolume(completeImageData if completeImageData is not None else imageData)
+
+    def setInputVolume(self, imageData: vtk.vtkImageData) -> None:
+        # Reslice axes, crosshairs and cameras are in world coordinates, only the input changes
+        self.clearSliceCaches()
+        self.imageData = imageData
+        self.resliceAxial.SetInputData(imageData)
+        self.resliceCoronal.SetInputData(imageData)
+        self.resliceSagittal.SetInputData(imageData)
+        self.buildPyramid(imageData)
+        self.buildMinMaxIndex(imageData)
+        self.buildHistogram(imageData)
+        self.renderWindows()
+
+    def buildPyramid(self, imageData: vtk.vtkImageData) -> None:
+        # Only complete in-memory volumes get a pyramid, the levels share nothing with the input
+        self.pyramid = None
+        self.interactionLevel = 0
+        # Levels of one phase must not stand in for the others during drags
+        if len(self.pyramidFactors) == 0 or imageData.GetPointData().GetScalars() is None or self.phases is not None:
+            return
+        study = self.currentStudy
+        source = self.currentSource
+        if self.studyCache is not None and study is not None:
+            cached = self.studyCache.getDerived(study[0], "pyramid")
+            if cached is not None and cached.imageData.get(0) is imageData:
+                self.pyramid = cached
+                return
+        volume = imageDataToVolume(imageData)
+        volume.setRescale(self.rescaleSlope, self.rescaleIntercept)
+        pyramid = VolumePyramid(volume, self.pyramidFactors, imageData)
+        # Reopened studies map their stored levels, reducing them again would read every page of
+        # the memory-mapped voxels
+        persistent = self.volumeCache is not None and study is not None and source is not None
+        if persistent:
+            levels = self.volumeCache.loadPyramid(source[0], volume.array.shape, pyramid.factors, study[1], source[1])
+            if levels is not None:
+                self.pyramid = pyramid.setLevels(levels)
+                if self.studyCache is not None:
+                    self.studyCache.setDerived(study[0], "pyramid", self.pyramid)
+                return
+
+        def onFinished(pyramid: VolumePyramid) -> None:
+            if persistent:
+                self.volumeCache.storePyramid(source[0], pyramid.levels[1:], volume.array.shape, pyramid.factors, study[1], source[1])
+
+            def install() -> None:
+                # A newer volume may have been swapped in while this one was being reduced
+                if self.imageData is imageData:
+                    self.pyramid = pyramid
+                if self.studyCache is not None and study is not None:
+                    self.studyCache.setDerived(study[0], "pyramid", pyramid)
+            self.runOnMainThread(install)
+
+        pyramid.buildInBackground(onFinished)
+
+    def buildMinMaxIndex(self, imageData: vtk.vtkImageData, bricks: Optional[CompressedBrickVolume] = None) -> None:
+        # Per-brick value ranges of the complete volume, computed once per study in the background;
+        # compressed brick volumes bring their own from the compression pass
+        self.minMaxIndex = bricks.minMaxIndex if bricks is not None else None
+        if bricks is not None or imageData.GetPointData().GetScalars() is None:
+            return
+        study = self.currentStudy
+        source = self.currentSource
+        shape = tuple(reversed(imageData.GetDimensions()))
+        cached = None
+        if self.studyCache is not None and study is not None:
+            cached = self.studyCache.getDerived(study[0], "minmax")
+        persistent = self.volumeCache is not None and study is not None and source is not None
+        if cached is None and persistent:
+            cached = self.volumeCache.loadMinMaxIndex(source[0], study[1], source[1])
+        if cached is not None and cached.shape == shape:
+            self.minMaxIndex = cached
+            if self.studyCache is not None and study is not None:
+                self.studyCache.setDerived(study[0], "minmax", cached)
+            return
+        volume = imageDataToVolume(imageData)
+
+        def run() -> None:
+            index = MinMaxBrickIndex.fromVolume(volume)
+            if persistent:
+                self.volumeCache.storeMinMaxIndex(source[0], index, study[1], source[1])
+
+            def install() -> None:
+                if self.imageData is imageData:
+                    self.minMaxIndex = index
+                if self.studyCache is not None and study is not None:
+                    self.studyCache.setDerived(study[0], "minmax", index)
+            self.runOnMainThread(install)
+
+        threading.Thread(target=run, name="MinMaxBrickIndex", daemon=True).start()
+
+    def buildHistogram(self, imageData: vtk.vtkImageData) -> None:
+        # Histogram and percentile table of the complete volume, counted once per study in parallel
+        # and kept in the study cache and next to the cached voxels on disk
+        self.histogram = None
+        if imageData.GetPointData().GetScalars() is None:
+            return
+        study = self.currentStudy
+        source = self.currentSource
+        histogram = None
+        if self.studyCache is not None and study is not None:
+            histogram = self.studyCache.getDerived(study[0], "histogram")
+        if histogram is None and self.volumeCache is not None and study is not None and source is not None:
+            histogram = self.volumeCache.loadHistogram(source[0], study[1], source[1])
+        if histogram is not None:
+            self.histogram = histogram
+            if self.windowPreset is not None:
+                self.applyWindowPreset(self.windowPreset, render=False)
+            return
+        volume = imageDataToVolume(imageData)
+        volume.setRescale(self.rescaleSlope, self.rescaleIntercept)
+
+        def run() -> None:
+            histogram = VolumeHistogram.fromVolume(volume, self.numWorkers)
+            def install() -> None:
+                if self.imageData is imageData:
+                    self.histogram = histogram
+                    if self.windowPreset is not None:
+                        self.applyWindowPreset(self.windowPreset)
+                if self.studyCache is not None and study is not None:
+                    self.studyCache.setDerived(study[0], "histogram", histogram)
+            if self.volumeCache is not None and study is not None and source is not None:
+                self.volumeCache.storeHistogram(source[0], histogram, study[1], source[1])
+            self.runOnMainThread(install)
+
+        threading.Thread(target=run, name="VolumeHistogram", daemon=True).start()
+
+    def getWindowPresets(self) -> dict:
+        # name -> (window, level) in modality units, "auto" only once the histogram is there
+        presets = dict(WINDOW_PRESETS)
+        if self.histogram is not None:
+            presets = dict((name, self.histogram.getPresetWindowLevel(name)) for name in presets)
+            presets["auto"] = self.histogram.getAutoWindowLevel()
+        return presets
+
+    def applyWindowPreset(self, name: str, render: bool = True) -> None:
+        presets = self.getWindowPresets()
+        if name not in presets:
+            if name == "auto":
+                # The histogram of this volume is still being counted
+                return
+            raise ValueError("Unknown window preset {}".format(name))
+        self.setWindowLevel(*presets[name])
+        if render:
+            self.renderWindows()
+
+    def getSlabMaximumIntensity(self, z0: int, z1: int) -> np.ndarray:
+        # Axial thick-slab MIP over slices [z0, z1) in modality units. Values below the window are
+        # displayed black anyway, so bricks entirely below it are skipped.
+        volume = self.getVolume()
+        index = self.minMaxIndex if self.minMaxIndex is not None else MinMaxBrickIndex.fromVolume(volume)
+        floor = None
+        if volume.rescaleSlope > 0:
+            floor = volume.toStoredValues(self.colorLevel - self.colorWindow/2)
+            if np.issubdtype(volume.array.dtype, np.integer):
+                info = np.iinfo(volume.array.dtype)
+                floor = min(max(math.floor(floor), info.min), info.max)
+        return volume.toModalityValues(slabMaximumIntensity(volume.array, index, z0, z1, floor))
+
+    def getHistogram(self, bins: int, value_range: Tuple[float, float]) -> Tuple[np.ndarray, np.ndarray]:
+        # Histogram of the loaded volume over value_range (modality units), bricks without values in
+        # the range are never read
+        volume = self.getVolume()
+        index = self.minMaxIndex if self.minMaxIndex is not None else MinMaxBrickIndex.fromVolume(volume)
+        storedRange = sorted(volume.toStoredValues(value) for value in value_range)
+        (counts, edges) = histogramInRange(volume.array, index, bins, tuple(storedRange))
+        edges = volume.toModalityValues(edges)
+        if volume.rescaleSlope < 0:
+            (counts, edges) = (counts[::-1], edges[::-1])
+        return (counts, edges)
+
+    def setInteractionLevel(self, level: int) -> None:
+        # Swaps the pyramid level the reslices sample, self.imageData stays the full resolution volume
+        if self.pyramid is None or level == self.interactionLevel:
+            return
+        self.interactionLevel = level
+        imageData = self.pyramid.getImageData(level)
+        self.resliceAxial.SetInputData(imageData)
+        self.resliceCoronal.SetInputData(imageData)
+        self.resliceSagittal.SetInputData(imageData)
+
+    def startEventHandleReslice(self, obj, event) -> None:
+        self.resliceStart = time.perf_counter()
+
+    def endEventHandleReslice(self, obj, event) -> None:
+        self.resliceTime += time.perf_counter() - self.resliceStart
+
+    def startInteractionEventHandleLevelOfDetail(self, obj, event) -> None:
+        self.resliceTime = 0.0
+
+    def interactionEventHandleLevelOfDetail(self, obj, event) -> None:
+        # Reslice time spent since the previous event is charged to the level in use, the level
+        # for the next event is picked from the frame-time estimates
+        if self.pyramid is None:
+            return
+        if self.resliceTime > 0:
+            self.levelOfDetail.recordFrameTime(self.interactionLevel, self.resliceTime)
+        self.resliceTime = 0.0
+        self.setInteractionLevel(self.levelOfDetail.selectLevel(self.pyramid.getNumberOfLevels()))
+
+    def endInteractionEventHandleLevelOfDetail(self, obj, event) -> None:
+        # Back to full resolution, the reslice axes and cameras are untouched so the view stays put
+        if self.pyramid is None or self.interactionLevel == 0:
+            return
+        self.setInteractionLevel(0)
+        self.renderWindows()
+
+    def setInterpolationMode(self, mode: int) -> None:
+        # Planes are only resampled when they are rendered next; cached planes are kept per mode
+        for reslice in [self.resliceAxial, self.resliceCoronal, self.resliceSagittal]:
+            reslice.SetInterpolationMode(mode)
+
+    def startInteractiveInterpolation(self) -> None:
+        # Called for every drag and wheel event: a pending refinement is cancelled and rescheduled,
+        # so it only runs once the input has been idle for refineDelay
+        if self.interactiveInterpolation is None:
+            return
+        self.cancelRefinement()
+        self.setInterpolationMode(self.interactiveInterpolation)
+        self.refineTimer = self.renderWindowInteractorAxial.CreateOneShotTimer(max(1, int(1000*self.refineDelay)))
+
+    def cancelRefinement(self) -> None:
+        if self.refineTimer is None:
+            return
+        self.renderWindowInteractorAxial.DestroyTimer(self.refineTimer)
+        self.refineTimer = None
+
+    def timerEventHandleRefineInterpolation(self, obj, event) -> None:
+        if self.refineTimer is None or obj.GetTimerEventId() != self.refineTimer:
+            return
+        self.refineTimer = None
+        self.setInterpolationMode(self.refinedInterpolation)
+        self.renderWindows()
+
+    def interactionEventHandleInterpolation(self, obj, event) -> None:
+        self.startInteractiveInterpolation()
+
+    def setWindowLevel(self, window: float, level: float) -> None:
+        # Window/level is given in modality units and mapped onto the stored voxel values,
+        # so the reslice outputs never have to be rescaled for display
+        self.colorWindow = float(window)
+        self.colorLevel = float(level)
+        slope = self.rescaleSlope if self.rescaleSlope != 0 else 1.0
+        for actor in [self.actorAxial, self.actorCoronal, self.actorSagittal]:
+            actor.GetProperty().SetColorWindow(self.colorWindow / abs(slope))
+            actor.GetProperty().SetColorLevel((self.colorLevel - self.rescaleIntercept) / slope)
+
+    def getReslice(self, view: str) -> Union[vtk.vtkImageReslice, PythonImageReslice]:
+        reslices = {"axial": self.resliceAxial, "coronal": self.resliceCoronal, "sagittal": self.resliceSagittal}
+        if view not in reslices:
+            raise ValueError("Unknown view {}".format(view))
+        return reslices[view]
+
+    def getVolume(self) -> Volume:
+        # NumPy view (z, y, x) sharing memory with the loaded vtkImageData, values in stored units
+        # (see rescaleSlope/rescaleIntercept of the returned volume)
+        if self.imageData is None or self.imageData.GetPointData().GetScalars() is None:
+            raise ValueError("No in-memory volume is loaded")
+        volume = imageDataToVolume(self.imageData)
+        volume.setRescale(self.rescaleSlope, self.rescaleIntercept)
+        return volume
+
+    def getResliceVolume(self, view: str) -> Volume:
+        # NumPy view of the current 2D reslice output of a view, as a one-slice volume in world
+        # coordinates: origin is the first pixel, direction holds the in-plane axes and the plane normal
+        reslice = self.getReslice(view)
+        reslice.Update()
+        output = reslice.GetOutput()
+        volume = imageDataToVolume(output)
+        axes = reslice.GetResliceAxes()
+        columns = [[axes.GetElement(row, column) for row in range(3)] for column in range(4)]
+        (ox, oy, oz) = output.GetOrigin()
+        volume.origin = tuple(columns[3][i] + ox*columns[0][i] + oy*columns[1][i] + oz*columns[2][i] for i in range(3))
+        volume.direction = tuple(columns[0] + columns[1] + columns[2])
+        volume.setRescale(self.rescaleSlope, self.rescaleIntercept)
+        return volume
+
+    def setInputArray(self, array: np.ndarray, spacing: Union[List, Tuple] = (1.0, 1.0, 1.0), origin: Union[List, Tuple] = (0.0, 0.0, 0.0), rescale: Tuple[float, float] = (1.0, 0.0)) -> vtk.vtkImageData:
+        # Wraps a C-contiguous (z, y, x) array as the reslice input without copying, the array must
+        # stay unchanged in shape while displayed; writes show up after Modified() and a render.
+        # The array is not a study, derived data cached for the previous one must not be reused.
+        self.setCurrentStudy(None)
+        self.setVolumeRescale(*rescale)
+        volume = Volume(array, spacing, origin)
+        imageData = volume.toImageData()
+        self.setInputVolume(imageData)
+        return imageData
+
+    def getResliceOutputArray(self, reslice: Union[vtk.vtkImageReslice, PythonImageReslice]) -> np.ndarray:
+        # 2D reslice output in modality units, the rescale is applied to the slice only
+        output = reslice.GetOutput()
+        (nx, ny, _) = output.GetDimensions()
+        values = numpy_support.vtk_to_numpy(output.GetPointData().GetScalars()).reshape(ny, nx)
+        if self.rescaleSlope == 1 and self.rescaleIntercept == 0:
+            return values
+        return values * np.float32(self.rescaleSlope) + np.float32(self.rescaleIntercept)
+
+    def runOnMainThread(self, callback: Callable[[], None]) -> None:
+        self.mainThreadTasks.put(callback)
+
+    def timerEventHandleMainThreadTasks(self, obj, event) -> None:
+        while True:
+            try:
+                callback = self.mainThreadTasks.get_nowait()
+            except queue.Empty:
+                break
+            callback()
+
+    def getStudyIdentity(self, path_to_dir: str, series_uid: Optional[str] = None) -> Tuple[str, str]:
+        files = [path_to_dir] if isArchive(path_to_dir) else self.getSeriesFiles(path_to_dir, series_uid)
+        return (studyKey(path_to_dir, series_uid), directoryFingerprint(path_to_dir, files))
+
+    def setCurrentStudy(self, study: Optional[Tuple[str, str]]) -> None:
+        # The study on screen is pinned, neither other loads nor prefetches evict it
+        if self.studyCache is not None and self.currentStudy is not None:
+            self.studyCache.unpin(self.currentStudy[0])
+        self.currentStudy = study
+        if study is None:
+            self.currentSource = None
+            self.stopPhasePlayback()
+            self.phases = None
+            # The previous study's shared voxels stay mapped while displayed, only the reference goes
+            self.releaseSharedVolume()
+        if self.studyCache is not None and study is not None:
+            self.studyCache.pin(study[0])
+
+    def storeStudy(self, study: Optional[Tuple[str, str]], imageData: vtk.vtkImageData, rescale: Tuple[float, float], bricks: Optional[CompressedBrickVolume] = None) -> None:
+        # Only complete volumes are cached, partial first-paint and progressive inputs never are
+        if self.studyCache is not None and study is not None:
+            (key, fingerprint) = study
+            entry = StudyEntry(imageData, fingerprint, rescale)
+            if bricks is not None:
+                entry.derived["bricks"] = bricks
+            self.studyCache.put(key, entry)
+
+    def getStudyCacheStatistics(self) -> dict:
+        # hits, misses, evictions, entries and bytes of the in-process study cache
+        if self.studyCache is None:
+            return {}
+        return self.studyCache.getStatistics()
+
+    def readStudyVolume(self, path_to_dir: str, series_uid: Optional[str], loader: ParallelDICOMLoader, cancelled: Optional[threading.Event] = None) -> Optional[Tuple[Volume, str]]:
+        # Decodes a study without touching the viewer state, for the prefetch workers. None once
+        # cancelled is set, checked between the header read, the decode and the disk cache store.
+        files = [path_to_dir] if isArchive(path_to_dir) else self.getSeriesFiles(path_to_dir, series_uid)
+        fingerprint = self.getVolumeFingerprint(path_to_dir, files)
+        volume = self.loadCachedVolume(path_to_dir, fingerprint, series_uid)
+        if volume is None:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            volume = self.archiveLoader.loadArchive(path_to_dir) if isArchive(path_to_dir) else loader.loadFiles(files)
+            if cancelled is not None and cancelled.is_set():
+                return None
+            self.storeCachedVolume(path_to_dir, fingerprint, volume, series_uid)
+        if self.autoCrop:
+            (volume, _) = autoCropVolume(volume, self.autoCropThreshold)
+        return (volume, directoryFingerprint(path_to_dir, files))
+
+    def prefetchStudy(self, item: Tuple[str, Optional[str]], cancelled: threading.Event) -> None:
+        (path_to_dir, series_uid) = item
+        key = studyKey(path_to_dir, series_uid)
+        if self.studyCache.contains(key) or cancelled.is_set():
+            return
+        result = self.readStudyVolume(path_to_dir, series_uid, self.prefetchLoader, cancelled)
+        # A prefetch that went stale while decoding is dropped instead of displacing cached studies
+        if result is None or cancelled.is_set():
+            return
+        (volume, fingerprint) = result
+        rescale = (volume.rescaleSlope, volume.rescaleIntercept)
+        if self.compressedBricks:
+            bricks = CompressedBrickVolume.fromVolume(volume, codec=BrickCodec(self.brickCodec), cache=self.brickCache)
+            if cancelled.is_set():
+                return
+            self.storeStudy((key, fingerprint), bricks.toGeometryImageData(), rescale, bricks)
+        else:
+            self.storeStudy((key, fingerprint), volume.toImageData(), rescale)
+            # Opening the study later applies its auto window/level without a scan; a histogram stored
+            # next to memory-mapped voxels spares reading all of their pages here
+            histogram = self.volumeCache.loadHistogram(path_to_dir, fingerprint, series_uid) if self.volumeCache is not None else None
+            self.studyCache.setDerived(key, "histogram", histogram if histogram is not None else VolumeHistogram.fromVolume(volume, 1))
+
+    def prefetchWorklist(self, worklist: List[Union[str, Tuple[str, Optional[str]]]]) -> List[Tuple[str, Optional[str]]]:
+        # worklist holds study paths (or (path, series_uid) pairs) in reading order. The studies after
+        # the one on screen are decoded into the study cache, earlier prefetches no longer among the
+        # next prefetch_depth studies are cancelled. Call again whenever the worklist or the study changes.
+        if self.studyCache is None or self.brickDir is not None or self.prefetchDepth <= 0:
+            return []
+        items = [item if isinstance(item, tuple) else (item, None) for item in worklist]
+        keys = [studyKey(path_to_dir, series_uid) for (path_to_dir, series_uid) in items]
+        if self.currentStudy is not None and self.currentStudy[0] in keys:
+            items = items[keys.index(self.currentStudy[0]) + 1:]
+        if self.prefetcher is None:
+            self.prefetcher = StudyPrefetcher(self.prefetchStudy, self.prefetchDepth)
+        return self.prefetcher.schedule(items)
+
+    def show3DMPR(self, path_to_dir: str, series_uid: Optional[str] = None) -> None:
+        # Out-of-core bricked volumes are not held in memory, everything else goes through the study cache
+        self.setCurrentStudy(None)
+        self.currentSource = (path_to_dir, series_uid)
+        if self.studyCache is not None and self.brickDir is None:
+            self.setCurrentStudy(self.getStudyIdentity(path_to_dir, series_uid))
+            entry = self.studyCache.get(*self.currentStudy)
+            if entry is not None:
+                self.setVolumeRescale(*entry.rescale)
+                bricks = entry.derived.get("bricks")
+                if bricks is None and not isArchive(path_to_dir):
+                    self.acquireSharedVolume(path_to_dir, series_uid, self.currentStudy[1], entry.imageData, entry.rescale)
+                self.showImageData(entry.imageData, [bricks]*3 if bricks is not None else None)
+                return
         # Reader
-        self.reader.SetDirectoryName(path_to_dir)
-        self.reader.Update()
-        imageData = self.reader.GetOutput()
-        center = imageData.GetCenter()
+        if isArchive(path_to_dir):
+            imageData = self.loadArchiveVolume(path_to_dir)
+            displayedImageData = [imageData]*3
+        elif self.brickDir is not None:
+            (imageData, displayedImageData) = self.loadVolumeBricked(path_to_dir, series_uid)
+        elif self.compressedBricks:
+            (imageData, displayedImageData) = self.loadVolumeCompressedBricks(path_to_dir, series_uid)
+        elif self.firstPaint:
+            (imageData, displayedImageData) = self.loadVolumeFirstPaint(path_to_dir, series_uid)
+        elif self.progressiveStep > 1:
+            (imageData, displayedImageData) = self.loadVolumeProgressive(path_to_dir, series_uid)
+        else:
+            imageData = self.loadVolume(path_to_dir, series_uid)
+            displayedImageData = [imageData]*3
+        if all(displayed is imageData for displayed in displayedImageData):
+            self.storeStudy(self.currentStudy, imageData, (self.rescaleSlope, self.rescaleIntercept))
+        self.showImageData(imageData, displayedImageData)
+
+    def show3DMPRPhases(self, path_to_dir: str, series_uid: Optional[str] = None) -> None:
+        # Multi-phase (cardiac, perfusion) series, requires multi_phase=True; phase 0 is shown first
+        if not self.multiPhase:
+            raise ValueError("Multi-phase series need MPRViewer(multi_phase=True)")
+        self.setCurrentStudy(None)
+        phases = MultiPhaseLoader(self.loader).loadFiles(self.getSeriesFiles(path_to_dir, series_uid))
+        self.setVolumeRescale(phases.rescaleSlope, phases.rescaleIntercept)
+        self.phases = phases
+        self.phase = 0
+        self.showImageData(phases.getImageData(0))
+
+    def getNumberOfPhases(self) -> int:
+        return self.phases.getNumberOfPhases() if self.phases is not None else 1
+
+    def setPhase(self, phase: int) -> None:
+        # Only the reslice inputs change: axes, cameras, crosshairs and window/level stay as they are
+        if self.phases is None:
+            return
+        self.phase = phase % self.phases.getNumberOfPhases()
+        imageData = self.phases.getImageData(self.phase)
+        self.imageData = imageData
+        self.resliceAxial.SetInputData(imageData)
+        self.resliceCoronal.SetInputData(imageData)
+        self.resliceSagittal.SetInputData(imageData)
+        self.renderWindows()
+
+    def startPhasePlayback(self, frames_per_second: float = 10.0) -> None:
+        # Loops over the phases on the rendering thread until stopPhasePlayback
+        self.stopPhasePlayback()
+        if self.phases is None:
+            return
+        self.phaseTimer = self.renderWindowInteractorAxial.CreateRepeatingTimer(max(1, int(1000 / frames_per_second)))
+        self.phaseTimerObserver = self.renderWindowInteractorAxial.AddObserver(vtkCommand.TimerEvent, self.timerEventHandlePhasePlayback)
+
+    def stopPhasePlayback(self) -> None:
+        if self.phaseTimer is None:
+            return
+        self.renderWindowInteractorAxial.DestroyTimer(self.phaseTimer)
+        self.renderWindowInteractorAxial.RemoveObserver(self.phaseTimerObserver)
+        self.phaseTimer = None
+        self.phaseTimerObserver = None
+
+    def timerEventHandlePhasePlayback(self, obj, event) -> None:
+        if obj.GetTimerEventId() == self.phaseTimer:
+            self.setPhase(self.phase + 1)
+
+    def show3DMPRFromArray(self, array: np.ndarray, spacing: Union[List, Tuple] = (1.0, 1.0, 1.0), origin: Union[List, Tuple] = (0.0, 0.0, 0.0), rescale: Tuple[float, float] = (1.0, 0.0)) -> None:
+        # Views an existing (z, y, x) NumPy volume, C-contiguous arrays are shared rather than copied
+        self.setCurrentStudy(None)
+        self.setVolumeRescale(*rescale)
+        self.showImageData(Volume(array, spacing, origin).toImageData())
+
+    def show3DMPRFromBytes(self, instances: Iterable[Union[bytes, bytearray, memoryview]]) -> None:
+        # Instances are sorted by position and assembled in memory, no filesystem round-trip
+        self.setCurrentStudy(None)
+        if self.ingestor is not None:
+            self.ingestor.close()
+        self.ingestor = DicomByteIngestor(num_workers=self.numWorkers, loader=self.loader)
+        self.ingestor.extend(instances)
+        imageData = self.prepareVolume(self.ingestor.buildVolume()).toImageData()
+        self.showImageData(imageData)
+
+    def show3DMPRFromDICOMweb(self, base_url: str, study_uid: str, series_uid: str, max_in_flight: int = 8) -> None:
+        self.setCurrentStudy(None)
+        if self.ingestor is not None:
+            self.ingestor.close()
+        self.ingestor = DicomByteIngestor(num_workers=self.numWorkers, loader=self.loader)
+        retriever = WADORSRetriever(base_url, max_in_flight=max_in_flight)
+        try:
+            retriever.retrieveSeries(study_uid, series_uid, self.ingestor)
+        finally:
+            retriever.close()
+        imageData = self.prepareVolume(self.ingestor.buildVolume()).toImageData()
+        self.showImageData(imageData)
+
+    def appendInstances(self, instances: Iterable[Union[bytes, bytearray, memoryview]]) -> threading.Thread:
+        # Can be called from any thread while the viewer runs, the grown volume is swapped in
+        # on the rendering thread
+        self.ingestor.extend(instances)
+
+        def rebuild() -> None:
+            imageData = self.prepareVolume(self.ingestor.buildVolume()).toImageData()
+            self.runOnMainThread(lambda: self.setInputVolume(imageData))
+
+        thread = threading.Thread(target=rebuild, name="AppendInstances", daemon=True)
+        thread.start()
+        return thread
+
+    def showImageData(self, imageData: vtk.vtkImageData, displayedImageData: Optional[List[vtk.vtkImageData]] = None) -> None:
+        if displayedImageData is None:
+            displayedImageData = [imageData]*3
+        self.clearSliceCaches()
+        self.cancelRefinement()
+        self.imageData = imageData
+        # Start the crosshair on voxel planes (within half a voxel of the center), so that the initial
+        # planes and every wheel step from them are served by the axis-aligned fast path
+        (origin, spacing) = (imageData.GetOrigin(), imageData.GetSpacing())
+        center = [origin[i] + round((imageData.GetCenter()[i] - origin[i]) / spacing[i])*spacing[i] for i in range(3)]
         (xMin, xMax, yMin, yMax, zMin, zMax) = imageData.GetBounds()
 
         # Set crosshair position in views
@@ -304,34 +1157,25 @@ class MPRViewer(object):
         )
         
         # Extract a slice in the desired orientation
-        self.resliceAxial.SetInputData(imageData)
-        self.resliceAxial.SetOutputDimensionality(2)
-        self.resliceAxial.SetResliceAxes(self.axial)
-        self.resliceAxial.SetInterpolationModeToLinear()
+        self.resliceAxial.SetInputData(displayedImageData[0])
+        self.resliceAxial.SetInterpolationMode(self.refinedInterpolation)
 
-        self.resliceCoronal.SetInputData(imageData)
-        self.resliceCoronal.SetOutputDimensionality(2)
-        self.resliceCoronal.SetResliceAxes(self.coronal)
-        self.resliceCoronal.SetInterpolationModeToLinear()
+        self.resliceCoronal.SetInputData(displayedImageData[1])
+        self.resliceCoronal.SetInterpolationMode(self.refinedInterpolation)
         
-        self.resliceSagittal.SetInputData(imageData)
-        self.resliceSagittal.SetOutputDimensionality(2)
-        self.resliceSagittal.SetResliceAxes(self.sagittal)
-        self.resliceSagittal.SetInterpolationModeToLinear()
-
-        # Display
-        self.actorAxial.GetMapper().SetInputConnection(self.resliceAxial.GetOutputPort())
-        self.actorCoronal.GetMapper().SetInputConnection(self.resliceCoronal.GetOutputPort())
-        self.actorSagittal.GetMapper().SetInputConnection(self.resliceSagittal.GetOutputPort())
-
-        # Set position and rotate in world coordinates
-        self.actorAxial.SetUserMatrix(self.axial)
-        self.actorCoronal.SetUserMatrix(self.coronal)
-        self.actorSagittal.SetUserMatrix(self.sagittal)
+        self.resliceSagittal.SetInputData(displayedImageData[2])
+        self.resliceSagittal.SetInterpolationMode(self.refinedInterpolation)
+        # Partial inputs (first paint, progressive) get their pyramid once the full volume is swapped in
+        if all(displayed is imageData for displayed in displayedImageData):
+            self.buildPyramid(imageData)
+            self.buildMinMaxIndex(imageData)
+            self.buildHistogram(imageData)
+        elif isinstance(displayedImageData[0], CompressedBrickVolume):
+            self.buildMinMaxIndex(imageData, displayedImageData[0])
+
+        self.setWindowLevel(self.colorWindow, self.colorLevel)
 
         # Set renderers
-        self.rendererAxial.AddActor(self.actorAxial)
-        self.rendererAxial.AddActor(self.linesAxialActor)
         # The reset camera call is figuring out the frustum bounds based on all the actors present
         # in the viewport.
         self.rendererAxial.ResetCamera()
@@ -341,8 +1185,6 @@ class MPRViewer(object):
         self.cameraAxialView.SetThickness(2*zMax)
         self.rendererAxial.SetActiveCamera(self.cameraAxialView)
 
-        self.rendererCoronal.AddActor(self.actorCoronal)
-        self.rendererCoronal.AddActor(self.linesCoronalActor)
         # The reset camera call is figuring out the frustum bounds based on all the actors present
         # in the viewport.
         self.rendererCoronal.ResetCamera()
@@ -352,8 +1194,6 @@ class MPRViewer(object):
         self.cameraCoronalView.SetThickness(2*yMax)
         self.rendererCoronal.SetActiveCamera(self.cameraCoronalView)
 
-        self.rendererSagittal.AddActor(self.actorSagittal)
-        self.rendererSagittal.AddActor(self.linesSagittalActor)
         # The reset camera call is figuring out the frustum bounds based on all the actors present
         # in the viewport.
         self.rendererSagittal.ResetCamera()
@@ -364,15 +1204,53 @@ class MPRViewer(object):
         self.rendererSagittal.SetActiveCamera(self.cameraSagittalView)
         self.renderWindows()
 
-        # Create callback function for sphere widget interaction
-        currentSphereWidgetCenter = {
+        # Crosshair centers the interaction handlers move from, updated in place for every study
+        self.sphereWidgetCenters.update({
             "axial": self.sphereWidgetAxial.GetCenter(),
             "coronal": self.sphereWidgetCoronal.GetCenter(),
             "sagittal": self.sphereWidgetSagittal.GetCenter()
-        }
-        currentSphereWidgetCenterRotateLinesAxial = {
+        })
+        self.sphereWidgetCentersRotateLines.update({
             "green": self.sphereWidgetInteractionRotateGreenLineAxial.GetCenter()
-        }
+        })
+
+        # Observers, timers and the event loop are set up with the first study only; later studies
+        # are shown from within the running event loop
+        if not self.interactionInitialized:
+            self.interactionInitialized = True
+            self.initInteraction()
+            self.renderWindowInteractorAxial.Start()
+
+    def initPipeline(self) -> None:
+        # Reslice -> actor wiring, identical for every study
+        self.resliceAxial.SetOutputDimensionality(2)
+        self.resliceAxial.SetResliceAxes(self.axial)
+        self.resliceCoronal.SetOutputDimensionality(2)
+        self.resliceCoronal.SetResliceAxes(self.coronal)
+        self.resliceSagittal.SetOutputDimensionality(2)
+        self.resliceSagittal.SetResliceAxes(self.sagittal)
+
+        # Display
+        self.actorAxial.GetMapper().SetInputConnection(self.resliceAxial.GetOutputPort())
+        self.actorCoronal.GetMapper().SetInputConnection(self.resliceCoronal.GetOutputPort())
+        self.actorSagittal.GetMapper().SetInputConnection(self.resliceSagittal.GetOutputPort())
+
+        # Set position and rotate in world coordinates
+        self.actorAxial.SetUserMatrix(self.axial)
+        self.actorCoronal.SetUserMatrix(self.coronal)
+        self.actorSagittal.SetUserMatrix(self.sagittal)
+
+        self.rendererAxial.AddActor(self.actorAxial)
+        self.rendererAxial.AddActor(self.linesAxialActor)
+        self.rendererCoronal.AddActor(self.actorCoronal)
+        self.rendererCoronal.AddActor(self.linesCoronalActor)
+        self.rendererSagittal.AddActor(self.actorSagittal)
+        self.rendererSagittal.AddActor(self.linesSagittalActor)
+
+    def initInteraction(self) -> None:
+        # Create callback function for sphere widget interaction
+        currentSphereWidgetCenter = self.sphereWidgetCenters
+        currentSphereWidgetCenterRotateLinesAxial = self.sphereWidgetCentersRotateLines
 
         def setupCameraAxialView(newPosition: Union[List, Tuple]) -> None:
             cameraPosition = self.rendererAxial.GetActiveCamera().GetPosition()
@@ -555,7 +1433,20 @@ class MPRViewer(object):
         
         self.sphereWidgetSagittal.AddObserver(vtkCommand.InteractionEvent, interactionEventHandleTranslateLinesSagittalView)
 
+        # Level of detail while dragging
+        for widget in [self.sphereWidgetAxial, self.sphereWidgetCoronal, self.sphereWidgetSagittal, self.sphereWidgetInteractionRotateGreenLineAxial]:
+            widget.AddObserver(vtkCommand.StartInteractionEvent, self.startInteractionEventHandleLevelOfDetail)
+            widget.AddObserver(vtkCommand.InteractionEvent, self.interactionEventHandleLevelOfDetail)
+            widget.AddObserver(vtkCommand.EndInteractionEvent, self.endInteractionEventHandleLevelOfDetail)
+
+        # Interactive interpolation while dragging, refined once the input has been idle
+        for widget in [self.sphereWidgetAxial, self.sphereWidgetCoronal, self.sphereWidgetSagittal, self.sphereWidgetInteractionRotateGreenLineAxial]:
+            widget.AddObserver(vtkCommand.StartInteractionEvent, self.interactionEventHandleInterpolation)
+            widget.AddObserver(vtkCommand.InteractionEvent, self.interactionEventHandleInterpolation)
+
         def mouseWheelEventHandleAxialView(obj, event) -> None:
+            # A burst of wheel steps is rendered with the interactive interpolation
+            self.startInteractiveInterpolation()
             sliceSpacing = self.resliceAxial.GetOutput().GetSpacing()[2]
             cameraPosition = self.rendererAxial.GetActiveCamera().GetPosition()
             focalPoint = self.rendererAxial.GetActiveCamera().GetFocalPoint()
@@ -603,6 +1494,8 @@ class MPRViewer(object):
             self.renderWindowSagittal.Render()
 
         def mouseWheelEventHandleCoronalView(obj, event) -> None:
+            # A burst of wheel steps is rendered with the interactive interpolation
+            self.startInteractiveInterpolation()
             sliceSpacing = self.resliceCoronal.GetOutput().GetSpacing()[2]
             cameraPosition = self.rendererCoronal.GetActiveCamera().GetPosition()
             focalPoint = self.rendererCoronal.GetActiveCamera().GetFocalPoint()
@@ -649,6 +1542,8 @@ class MPRViewer(object):
             self.renderWindowSagittal.Render()
 
         def mouseWheelEventHandleSagittalView(obj, event) -> None:
+            # A burst of wheel steps is rendered with the interactive interpolation
+            self.startInteractiveInterpolation()
             sliceSpacing = self.resliceSagittal.GetOutput().GetSpacing()[2]
             cameraPosition = self.rendererSagittal.GetActiveCamera().GetPosition()
             focalPoint = self.rendererSagittal.GetActiveCamera().GetFocalPoint()
@@ -708,7 +1603,12 @@ class MPRViewer(object):
         # Turn on widgets
         self.turnOnWidgets()
 
-        self.renderWindowInteractorAxial.Start()
+        # Hand work finished by background loaders over to the rendering thread
+        self.renderWindowInteractorAxial.Initialize()
+        self.renderWindowInteractorAxial.AddObserver(vtkCommand.TimerEvent, self.timerEventHandleMainThreadTasks)
+        self.renderWindowInteractorAxial.CreateRepeatingTimer(50)
+        self.renderWindowInteractorAxial.AddObserver(vtkCommand.TimerEvent, self.timerEventHandleRefineInterpolation)
+
 
 if __name__ == "__main__":
     mpr = MPRViewer()
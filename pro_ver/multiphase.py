@@ -0,0 +1,93 @@
+# Multi-phase (4D) series: all phases in one (phase, z, y, x) buffer sharing a single geometry
+
+import vtk
+import numpy as np
+import pydicom
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+from volume_loader import ParallelDICOMLoader, Volume, listDicomFiles, volumeGeometry, slicePosition, sortSlices
+
+def phaseTag(header: pydicom.Dataset) -> Optional[float]:
+    # Cardiac series carry the trigger time, perfusion series the temporal position
+    for keyword in ("TemporalPositionIdentifier", "TriggerTime"):
+        if keyword in header and header.get(keyword) not in (None, ""):
+            return float(header.get(keyword))
+    return None
+
+def acquisitionOrder(header: pydicom.Dataset) -> Tuple[str, int]:
+    return (str(header.get("AcquisitionTime", "")), int(header.get("InstanceNumber", 0) or 0))
+
+def groupPhases(paths: List[str], headers: List[pydicom.Dataset]) -> List[Tuple[List[str], List[pydicom.Dataset]]]:
+    # One (paths, headers) pair per phase, each sorted along the slice normal. Without phase tags,
+    # the k-th acquisition at every slice position is taken as phase k.
+    tags = [phaseTag(header) for header in headers]
+    groups = OrderedDict()
+    if all(tag is not None for tag in tags) and len(set(tags)) > 1:
+        for (path, header, tag) in sorted(zip(paths, headers, tags), key=lambda item: item[2]):
+            groups.setdefault(tag, []).append((path, header))
+    else:
+        positions = OrderedDict()
+        for (path, header) in zip(paths, headers):
+            positions.setdefault(round(slicePosition(header), 3), []).append((path, header))
+        for pairs in positions.values():
+            for (phase, pair) in enumerate(sorted(pairs, key=lambda pair: acquisitionOrder(pair[1]))):
+                groups.setdefault(phase, []).append(pair)
+    phases = [sortSlices([pair[0] for pair in pairs], [pair[1] for pair in pairs]) for pairs in groups.values()]
+    if len(set(len(phasePaths) for (phasePaths, _) in phases)) > 1:
+        raise ValueError("Phases have differing numbers of slices")
+    return phases
+
+class MultiPhaseVolume(object):
+    def __init__(self, array: np.ndarray, spacing: Union[List, Tuple], origin: Union[List, Tuple], direction: Optional[Union[List, Tuple]] = None) -> None:
+        # array is (phase, z, y, x), every phase has the geometry of the first one
+        self.array = array
+        self.spacing = tuple(float(s) for s in spacing)
+        self.origin = tuple(float(o) for o in origin)
+        self.direction = tuple(direction) if direction is not None else (1, 0, 0, 0, 1, 0, 0, 0, 1)
+        self.rescaleSlope = 1.0
+        self.rescaleIntercept = 0.0
+        # phase -> zero-copy vtkImageData wrapper, created on first use
+        self.imageData = {}
+
+    def setRescale(self, slope: float, intercept: float) -> None:
+        self.rescaleSlope = float(slope)
+        self.rescaleIntercept = float(intercept)
+
+    def getNumberOfPhases(self) -> int:
+        return self.array.shape[0]
+
+    def getNumberOfBytes(self) -> int:
+        return self.array.nbytes
+
+    def getPhase(self, phase: int) -> Volume:
+        # View on the shared buffer, nothing is copied
+        volume = Volume(self.array[phase], self.spacing, self.origin, self.direction)
+        volume.setRescale(self.rescaleSlope, self.rescaleIntercept)
+        return volume
+
+    def getImageData(self, phase: int) -> vtk.vtkImageData:
+        if phase not in self.imageData:
+            self.imageData[phase] = self.getPhase(phase).toImageData()
+        return self.imageData[phase]
+
+class MultiPhaseLoader(object):
+    def __init__(self, loader: ParallelDICOMLoader) -> None:
+        self.loader = loader
+
+    def loadFiles(self, paths: List[str]) -> MultiPhaseVolume:
+        (paths, headers) = self.loader.readHeaders(paths)
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found")
+        phases = groupPhases(paths, headers)
+        (spacing, origin, direction) = volumeGeometry(phases[0][1])
+        # One dtype and rescale for all phases, so any phase can be swapped in without touching the window/level
+        first = headers[0]
+        array = np.empty((len(phases), len(phases[0][0]), int(first.Rows), int(first.Columns)), dtype=self.loader.getVolumeDtype(headers))
+        volume = MultiPhaseVolume(array, spacing, origin, direction)
+        volume.setRescale(*self.loader.getVolumeRescale(headers))
+        for (phase, (phasePaths, _)) in enumerate(phases):
+            self.loader.decodeInto(volume.getPhase(phase), phasePaths)
+        return volume
+
+    def loadDirectory(self, path_to_dir: str) -> MultiPhaseVolume:
+        return self.loadFiles(listDicomFiles(path_to_dir))
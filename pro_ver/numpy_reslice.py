@@ -0,0 +1,269 @@
+# Reslicing in NumPy behind a vtkImageReslice compatible algorithm
+
+import math
+import vtk
+import numpy as np
+from vtkmodules.util import numpy_support
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+from typing import Union, List, Tuple, Optional
+
+def matrixToArray(matrix: vtk.vtkMatrix4x4) -> np.ndarray:
+    return np.array([[matrix.GetElement(i, j) for j in range(4)] for i in range(4)], dtype=np.float64)
+
+def computeOutputInformation(axes: np.ndarray, inOrigin: Union[List, Tuple], inSpacing: Union[List, Tuple], inExtent: Union[List, Tuple], dimensionality: int = 2) -> Tuple[Tuple, Tuple, Tuple]:
+    # Same defaults as vtkImageReslice: the input spacing, extent and center transformed by the
+    # direction cosines of the reslice axes
+    inCenter = [inOrigin[j] + 0.5*(inExtent[2*j] + inExtent[2*j + 1])*inSpacing[j] for j in range(3)]
+    outOrigin = [0.0, 0.0, 0.0]
+    outSpacing = [1.0, 1.0, 1.0]
+    outExtent = [0, 0, 0, 0, 0, 0]
+    for i in range(3):
+        s = d = e = c = r = 0.0
+        for j in range(3):
+            tmp = axes[j][i] * axes[j][i]
+            s += tmp * abs(inSpacing[j])
+            d += tmp * (inExtent[2*j + 1] - inExtent[2*j]) * abs(inSpacing[j])
+            e += tmp * inExtent[2*j]
+            c += axes[j][i] * (inCenter[j] - axes[j][3])
+            r += tmp
+        s /= r
+        d /= r * math.sqrt(r)
+        e /= r
+        outSpacing[i] = s
+        outExtent[2*i] = int(round(e))
+        outExtent[2*i + 1] = int(round(outExtent[2*i] + abs(d/s)))
+        outOrigin[i] = c - 0.5*(outExtent[2*i] + outExtent[2*i + 1])*s
+    if dimensionality <= 2:
+        outExtent[4] = outExtent[5] = 0
+        outOrigin[2] = 0.0
+    if dimensionality <= 1:
+        outExtent[2] = outExtent[3] = 0
+        outOrigin[1] = 0.0
+    return (tuple(outOrigin), tuple(outSpacing), tuple(outExtent))
+
+def computeSampleIndices(axes: np.ndarray, outOrigin: Union[List, Tuple], outSpacing: Union[List, Tuple], outExtent: Union[List, Tuple], inOrigin: Union[List, Tuple], inSpacing: Union[List, Tuple]) -> np.ndarray:
+    # Continuous input indices (x, y, z) of every output voxel, shape (3, nz, ny, nx)
+    grids = [(outOrigin[i] + np.arange(outExtent[2*i], outExtent[2*i + 1] + 1)*outSpacing[i]) for i in range(3)]
+    (pz, py, px) = np.meshgrid(grids[2], grids[1], grids[0], indexing="ij")
+    points = np.stack([px, py, pz])
+    world = np.tensordot(axes[:3, :3], points, axes=1) + axes[:3, 3].reshape(3, 1, 1, 1)
+    return (world - np.reshape(inOrigin, (3, 1, 1, 1))) / np.reshape(inSpacing, (3, 1, 1, 1))
+
+def nearestIndices(points: np.ndarray) -> np.ndarray:
+    # vtkImageReslice quantizes sample positions to 1/65536 voxel before rounding, so a sample a
+    # floating point error short of half way (e.g. the center plane of an even axis) goes up
+    return np.floor(points + (0.5 + 2.0**-17)).astype(np.int64)
+
+def interpolate(sampler, indices: np.ndarray, mode: int = vtk.VTK_RESLICE_LINEAR, background: float = 0.0) -> np.ndarray:
+    dims = np.array(sampler.getDimensions()).reshape(3, 1, 1, 1)
+    # Like vtkImageReslice, samples up to half a voxel outside the volume are clamped to its border
+    tolerance = 0.5
+    inside = np.all((indices >= -tolerance) & (indices <= dims - 1 + tolerance), axis=0)
+    result = np.full(indices.shape[1:], background, dtype=np.float32)
+    if not inside.any():
+        return result
+    points = np.clip(indices[:, inside], 0, dims.reshape(3, 1) - 1)
+    if mode == vtk.VTK_RESLICE_NEAREST:
+        nearest = nearestIndices(points)
+        result[inside] = sampler.sampleVoxels(nearest[0], nearest[1], nearest[2])
+        return result
+    base = np.floor(points).astype(np.int64)
+    upper = np.minimum(base + 1, dims.reshape(3, 1) - 1)
+    fraction = (points - base).astype(np.float32)
+    values = np.zeros(points.shape[1], dtype=np.float32)
+    for corner in range(8):
+        select = [(corner >> axis) & 1 for axis in range(3)]
+        ix = upper[0] if select[0] else base[0]
+        iy = upper[1] if select[1] else base[1]
+        iz = upper[2] if select[2] else base[2]
+        weight = np.ones(points.shape[1], dtype=np.float32)
+        for axis in range(3):
+            weight *= fraction[axis] if select[axis] else 1 - fraction[axis]
+        values += weight * sampler.sampleVoxels(ix, iy, iz)
+    result[inside] = values
+    return result
+
+def axisAlignedView(array: np.ndarray, axes: np.ndarray, inOrigin: Union[List, Tuple], inSpacing: Union[List, Tuple], outOrigin: Union[List, Tuple], outSpacing: Union[List, Tuple], outExtent: Union[List, Tuple], mode: int = vtk.VTK_RESLICE_LINEAR, tolerance: float = 1e-3) -> Optional[np.ndarray]:
+    # Output of an axis-aligned reslice as a view on the (z, y, x) array, or None when it needs
+    # resampling. The rotation must be a signed permutation, output and input spacing must match,
+    # every sample must lie inside the volume and, unless the mode is nearest neighbour, on a voxel
+    # (within tolerance voxels) so that interpolation would return the voxel itself.
+    rotation = np.rint(axes[:3, :3])
+    if np.abs(axes[:3, :3] - rotation).max() > 1e-9 or not (np.abs(rotation).sum(axis=0) == 1).all() or not (np.abs(rotation).sum(axis=1) == 1).all():
+        return None
+    dims = array.shape[::-1]
+    slices = [None, None, None]
+    # Output axis fed by each array axis (z, y, x)
+    outputAxes = [None, None, None]
+    for i in range(3):
+        j = int(np.flatnonzero(rotation[:, i])[0])
+        sign = rotation[j, i]
+        count = outExtent[2*i + 1] - outExtent[2*i] + 1
+        start = (axes[j][3] + sign*(outOrigin[i] + outExtent[2*i]*outSpacing[i]) - inOrigin[j]) / inSpacing[j]
+        step = sign*outSpacing[i]/inSpacing[j]
+        if count > 1 and abs(abs(step) - 1) > tolerance:
+            return None
+        step = int(round(step)) if count > 1 else 1
+        first = int(nearestIndices(np.array(start)))
+        if mode != vtk.VTK_RESLICE_NEAREST and abs(start - first) > tolerance:
+            return None
+        last = first + step*(count - 1)
+        if min(first, last) < 0 or max(first, last) > dims[j] - 1:
+            return None
+        # Nearest neighbour samples outside the volume are background, not the edge voxel
+        if min(start, start + step*(count - 1)) < -tolerance or max(start, start + step*(count - 1)) > dims[j] - 1 + tolerance:
+            return None
+        slices[2 - j] = slice(first, last + 1) if step > 0 else slice(first, last - 1 if last > 0 else None, -1)
+        outputAxes[2 - j] = i
+    # Output array axes are (z, y, x) of the output
+    order = [outputAxes.index(2 - q) for q in range(3)]
+    return array[tuple(slices)].transpose(order)
+
+def setImageScalars(output: vtk.vtkImageData, values: np.ndarray, origin: Union[List, Tuple], spacing: Union[List, Tuple], extent: Union[List, Tuple], source: Optional[np.ndarray] = None) -> None:
+    # Contiguous views on source (axis-aligned planes) are wrapped without copying, the output then
+    # shares memory with the volume and must be treated as read-only
+    output.SetExtent(extent)
+    output.SetSpacing(spacing)
+    output.SetOrigin(origin)
+    deep = not (source is not None and values.flags.c_contiguous and np.may_share_memory(values, source))
+    scalars = numpy_support.numpy_to_vtk(np.ascontiguousarray(values).reshape(-1), deep=deep)
+    scalars.SetName("ReslicedImage")
+    output.GetPointData().SetScalars(scalars)
+
+def castLike(values: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    # vtkImageReslice keeps the input scalar type and rounds integer results
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.rint(values), info.min, info.max).astype(dtype)
+    return values.astype(dtype)
+
+class ImageDataSampler(object):
+    def __init__(self, imageData: vtk.vtkImageData) -> None:
+        self.imageData = imageData
+        (nx, ny, nz) = imageData.GetDimensions()
+        self.array = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(nz, ny, nx)
+        self.dtype = self.array.dtype
+
+    def getDimensions(self) -> Tuple[int, int, int]:
+        return self.imageData.GetDimensions()
+
+    def getOrigin(self) -> Tuple[float, float, float]:
+        return self.imageData.GetOrigin()
+
+    def getSpacing(self) -> Tuple[float, float, float]:
+        return self.imageData.GetSpacing()
+
+    def getExtent(self) -> Tuple[int, int, int, int, int, int]:
+        return self.imageData.GetExtent()
+
+    def sampleVoxels(self, ix: np.ndarray, iy: np.ndarray, iz: np.ndarray) -> np.ndarray:
+        return self.array[iz, iy, ix]
+
+class PythonImageReslice(VTKPythonAlgorithmBase):
+    # Drop-in replacement for the parts of vtkImageReslice that MPRViewer uses. The input is either a
+    # vtkImageData or any sampler providing getDimensions/getOrigin/getSpacing/getExtent/sampleVoxels.
+    # The resampling itself is done by a reslice engine (see reslice_engine), or by interpolate() without one.
+    def __init__(self, engine: Optional[object] = None) -> None:
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType="vtkImageData")
+        self.engine = engine
+        self.sampler = None
+        self.resliceAxes = None
+        self.resliceAxesObserver = None
+        self.outputDimensionality = 3
+        self.interpolationMode = vtk.VTK_RESLICE_NEAREST
+        self.backgroundLevel = 0.0
+
+    def SetInputData(self, data: object) -> None:
+        self.sampler = ImageDataSampler(data) if isinstance(data, vtk.vtkImageData) else data
+        self.Modified()
+
+    def GetSampler(self) -> object:
+        return self.sampler
+
+    def GetOutput(self) -> vtk.vtkImageData:
+        # VTKPythonAlgorithmBase only provides GetOutputDataObject
+        return self.GetOutputDataObject(0)
+
+    def SetResliceAxes(self, matrix: vtk.vtkMatrix4x4) -> None:
+        if self.resliceAxes is not None:
+            self.resliceAxes.RemoveObserver(self.resliceAxesObserver)
+        self.resliceAxes = matrix
+        # vtkImageReslice folds the axes MTime into its own, do the same through an observer
+        self.resliceAxesObserver = matrix.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda obj, event: self.Modified())
+        self.Modified()
+
+    def GetResliceAxes(self) -> vtk.vtkMatrix4x4:
+        return self.resliceAxes
+
+    def SetOutputDimensionality(self, dimensionality: int) -> None:
+        self.outputDimensionality = dimensionality
+        self.Modified()
+
+    def GetOutputDimensionality(self) -> int:
+        return self.outputDimensionality
+
+    def SetResliceEngine(self, engine: Optional[object]) -> None:
+        self.engine = engine
+        self.Modified()
+
+    def GetResliceEngine(self) -> Optional[object]:
+        return self.engine
+
+    def SetInterpolationMode(self, mode: int) -> None:
+        if mode != self.interpolationMode:
+            self.interpolationMode = mode
+            self.Modified()
+
+    def GetInterpolationMode(self) -> int:
+        return self.interpolationMode
+
+    def SetInterpolationModeToNearestNeighbor(self) -> None:
+        self.SetInterpolationMode(vtk.VTK_RESLICE_NEAREST)
+
+    def SetInterpolationModeToLinear(self) -> None:
+        self.SetInterpolationMode(vtk.VTK_RESLICE_LINEAR)
+
+    def SetInterpolationModeToCubic(self) -> None:
+        # Accepted for interface parity with vtkImageReslice, the NumPy paths sample it as linear
+        self.SetInterpolationMode(vtk.VTK_RESLICE_CUBIC)
+
+    def SetBackgroundLevel(self, level: float) -> None:
+        self.backgroundLevel = level
+        self.Modified()
+
+    def getAxes(self) -> np.ndarray:
+        return matrixToArray(self.resliceAxes) if self.resliceAxes is not None else np.identity(4)
+
+    def computeOutputInformation(self) -> Tuple[Tuple, Tuple, Tuple]:
+        return computeOutputInformation(self.getAxes(), self.sampler.getOrigin(), self.sampler.getSpacing(), self.sampler.getExtent(), self.outputDimensionality)
+
+    def resliceToArray(self) -> Tuple[np.ndarray, Tuple, Tuple, Tuple]:
+        axes = self.getAxes()
+        (outOrigin, outSpacing, outExtent) = self.computeOutputInformation()
+        array = getattr(self.sampler, "array", None)
+        if array is not None:
+            view = axisAlignedView(array, axes, self.sampler.getOrigin(), self.sampler.getSpacing(), outOrigin, outSpacing, outExtent, self.interpolationMode)
+            if view is not None:
+                return (view, outOrigin, outSpacing, outExtent)
+        if self.engine is not None:
+            values = self.engine.reslice(self.sampler, axes, outOrigin, outSpacing, outExtent, self.interpolationMode, self.backgroundLevel)
+            return (values, outOrigin, outSpacing, outExtent)
+        indices = computeSampleIndices(axes, outOrigin, outSpacing, outExtent, self.sampler.getOrigin(), self.sampler.getSpacing())
+        values = interpolate(self.sampler, indices, self.interpolationMode, self.backgroundLevel)
+        return (castLike(values, self.sampler.dtype), outOrigin, outSpacing, outExtent)
+
+    def RequestInformation(self, request: vtk.vtkInformation, inInfo: tuple, outInfo: vtk.vtkInformationVector) -> int:
+        if self.sampler is None:
+            return 0
+        (outOrigin, outSpacing, outExtent) = self.computeOutputInformation()
+        info = outInfo.GetInformationObject(0)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(), outExtent, 6)
+        info.Set(vtk.vtkDataObject.SPACING(), outSpacing, 3)
+        info.Set(vtk.vtkDataObject.ORIGIN(), outOrigin, 3)
+        return 1
+
+    def RequestData(self, request: vtk.vtkInformation, inInfo: tuple, outInfo: vtk.vtkInformationVector) -> int:
+        output = vtk.vtkImageData.GetData(outInfo)
+        (values, outOrigin, outSpacing, outExtent) = self.resliceToArray()
+        setImageScalars(output, values, outOrigin, outSpacing, outExtent, getattr(self.sampler, "array", None))
+        return 1
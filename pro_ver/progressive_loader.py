@@ -0,0 +1,40 @@
+# Coarse-to-fine loading: every Nth slice first, the remaining slices in the background
+
+import threading
+import numpy as np
+from typing import Callable, List, Tuple, Optional
+from volume_loader import ParallelDICOMLoader, Volume
+
+class ProgressiveLoader(object):
+    def __init__(self, loader: ParallelDICOMLoader, step: int = 4) -> None:
+        self.loader = loader
+        self.step = max(1, int(step))
+        self.thread = None
+
+    def loadCoarse(self, paths: List[str]) -> Tuple[Volume, Volume, List[str]]:
+        (paths, headers) = self.loader.readHeaders(paths)
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found")
+        # The full buffer is allocated up front, coarse slices are decoded straight into it
+        volume = self.loader.allocateVolume(headers)
+        indices = list(range(0, len(paths), self.step))
+        self.loader.decodeInto(volume, paths, indices)
+        (sx, sy, sz) = volume.spacing
+        coarseVolume = Volume(np.ascontiguousarray(volume.array[::self.step]), (sx, sy, sz*self.step), volume.origin, volume.direction)
+        coarseVolume.setRescale(volume.rescaleSlope, volume.rescaleIntercept)
+        return (volume, coarseVolume, paths)
+
+    def fillInBackground(self, volume: Volume, paths: List[str], on_finished: Callable[[Volume], None]) -> threading.Thread:
+        indices = [i for i in range(len(paths)) if i % self.step != 0]
+
+        def run() -> None:
+            self.loader.decodeInto(volume, paths, indices)
+            on_finished(volume)
+
+        self.thread = threading.Thread(target=run, name="ProgressiveLoader", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,95 @@
+# Interchangeable reslice engines: (volume, 4x4 reslice axes, output geometry) -> resampled slice
+
+import vtk
+import numpy as np
+from vtkmodules.util import numpy_support
+from typing import Tuple
+from numpy_reslice import computeSampleIndices, interpolate, nearestIndices, castLike
+
+class ResliceEngine(object):
+    # The volume is a sampler (ImageDataSampler, BrickedVolume, ...), axes a 4x4 NumPy array in
+    # vtkImageReslice convention. The result is (nz, ny, nx) in the input dtype, nz = 1 for 2D outputs.
+    name = None
+
+    def reslice(self, sampler: object, axes: np.ndarray, origin: Tuple, spacing: Tuple, extent: Tuple, mode: int = vtk.VTK_RESLICE_LINEAR, background: float = 0.0) -> np.ndarray:
+        raise NotImplementedError
+
+class VTKResliceEngine(ResliceEngine):
+    # vtkImageReslice on the in-memory vtkImageData behind the sampler
+    name = "vtk"
+
+    def __init__(self) -> None:
+        self.resliceAxes = vtk.vtkMatrix4x4()
+        self.imageReslice = vtk.vtkImageReslice()
+        self.imageReslice.SetResliceAxes(self.resliceAxes)
+
+    def reslice(self, sampler: object, axes: np.ndarray, origin: Tuple, spacing: Tuple, extent: Tuple, mode: int = vtk.VTK_RESLICE_LINEAR, background: float = 0.0) -> np.ndarray:
+        imageData = getattr(sampler, "imageData", None)
+        if imageData is None:
+            raise ValueError("The vtk reslice engine needs an in-memory vtkImageData input")
+        if self.imageReslice.GetInput() is not imageData:
+            self.imageReslice.SetInputData(imageData)
+        self.resliceAxes.DeepCopy(np.asarray(axes, dtype=np.float64).reshape(-1).tolist())
+        self.imageReslice.SetOutputOrigin(origin)
+        self.imageReslice.SetOutputSpacing(spacing)
+        self.imageReslice.SetOutputExtent(extent)
+        self.imageReslice.SetOutputDimensionality(2 if extent[4] == extent[5] else 3)
+        self.imageReslice.SetInterpolationMode(mode)
+        self.imageReslice.SetBackgroundLevel(background)
+        self.imageReslice.Update()
+        output = self.imageReslice.GetOutput()
+        (nx, ny, nz) = output.GetDimensions()
+        # The output buffer is reused by the next call
+        return numpy_support.vtk_to_numpy(output.GetPointData().GetScalars()).reshape(nz, ny, nx).copy()
+
+class NumPyResliceEngine(ResliceEngine):
+    # Vectorized trilinear / nearest sampling; in-memory volumes go through scipy.ndimage when installed
+    name = "numpy"
+
+    def __init__(self, use_scipy: bool = True) -> None:
+        self.useScipy = use_scipy and NumPyResliceEngine.hasScipy()
+
+    @staticmethod
+    def hasScipy() -> bool:
+        try:
+            import scipy.ndimage
+        except ImportError:
+            return False
+        return True
+
+    def reslice(self, sampler: object, axes: np.ndarray, origin: Tuple, spacing: Tuple, extent: Tuple, mode: int = vtk.VTK_RESLICE_LINEAR, background: float = 0.0) -> np.ndarray:
+        indices = computeSampleIndices(axes, origin, spacing, extent, sampler.getOrigin(), sampler.getSpacing())
+        if self.useScipy and hasattr(sampler, "array"):
+            values = self.mapCoordinates(sampler, indices, mode, background)
+        else:
+            values = interpolate(sampler, indices, mode, background)
+        return castLike(values, sampler.dtype)
+
+    def mapCoordinates(self, sampler: object, indices: np.ndarray, mode: int, background: float) -> np.ndarray:
+        from scipy import ndimage
+        # Same edge rule as interpolate(): samples up to half a voxel outside the volume are clamped
+        # to it, everything else is background
+        dims = np.array(sampler.getDimensions()).reshape(3, 1, 1, 1)
+        tolerance = 0.5
+        inside = np.all((indices >= -tolerance) & (indices <= dims - 1 + tolerance), axis=0)
+        result = np.full(indices.shape[1:], background, dtype=np.float32)
+        if not inside.any():
+            return result
+        points = np.clip(indices[:, inside], 0, dims.reshape(3, 1) - 1)
+        if mode == vtk.VTK_RESLICE_NEAREST:
+            nearest = nearestIndices(points)
+            result[inside] = sampler.array[nearest[2], nearest[1], nearest[0]]
+            return result
+        # map_coordinates takes (z, y, x) indices
+        result[inside] = ndimage.map_coordinates(sampler.array, points[::-1], output=np.float32, order=1, mode="nearest", prefilter=False)
+        return result
+
+RESLICE_ENGINES = {
+    VTKResliceEngine.name: VTKResliceEngine,
+    NumPyResliceEngine.name: NumPyResliceEngine
+}
+
+def createResliceEngine(name: str) -> ResliceEngine:
+    if name not in RESLICE_ENGINES:
+        raise ValueError("Unknown reslice engine {}".format(name))
+    return RESLICE_ENGINES[name]()
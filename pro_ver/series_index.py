@@ -0,0 +1,128 @@
+# Header-only DICOM series index stored in SQLite (one row per instance)
+
+import os
+import json
+import sqlite3
+import threading
+import pydicom
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Dict
+from volume_loader import sliceNormal
+
+HEADER_TAGS = [
+    "StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID", "SeriesDescription", "Modality",
+    "InstanceNumber", "ImagePositionPatient", "ImageOrientationPatient", "Rows", "Columns", "PixelSpacing"
+]
+
+def readIndexRow(path: str) -> Optional[Tuple]:
+    try:
+        stat = os.stat(path)
+        header = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+    except (OSError, pydicom.errors.InvalidDicomError):
+        return None
+    if "SeriesInstanceUID" not in header or "ImagePositionPatient" not in header:
+        return None
+    position = [float(v) for v in header.ImagePositionPatient]
+    orientation = [float(v) for v in header.get("ImageOrientationPatient", [1, 0, 0, 0, 1, 0])]
+    spacing = [float(v) for v in header.get("PixelSpacing", [1.0, 1.0])]
+    return (
+        path, stat.st_mtime_ns, stat.st_size,
+        str(header.get("StudyInstanceUID", "")), str(header.SeriesInstanceUID), str(header.get("SOPInstanceUID", "")),
+        str(header.get("SeriesDescription", "")), str(header.get("Modality", "")), int(header.get("InstanceNumber", 0) or 0),
+        position[0], position[1], position[2], json.dumps(orientation),
+        int(header.get("Rows", 0)), int(header.get("Columns", 0)), spacing[0], spacing[1]
+    )
+
+class SeriesIndex(object):
+    def __init__(self, db_path: str, num_workers: Optional[int] = None) -> None:
+        self.dbPath = db_path
+        self.numWorkers = num_workers or os.cpu_count() or 1
+        self.connection = sqlite3.connect(self.dbPath, check_same_thread=False)
+        # The viewer and its prefetch workers share the connection
+        self.lock = threading.RLock()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS instances ("
+            "path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, "
+            "study_uid TEXT, series_uid TEXT, sop_uid TEXT, series_description TEXT, modality TEXT, instance_number INTEGER, "
+            "position_x REAL, position_y REAL, position_z REAL, orientation TEXT, "
+            "rows INTEGER, columns INTEGER, row_spacing REAL, column_spacing REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS instances_series ON instances (series_uid)")
+        # Files that are not DICOM are remembered too so rescans skip them
+        self.connection.execute("CREATE TABLE IF NOT EXISTS ignored (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER)")
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def scan(self, path_to_dir: str) -> Dict[str, int]:
+        # Like listDicomFiles only the files directly in the directory are series slices
+        root = os.path.abspath(path_to_dir)
+        onDisk = {}
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not name.startswith("."):
+                stat = os.stat(path)
+                onDisk[path] = (stat.st_mtime_ns, stat.st_size)
+
+        (where, parameters) = self.getDirectoryFilter(root)
+        known = {}
+        with self.lock:
+            for table in ("instances", "ignored"):
+                for (path, mtime, size) in self.connection.execute("SELECT path, mtime, size FROM {} WHERE {}".format(table, where), parameters):
+                    known[path] = (mtime, size)
+
+        removed = [path for path in known if path not in onDisk]
+        changed = [path for (path, signature) in onDisk.items() if known.get(path) != signature]
+
+        # Only headers of new or modified files are parsed
+        with ThreadPoolExecutor(max_workers=self.numWorkers) as executor:
+            rows = list(executor.map(readIndexRow, changed))
+
+        stale = [(path,) for path in removed + changed]
+        with self.lock:
+            self.connection.executemany("DELETE FROM instances WHERE path = ?", stale)
+            self.connection.executemany("DELETE FROM ignored WHERE path = ?", stale)
+            self.connection.executemany("INSERT INTO instances VALUES ({})".format(", ".join(["?"]*17)), [row for row in rows if row is not None])
+            self.connection.executemany("INSERT INTO ignored VALUES (?, ?, ?)", [(path,) + onDisk[path] for (path, row) in zip(changed, rows) if row is None])
+            self.connection.commit()
+        return {"scanned": len(changed), "removed": len(removed), "unchanged": len(onDisk) - len(changed)}
+
+    def escapeLike(self, text: str) -> str:
+        return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    def getDirectoryFilter(self, path_to_dir: str) -> Tuple[str, Tuple[str, str]]:
+        # WHERE clause matching the rows of the files directly in path_to_dir, not in its subdirectories
+        prefix = self.escapeLike(os.path.join(os.path.abspath(path_to_dir), "")) + "%"
+        return ("path LIKE ? ESCAPE '\\' AND path NOT LIKE ? ESCAPE '\\'", (prefix, prefix + self.escapeLike(os.sep) + "%"))
+
+    def listSeries(self, path_to_dir: Optional[str] = None) -> List[Dict]:
+        query = ("SELECT series_uid, study_uid, series_description, modality, rows, columns, COUNT(*) "
+                 "FROM instances {} GROUP BY series_uid ORDER BY study_uid, series_uid")
+        with self.lock:
+            if path_to_dir is None:
+                rows = self.connection.execute(query.format("")).fetchall()
+            else:
+                (where, parameters) = self.getDirectoryFilter(path_to_dir)
+                rows = self.connection.execute(query.format("WHERE " + where), parameters).fetchall()
+        return [
+            {"series_uid": row[0], "study_uid": row[1], "description": row[2], "modality": row[3], "rows": row[4], "columns": row[5], "instances": row[6]}
+            for row in rows
+        ]
+
+    def getSortedFiles(self, series_uid: str, path_to_dir: Optional[str] = None) -> List[str]:
+        # A series copied to several scanned directories is indexed once per copy, path_to_dir picks one
+        query = "SELECT path, position_x, position_y, position_z, orientation, instance_number FROM instances WHERE series_uid = ?"
+        parameters = (series_uid,)
+        if path_to_dir is not None:
+            (where, directoryParameters) = self.getDirectoryFilter(path_to_dir)
+            query += " AND " + where
+            parameters += directoryParameters
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        if len(rows) == 0:
+            raise KeyError("Unknown series {}".format(series_uid))
+        # All slices of a series share one orientation, sort along its normal
+        normal = sliceNormal(json.loads(rows[0][4]))
+        rows.sort(key=lambda row: (sum(normal[i] * row[1 + i] for i in range(3)), row[5]))
+        return [row[0] for row in rows]
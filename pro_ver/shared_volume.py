@@ -0,0 +1,229 @@
+# Cross-process registry of study volumes in shared memory: one copy of the voxels per study,
+# attached read-only and reference counted by every viewer process that displays it
+
+import os
+import json
+import hashlib
+import contextlib
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from typing import Callable, Iterator, Optional, Tuple
+from volume_loader import Volume
+from volume_cache import studyKey
+from compressed_decoder import mapSharedMemory
+
+if os.name == "posix":
+    import fcntl
+    import _posixshmem
+else:
+    import ctypes
+    import msvcrt
+
+def sharedVolumeKey(path_to_dir: str, fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> str:
+    # A rewritten study gets a new key, viewers still holding the old voxels keep their segment
+    source = studyKey(path_to_dir, series_uid)
+    if fingerprint is not None:
+        source += "|" + fingerprint
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+def openSharedMemory(name: Optional[str] = None, size: int = 0) -> shared_memory.SharedMemory:
+    # Segments outlive the process that created them, the registry unlinks them when the last
+    # reference goes away, so they must not be handed to the per-process resource tracker
+    create = name is None
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        sharedMemory = shared_memory.SharedMemory(name=name, create=create, size=size)
+        # Only POSIX segments are tracked, Windows frees a segment with its last handle
+        if os.name == "posix":
+            resource_tracker.unregister(sharedMemory._name, "shared_memory")
+        return sharedMemory
+
+def unlinkSharedMemory(sharedMemory: shared_memory.SharedMemory) -> None:
+    # SharedMemory.unlink() also unregisters the segment from the resource tracker unless it was
+    # opened with track=False (Python 3.13+). Segments from the fallback above are unregistered
+    # already, a second unregister makes the tracker print a KeyError.
+    if hasattr(sharedMemory, "_track") or os.name != "posix":
+        sharedMemory.unlink()
+    else:
+        _posixshmem.shm_unlink(sharedMemory._name)
+
+def lockFile(file: object) -> None:
+    if os.name == "posix":
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        return
+    # msvcrt locks bytes from the current position and gives up after 10 s, retry until it is ours
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+def unlockFile(file: object) -> None:
+    if os.name == "posix":
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        return
+    file.seek(0)
+    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def isProcessAlive(pid: int) -> bool:
+    if os.name != "posix":
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        # STILL_ACTIVE
+        return code.value == 259
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class SharedVolumeRegistry(object):
+    def __init__(self, registry_dir: str) -> None:
+        # registry_dir must be common to all viewer processes, it holds one JSON entry and one
+        # lock file per study
+        self.registryDir = registry_dir
+        os.makedirs(self.registryDir, exist_ok=True)
+        # key -> number of references held by this process
+        self.references = {}
+
+    def getPaths(self, key: str) -> tuple:
+        return (os.path.join(self.registryDir, key + ".json"), os.path.join(self.registryDir, key + ".lock"))
+
+    @contextlib.contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        # Held while a study is created, so concurrent viewers of the same study wait for the
+        # first decode instead of decoding it again
+        (_, lockPath) = self.getPaths(key)
+        with open(lockPath, "a") as file:
+            lockFile(file)
+            try:
+                yield
+            finally:
+                unlockFile(file)
+
+    def readEntry(self, key: str) -> Optional[dict]:
+        (entryPath, _) = self.getPaths(key)
+        try:
+            with open(entryPath, "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        # References of crashed or exited processes are dropped
+        entry["references"] = dict((pid, count) for (pid, count) in entry["references"].items() if isProcessAlive(int(pid)))
+        return entry
+
+    def writeEntry(self, key: str, entry: dict) -> None:
+        (entryPath, _) = self.getPaths(key)
+        tmpPath = entryPath + ".tmp"
+        with open(tmpPath, "w") as file:
+            json.dump(entry, file)
+        os.replace(tmpPath, entryPath)
+
+    def removeEntry(self, key: str, entry: dict) -> None:
+        (entryPath, _) = self.getPaths(key)
+        try:
+            sharedMemory = openSharedMemory(entry["name"])
+            sharedMemory.close()
+            unlinkSharedMemory(sharedMemory)
+        except FileNotFoundError:
+            pass
+        if os.path.exists(entryPath):
+            os.remove(entryPath)
+
+    def attach(self, entry: dict) -> Volume:
+        shape = tuple(entry["shape"])
+        # Every process maps the same pages read-only, nobody may write to them
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(shape))
+        array = np.frombuffer(mapSharedMemory(entry["name"], max(1, count*dtype.itemsize)), dtype=dtype, count=count).reshape(shape)
+        volume = Volume(array, entry["spacing"], entry["origin"], entry["direction"])
+        volume.setRescale(*entry["rescale"])
+        return volume
+
+    def publish(self, volume: Volume) -> Tuple[dict, Volume]:
+        # Returns the entry and the publisher's attached volume
+        sharedMemory = openSharedMemory(size=max(1, volume.array.nbytes))
+        target = np.ndarray(volume.array.shape, dtype=volume.array.dtype, buffer=sharedMemory.buf)
+        target[...] = volume.array
+        del target
+        entry = {
+            "name": sharedMemory.name,
+            "shape": list(volume.array.shape),
+            "dtype": volume.array.dtype.str,
+            "spacing": list(volume.spacing),
+            "origin": list(volume.origin),
+            "direction": list(volume.direction),
+            "rescale": [volume.rescaleSlope, volume.rescaleIntercept],
+            "references": {}
+        }
+        # Attached before the creating handle is closed, Windows frees a segment with its last handle
+        attached = self.attach(entry)
+        sharedMemory.close()
+        return (entry, attached)
+
+    def acquire(self, key: str, load: Callable[[], Volume]) -> Volume:
+        # Attaches to the study's shared voxels, load() runs only in the first process asking for it
+        with self.lock(key):
+            entry = self.readEntry(key)
+            volume = None
+            if entry is not None:
+                if len(entry["references"]) == 0:
+                    # Every holder died without releasing, start over
+                    self.removeEntry(key, entry)
+                    entry = None
+                else:
+                    try:
+                        volume = self.attach(entry)
+                    except FileNotFoundError:
+                        entry = None
+            if entry is None:
+                (entry, volume) = self.publish(load())
+            pid = str(os.getpid())
+            entry["references"][pid] = entry["references"].get(pid, 0) + 1
+            self.writeEntry(key, entry)
+        self.references[key] = self.references.get(key, 0) + 1
+        return volume
+
+    def release(self, key: str) -> None:
+        # The segment is unlinked with the last reference, mappings that are still open stay valid
+        if self.references.get(key, 0) == 0:
+            return
+        self.references[key] -= 1
+        if self.references[key] == 0:
+            del self.references[key]
+        with self.lock(key):
+            entry = self.readEntry(key)
+            if entry is None:
+                return
+            pid = str(os.getpid())
+            count = entry["references"].get(pid, 0) - 1
+            if count > 0:
+                entry["references"][pid] = count
+            else:
+                entry["references"].pop(pid, None)
+            if len(entry["references"]) == 0:
+                self.removeEntry(key, entry)
+            else:
+                self.writeEntry(key, entry)
+
+    def releaseAll(self) -> None:
+        for key in list(self.references):
+            while key in self.references:
+                self.release(key)
+
+    def getReferenceCount(self, key: str) -> int:
+        with self.lock(key):
+            entry = self.readEntry(key)
+        if entry is None:
+            return 0
+        return sum(entry["references"].values())
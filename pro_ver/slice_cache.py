@@ -0,0 +1,196 @@
+# LRU cache of resliced planes under a byte budget, and a reslice wrapper that serves planes it
+# has already computed from the cache instead of resampling them
+
+import threading
+import vtk
+import numpy as np
+from collections import OrderedDict
+from vtkmodules.util import numpy_support
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+from numpy_reslice import matrixToArray, axisAlignedView, setImageScalars
+from typing import Dict, Optional, Union
+
+def quantizeAxes(matrix: Optional[vtk.vtkMatrix4x4], rotation_step: float = 1e-6, translation_step: float = 1e-4) -> tuple:
+    # Wheel steps back and forth do not land on bit-identical positions, planes closer than the
+    # steps (translation in mm) share one key
+    if matrix is None:
+        return ()
+    key = []
+    for i in range(4):
+        for j in range(4):
+            step = translation_step if j == 3 and i < 3 else rotation_step
+            key.append(int(round(matrix.GetElement(i, j) / step)))
+    return tuple(key)
+
+class SliceCache(object):
+    def __init__(self, max_bytes: int = 32*1024*1024) -> None:
+        self.maxBytes = max_bytes
+        self.bytes = 0
+        self.slices = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[vtk.vtkImageData]:
+        with self.lock:
+            entry = self.slices.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.slices.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, source: object, output: vtk.vtkImageData) -> None:
+        # The source volume is held with its slice, so its id in the key is never reused while cached
+        with self.lock:
+            if key in self.slices:
+                return
+            self.slices[key] = (source, output)
+            self.bytes += output.GetActualMemorySize()*1024
+            while self.bytes > self.maxBytes and len(self.slices) > 1:
+                (_, (_, evicted)) = self.slices.popitem(last=False)
+                self.bytes -= evicted.GetActualMemorySize()*1024
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.slices.clear()
+            self.bytes = 0
+
+    def getStatistics(self) -> Dict[str, Union[int, float]]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.slices),
+                "bytes": self.bytes,
+                "max_bytes": self.maxBytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+            }
+
+class CachedReslice(VTKPythonAlgorithmBase):
+    # Wraps a vtkImageReslice (or PythonImageReslice) with the same interface. The output for an
+    # input volume (identity and modification time), quantized reslice axes and interpolation mode
+    # is resampled once and served from the cache afterwards. Without a cache only the axis-aligned
+    # planes skip the resampling. Outputs share their scalars with the cache (or the input volume)
+    # and must be treated as read-only.
+    def __init__(self, cache: Optional[SliceCache], reslice: Optional[Union[vtk.vtkImageReslice, VTKPythonAlgorithmBase]] = None) -> None:
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType="vtkImageData")
+        self.cache = cache
+        self.reslice = reslice if reslice is not None else vtk.vtkImageReslice()
+        self.input = None
+        self.resliceAxesObserver = None
+
+    def SetInputData(self, data: object) -> None:
+        self.input = data
+        self.reslice.SetInputData(data)
+        self.Modified()
+
+    def GetOutput(self) -> vtk.vtkImageData:
+        # VTKPythonAlgorithmBase only provides GetOutputDataObject
+        return self.GetOutputDataObject(0)
+
+    def SetResliceAxes(self, matrix: vtk.vtkMatrix4x4) -> None:
+        if self.reslice.GetResliceAxes() is not None and self.resliceAxesObserver is not None:
+            self.reslice.GetResliceAxes().RemoveObserver(self.resliceAxesObserver)
+        self.reslice.SetResliceAxes(matrix)
+        self.resliceAxesObserver = matrix.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda obj, event: self.Modified())
+        self.Modified()
+
+    def GetResliceAxes(self) -> vtk.vtkMatrix4x4:
+        return self.reslice.GetResliceAxes()
+
+    def SetOutputDimensionality(self, dimensionality: int) -> None:
+        self.reslice.SetOutputDimensionality(dimensionality)
+        self.Modified()
+
+    def GetOutputDimensionality(self) -> int:
+        return self.reslice.GetOutputDimensionality()
+
+    def SetInterpolationMode(self, mode: int) -> None:
+        if mode != self.reslice.GetInterpolationMode():
+            self.reslice.SetInterpolationMode(mode)
+            self.Modified()
+
+    def GetInterpolationMode(self) -> int:
+        return self.reslice.GetInterpolationMode()
+
+    def SetInterpolationModeToNearestNeighbor(self) -> None:
+        self.SetInterpolationMode(vtk.VTK_RESLICE_NEAREST)
+
+    def SetInterpolationModeToLinear(self) -> None:
+        self.SetInterpolationMode(vtk.VTK_RESLICE_LINEAR)
+
+    def SetInterpolationModeToCubic(self) -> None:
+        self.SetInterpolationMode(vtk.VTK_RESLICE_CUBIC)
+
+    def getCacheKey(self) -> tuple:
+        # Writes into a displayed array show up after Modified(), which bumps the input MTime
+        modified = self.input.GetMTime() if isinstance(self.input, vtk.vtkObject) else 0
+        return (id(self.input), modified, quantizeAxes(self.reslice.GetResliceAxes()), self.reslice.GetInterpolationMode(), self.reslice.GetOutputDimensionality())
+
+    def getInputArray(self) -> Optional[np.ndarray]:
+        # (z, y, x) voxels of in-memory inputs, None for bricked samplers
+        if isinstance(self.input, vtk.vtkImageData):
+            scalars = self.input.GetPointData().GetScalars()
+            if scalars is None or scalars.GetNumberOfComponents() != 1:
+                return None
+            (nx, ny, nz) = self.input.GetDimensions()
+            return numpy_support.vtk_to_numpy(scalars).reshape(nz, ny, nx)
+        return getattr(self.input, "array", None)
+
+    def resliceAxisAligned(self, outInfo: vtk.vtkInformationVector) -> Optional[vtk.vtkImageData]:
+        # Planes along the volume axes that land on voxels are views on the input, no resampling
+        array = self.getInputArray()
+        if array is None or self.reslice.GetResliceAxes() is None:
+            return None
+        info = outInfo.GetInformationObject(0)
+        extent = info.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+        spacing = info.Get(vtk.vtkDataObject.SPACING())
+        origin = info.Get(vtk.vtkDataObject.ORIGIN())
+        if isinstance(self.input, vtk.vtkImageData):
+            (inOrigin, inSpacing) = (self.input.GetOrigin(), self.input.GetSpacing())
+        else:
+            (inOrigin, inSpacing) = (self.input.getOrigin(), self.input.getSpacing())
+        view = axisAlignedView(array, matrixToArray(self.reslice.GetResliceAxes()), inOrigin, inSpacing, origin, spacing, extent, self.reslice.GetInterpolationMode())
+        if view is None:
+            return None
+        imageData = vtk.vtkImageData()
+        setImageScalars(imageData, view, origin, spacing, extent, array)
+        return imageData
+
+    def RequestInformation(self, request: vtk.vtkInformation, inInfo: tuple, outInfo: vtk.vtkInformationVector) -> int:
+        if self.input is None:
+            return 0
+        self.reslice.UpdateInformation()
+        source = self.reslice.GetOutputInformation(0)
+        info = outInfo.GetInformationObject(0)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(), source.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT()), 6)
+        info.Set(vtk.vtkDataObject.SPACING(), source.Get(vtk.vtkDataObject.SPACING()), 3)
+        info.Set(vtk.vtkDataObject.ORIGIN(), source.Get(vtk.vtkDataObject.ORIGIN()), 3)
+        return 1
+
+    def RequestData(self, request: vtk.vtkInformation, inInfo: tuple, outInfo: vtk.vtkInformationVector) -> int:
+        output = vtk.vtkImageData.GetData(outInfo)
+        if self.cache is None:
+            view = self.resliceAxisAligned(outInfo)
+            if view is None:
+                self.reslice.Update()
+                view = self.reslice.GetOutput()
+            output.ShallowCopy(view)
+            return 1
+        key = self.getCacheKey()
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self.resliceAxisAligned(outInfo)
+        if cached is None:
+            self.reslice.Update()
+            cached = vtk.vtkImageData()
+            cached.DeepCopy(self.reslice.GetOutput())
+        self.cache.put(key, self.input, cached)
+        output.ShallowCopy(cached)
+        return 1
@@ -0,0 +1,125 @@
+# In-process LRU cache of loaded studies (decoded image plus derived data) under a byte budget
+
+import threading
+import vtk
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+def derivedBytes(value: object) -> int:
+    if hasattr(value, "getNumberOfBytes"):
+        return int(value.getNumberOfBytes())
+    return int(getattr(value, "nbytes", 0))
+
+class StudyEntry(object):
+    def __init__(self, imageData: vtk.vtkImageData, fingerprint: Optional[str] = None, rescale: Tuple[float, float] = (1.0, 0.0)) -> None:
+        self.imageData = imageData
+        self.fingerprint = fingerprint
+        self.rescale = tuple(rescale)
+        # name -> derived data of the study, e.g. "pyramid" or "histogram"
+        self.derived = {}
+
+    def getNumberOfBytes(self) -> int:
+        # GetActualMemorySize is in KiB
+        return self.imageData.GetActualMemorySize()*1024 + sum(derivedBytes(value) for value in self.derived.values())
+
+class StudyCache(object):
+    def __init__(self, max_bytes: int = 1024*1024*1024) -> None:
+        self.maxBytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Pinned studies (the one on screen) are never evicted
+        self.pinned = set()
+
+    def pin(self, key: str) -> None:
+        with self.lock:
+            self.pinned.add(key)
+
+    def unpin(self, key: str) -> None:
+        with self.lock:
+            self.pinned.discard(key)
+
+    def get(self, key: str, fingerprint: Optional[str] = None) -> Optional[StudyEntry]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and fingerprint is not None and entry.fingerprint != fingerprint:
+                # The study changed on disk since it was cached
+                self.removeLocked(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def contains(self, key: str) -> bool:
+        # Lookup without touching the LRU order or the counters
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key: str, entry: StudyEntry) -> None:
+        with self.lock:
+            if key in self.entries:
+                self.removeLocked(key)
+            self.entries[key] = entry
+            self.sizes[key] = entry.getNumberOfBytes()
+            self.bytes += self.sizes[key]
+            self.evictLocked(key)
+
+    def setDerived(self, key: str, name: str, value: object) -> None:
+        # Derived data counts against the budget of its study
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry.derived[name] = value
+            self.bytes -= self.sizes[key]
+            self.sizes[key] = entry.getNumberOfBytes()
+            self.bytes += self.sizes[key]
+            self.evictLocked(key)
+
+    def getDerived(self, key: str, name: str) -> Optional[object]:
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry.derived.get(name) if entry is not None else None
+
+    def evictLocked(self, keep: str) -> None:
+        # Least recently used first, the entry just added or grown stays even when it alone exceeds the budget
+        for key in list(self.entries.keys()):
+            if self.bytes <= self.maxBytes:
+                break
+            if key == keep or key in self.pinned:
+                continue
+            self.removeLocked(key)
+            self.evictions += 1
+
+    def removeLocked(self, key: str) -> None:
+        del self.entries[key]
+        self.bytes -= self.sizes.pop(key)
+
+    def remove(self, key: str) -> None:
+        with self.lock:
+            if key in self.entries:
+                self.removeLocked(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def getStatistics(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.maxBytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
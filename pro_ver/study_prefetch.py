@@ -0,0 +1,64 @@
+# Background prefetch of the next studies of a worklist into the study cache
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List
+
+def lowerThreadPriority() -> None:
+    # Linux applies nice values per thread and the decode threads a worker starts inherit it,
+    # so prefetching yields the CPU to the interactive thread
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+class StudyPrefetcher(object):
+    def __init__(self, decode: Callable[[Hashable, threading.Event], None], depth: int = 2, num_workers: int = 1) -> None:
+        # decode(item, cancelled) loads one study into the cache, it should give up once cancelled is set
+        self.decode = decode
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="StudyPrefetch", initializer=lowerThreadPriority)
+        self.lock = threading.Lock()
+        # item -> (future, cancelled event) of queued and running prefetches
+        self.scheduled = {}
+        self.completed = 0
+        self.cancelled = 0
+
+    def schedule(self, upcoming: List[Hashable]) -> List[Hashable]:
+        # upcoming is the rest of the worklist in reading order, the first depth items are prefetched
+        # in that order and everything scheduled earlier but no longer among them is cancelled
+        wanted = list(upcoming[:self.depth])
+        with self.lock:
+            for (item, (future, cancelled)) in list(self.scheduled.items()):
+                if future.done():
+                    del self.scheduled[item]
+                elif item not in wanted:
+                    future.cancel()
+                    cancelled.set()
+                    self.cancelled += 1
+                    del self.scheduled[item]
+            for item in wanted:
+                if item not in self.scheduled:
+                    cancelled = threading.Event()
+                    self.scheduled[item] = (self.executor.submit(self.run, item, cancelled), cancelled)
+        return wanted
+
+    def run(self, item: Hashable, cancelled: threading.Event) -> None:
+        if cancelled.is_set():
+            return
+        self.decode(item, cancelled)
+        if not cancelled.is_set():
+            with self.lock:
+                self.completed += 1
+
+    def cancelAll(self) -> None:
+        self.schedule([])
+
+    def close(self) -> None:
+        self.cancelAll()
+        self.executor.shutdown(wait=True)
+
+    def getStatistics(self) -> Dict[str, int]:
+        with self.lock:
+            return {"pending": sum(1 for (future, _) in self.scheduled.values() if not future.done()), "completed": self.completed, "cancelled": self.cancelled}
@@ -0,0 +1,198 @@
+# Persistent on-disk cache of decoded volumes (.npy voxels + .json geometry sidecar)
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from typing import Callable, IO, List, Optional, Tuple
+from volume_loader import Volume, listDicomFiles
+from volume_histogram import VolumeHistogram
+from minmax_index import MinMaxBrickIndex
+
+def studyKey(path_to_dir: str, series_uid: Optional[str] = None) -> str:
+    source = os.path.abspath(path_to_dir)
+    if series_uid is not None:
+        source += "|" + series_uid
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+def directoryFingerprint(path_to_dir: str, files: Optional[List[str]] = None) -> str:
+    # Any added, removed or rewritten file changes the fingerprint
+    if files is None:
+        files = listDicomFiles(path_to_dir)
+    digest = hashlib.sha1()
+    digest.update(str(os.stat(path_to_dir).st_mtime_ns).encode("utf-8"))
+    for path in files:
+        stat = os.stat(path)
+        digest.update("{}|{}|{}\n".format(os.path.relpath(path, path_to_dir), stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return digest.hexdigest()
+
+def writeTemporary(path: str, write: Callable[[IO], None], mode: str = "wb") -> str:
+    # Writes next to path under a name unique to this writer and returns it for os.replace, so
+    # concurrent stores of one study (viewer and prefetch workers) never write into the same file
+    (directory, name) = os.path.split(path)
+    with tempfile.NamedTemporaryFile(mode, dir=directory, prefix=name + ".", suffix=".tmp", delete=False) as file:
+        try:
+            write(file)
+        except BaseException:
+            file.close()
+            os.unlink(file.name)
+            raise
+    return file.name
+
+class VolumeCache(object):
+    def __init__(self, cache_dir: str) -> None:
+        self.cacheDir = cache_dir
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def getKey(self, path_to_dir: str, series_uid: Optional[str] = None) -> str:
+        return studyKey(path_to_dir, series_uid)
+
+    def getFingerprint(self, path_to_dir: str, files: Optional[List[str]] = None) -> str:
+        return directoryFingerprint(path_to_dir, files)
+
+    def getPaths(self, key: str) -> tuple:
+        return (os.path.join(self.cacheDir, key + ".npy"), os.path.join(self.cacheDir, key + ".json"))
+
+    def load(self, path_to_dir: str, fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> Optional[Volume]:
+        (arrayPath, sidecarPath) = self.getPaths(self.getKey(path_to_dir, series_uid))
+        if not (os.path.exists(arrayPath) and os.path.exists(sidecarPath)):
+            return None
+        with open(sidecarPath, "r") as file:
+            sidecar = json.load(file)
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        if sidecar.get("fingerprint") != fingerprint:
+            self.remove(path_to_dir, series_uid)
+            return None
+        # Copy-on-write mapping: nothing is read until a page is touched and VTK gets a writable buffer
+        array = np.load(arrayPath, mmap_mode="c")
+        if list(array.shape) != sidecar["shape"]:
+            self.remove(path_to_dir, series_uid)
+            return None
+        volume = Volume(array, sidecar["spacing"], sidecar["origin"], sidecar["direction"])
+        volume.setRescale(*sidecar.get("rescale", [1.0, 0.0]))
+        return volume
+
+    def store(self, path_to_dir: str, volume: Volume, fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> None:
+        (arrayPath, sidecarPath) = self.getPaths(self.getKey(path_to_dir, series_uid))
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        sidecar = {
+            "source": os.path.abspath(path_to_dir),
+            "series_uid": series_uid,
+            "fingerprint": fingerprint,
+            "shape": list(volume.array.shape),
+            "dtype": volume.array.dtype.str,
+            "spacing": list(volume.spacing),
+            "origin": list(volume.origin),
+            "extent": list(volume.getExtent()),
+            "direction": list(volume.direction),
+            "rescale": [volume.rescaleSlope, volume.rescaleIntercept]
+        }
+        # Write to temporary files first so a crash never leaves a half written entry behind
+        arrayTemporary = writeTemporary(arrayPath, lambda file: np.save(file, np.ascontiguousarray(volume.array)))
+        sidecarTemporary = writeTemporary(sidecarPath, lambda file: json.dump(sidecar, file), "w")
+        os.replace(arrayTemporary, arrayPath)
+        os.replace(sidecarTemporary, sidecarPath)
+
+    def getHistogramPath(self, key: str) -> str:
+        return os.path.join(self.cacheDir, key + ".histogram.npz")
+
+    def loadHistogram(self, path_to_dir: str, fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> Optional[VolumeHistogram]:
+        path = self.getHistogramPath(self.getKey(path_to_dir, series_uid))
+        if not os.path.exists(path):
+            return None
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        with np.load(path) as data:
+            if str(data["fingerprint"]) != fingerprint:
+                return None
+            histogram = VolumeHistogram(data["edges"], tuple(data["rescale"]))
+            histogram.counts = data["counts"]
+        histogram.cumulative = np.cumsum(histogram.getModalityCounts())
+        return histogram
+
+    def storeHistogram(self, path_to_dir: str, histogram: VolumeHistogram, fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> None:
+        # A few KB next to the voxels, reopening a cached study gets its auto window/level without a scan
+        path = self.getHistogramPath(self.getKey(path_to_dir, series_uid))
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        os.replace(writeTemporary(path, lambda file: np.savez(file, fingerprint=np.array(fingerprint), edges=histogram.edges, counts=histogram.counts, rescale=np.array([histogram.rescaleSlope, histogram.rescaleIntercept]))), path)
+
+    def getMinMaxIndexPath(self, key: str) -> str:
+        return os.path.join(self.cacheDir, key + ".minmax.npz")
+
+    def loadMinMaxIndex(self, path_to_dir: str, fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> Optional[MinMaxBrickIndex]:
+        path = self.getMinMaxIndexPath(self.getKey(path_to_dir, series_uid))
+        if not os.path.exists(path):
+            return None
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        with np.load(path) as data:
+            if str(data["fingerprint"]) != fingerprint:
+                return None
+            # Coarser levels are rebuilt from the brick ranges, a pass over a few KB
+            return MinMaxBrickIndex(data["minimum"], data["maximum"], int(data["brick_size"]), tuple(int(n) for n in data["shape"]))
+
+    def storeMinMaxIndex(self, path_to_dir: str, index: MinMaxBrickIndex, fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> None:
+        path = self.getMinMaxIndexPath(self.getKey(path_to_dir, series_uid))
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        (minimum, maximum) = index.levels[0]
+        os.replace(writeTemporary(path, lambda file: np.savez(file, fingerprint=np.array(fingerprint), brick_size=np.array(index.brickSize), shape=np.array(index.shape), minimum=minimum, maximum=maximum)), path)
+
+    def getPyramidPaths(self, key: str, level: int) -> tuple:
+        return (os.path.join(self.cacheDir, "{}.pyramid{}.npy".format(key, level)), os.path.join(self.cacheDir, "{}.pyramid{}.json".format(key, level)))
+
+    def loadPyramid(self, path_to_dir: str, shape: Tuple[int, int, int], factors: List[int], fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> Optional[List[Volume]]:
+        # Coarse levels 1..len(factors) of the volume with the given shape, memory-mapped like the voxels.
+        # None unless every level is there and was built from this study with these factors
+        key = self.getKey(path_to_dir, series_uid)
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        levels = []
+        for (level, factor) in enumerate(factors, 1):
+            (arrayPath, sidecarPath) = self.getPyramidPaths(key, level)
+            if not (os.path.exists(arrayPath) and os.path.exists(sidecarPath)):
+                return None
+            with open(sidecarPath, "r") as file:
+                sidecar = json.load(file)
+            if sidecar.get("fingerprint") != fingerprint or sidecar.get("factor") != factor or sidecar.get("source_shape") != list(shape):
+                return None
+            volume = Volume(np.load(arrayPath, mmap_mode="c"), sidecar["spacing"], sidecar["origin"], sidecar["direction"])
+            volume.setRescale(*sidecar["rescale"])
+            levels.append(volume)
+        return levels
+
+    def storePyramid(self, path_to_dir: str, levels: List[Volume], shape: Tuple[int, int, int], factors: List[int], fingerprint: Optional[str] = None, series_uid: Optional[str] = None) -> None:
+        # levels are the coarse levels of a VolumePyramid (without level 0), shape the one of level 0
+        key = self.getKey(path_to_dir, series_uid)
+        if fingerprint is None:
+            fingerprint = self.getFingerprint(path_to_dir)
+        for (level, (factor, volume)) in enumerate(zip(factors, levels), 1):
+            (arrayPath, sidecarPath) = self.getPyramidPaths(key, level)
+            sidecar = {
+                "fingerprint": fingerprint,
+                "factor": factor,
+                "source_shape": list(shape),
+                "spacing": list(volume.spacing),
+                "origin": list(volume.origin),
+                "direction": list(volume.direction),
+                "rescale": [volume.rescaleSlope, volume.rescaleIntercept]
+            }
+            arrayTemporary = writeTemporary(arrayPath, lambda file: np.save(file, np.ascontiguousarray(volume.array)))
+            sidecarTemporary = writeTemporary(sidecarPath, lambda file: json.dump(sidecar, file), "w")
+            os.replace(arrayTemporary, arrayPath)
+            os.replace(sidecarTemporary, sidecarPath)
+
+    def remove(self, path_to_dir: str, series_uid: Optional[str] = None) -> None:
+        key = self.getKey(path_to_dir, series_uid)
+        paths = list(self.getPaths(key)) + [self.getHistogramPath(key), self.getMinMaxIndexPath(key)]
+        level = 1
+        while os.path.exists(self.getPyramidPaths(key, level)[1]):
+            paths.extend(self.getPyramidPaths(key, level))
+            level += 1
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
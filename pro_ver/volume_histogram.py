@@ -0,0 +1,143 @@
+# Histogram and percentile table of a whole volume, built once at load and used for instant
+# auto window/level and window presets
+
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from volume_loader import Volume
+
+# (window, level) in HU
+WINDOW_PRESETS = {
+    "ct-soft-tissue": (400.0, 40.0),
+    "ct-lung": (1500.0, -600.0),
+    "ct-bone": (1800.0, 400.0),
+    "ct-brain": (80.0, 40.0),
+    "ct-liver": (150.0, 30.0),
+    "ct-mediastinum": (350.0, 50.0)
+}
+
+class VolumeHistogram(object):
+    def __init__(self, edges: np.ndarray, rescale: Tuple[float, float] = (1.0, 0.0)) -> None:
+        # edges are in stored units, bin i counts stored values in [edges[i], edges[i + 1]);
+        # integer volumes get one bin per stored value
+        self.edges = edges
+        self.counts = np.zeros(len(edges) - 1, dtype=np.int64)
+        (self.rescaleSlope, self.rescaleIntercept) = (float(rescale[0]), float(rescale[1]))
+        self.lock = threading.Lock()
+        self.cumulative = None
+
+    @staticmethod
+    def hasValuePerBin(dtype: np.dtype) -> bool:
+        # 8 and 16-bit integers are counted exactly with bincount
+        return np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2
+
+    @staticmethod
+    def fromVolume(volume: Volume, num_workers: Optional[int] = None, slab: int = 32, bins: int = 4096, value_range: Optional[Tuple[float, float]] = None) -> "VolumeHistogram":
+        # value_range (stored units) spares float volumes their min/max pass, e.g. from a MinMaxBrickIndex
+        dtype = volume.array.dtype
+        rescale = (volume.rescaleSlope, volume.rescaleIntercept)
+        if VolumeHistogram.hasValuePerBin(dtype):
+            info = np.iinfo(dtype)
+            histogram = VolumeHistogram(np.arange(int(info.min), int(info.max) + 2, dtype=np.float64), rescale)
+        else:
+            if value_range is None:
+                value_range = (float(np.nanmin(volume.array)), float(np.nanmax(volume.array)))
+            (low, high) = value_range
+            histogram = VolumeHistogram(np.linspace(low, high if high > low else low + 1, bins + 1), rescale)
+        histogram.build(volume.array, num_workers, slab)
+        return histogram
+
+    def countSlab(self, array: np.ndarray) -> np.ndarray:
+        if VolumeHistogram.hasValuePerBin(array.dtype):
+            offset = int(self.edges[0])
+            return np.bincount((array.reshape(-1).astype(np.int32) - offset), minlength=len(self.counts))
+        return np.histogram(array, self.edges)[0]
+
+    def update(self, array: np.ndarray) -> None:
+        # Adds voxels to the histogram, slabs of a volume can be fed as they are decoded
+        counts = self.countSlab(array)
+        with self.lock:
+            self.counts += counts
+            self.cumulative = None
+
+    def build(self, array: np.ndarray, num_workers: Optional[int] = None, slab: int = 32) -> "VolumeHistogram":
+        # Slabs are counted in parallel and added as they finish
+        with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count() or 1) as executor:
+            list(executor.map(lambda z0: self.update(array[z0:z0 + slab]), range(0, array.shape[0], slab)))
+        self.trim()
+        # Percentile lookups are a binary search from here on
+        self.cumulative = np.cumsum(self.getModalityCounts())
+        return self
+
+    def trim(self) -> None:
+        # Drops the empty bins at both ends, 16-bit volumes rarely use more than a few thousand values
+        occupied = np.flatnonzero(self.counts)
+        if len(occupied) == 0:
+            return
+        (first, last) = (occupied[0], occupied[-1])
+        with self.lock:
+            self.counts = self.counts[first:last + 1].copy()
+            self.edges = self.edges[first:last + 2].copy()
+            self.cumulative = None
+
+    def getNumberOfBytes(self) -> int:
+        return self.counts.nbytes + self.edges.nbytes + (self.cumulative.nbytes if self.cumulative is not None else 0)
+
+    def getTotal(self) -> int:
+        return int(self.counts.sum())
+
+    def toModalityValues(self, values: np.ndarray) -> np.ndarray:
+        return values * self.rescaleSlope + self.rescaleIntercept
+
+    def getModalityEdges(self) -> np.ndarray:
+        # Ascending bin edges in modality units, a negative slope reverses the bins
+        edges = self.toModalityValues(self.edges)
+        return edges[::-1] if self.rescaleSlope < 0 else edges
+
+    def getModalityCounts(self) -> np.ndarray:
+        return self.counts[::-1] if self.rescaleSlope < 0 else self.counts
+
+    def getPercentile(self, percentile: float, minimum: Optional[float] = None) -> float:
+        # Modality value below which percentile % of the voxels lie, voxels below minimum
+        # (modality units, e.g. air in CT) are left out
+        edges = self.getModalityEdges()
+        counts = self.getModalityCounts()
+        if minimum is not None:
+            counts = np.where(edges[1:] > minimum, counts, 0)
+            cumulative = np.cumsum(counts)
+        else:
+            if self.cumulative is None:
+                self.cumulative = np.cumsum(counts)
+            cumulative = self.cumulative
+        total = cumulative[-1] if len(cumulative) > 0 else 0
+        if total == 0:
+            return float(edges[0])
+        target = percentile / 100.0 * total
+        i = min(int(np.searchsorted(cumulative, target, side="right")), len(counts) - 1)
+        # Linear within the bin
+        before = cumulative[i - 1] if i > 0 else 0
+        fraction = (target - before) / counts[i] if counts[i] > 0 else 0.0
+        return float(edges[i] + fraction*(edges[i + 1] - edges[i]))
+
+    def getPercentileTable(self, step: float = 1.0, minimum: Optional[float] = None) -> Dict[float, float]:
+        return dict((float(p), self.getPercentile(p, minimum)) for p in np.arange(0.0, 100.0 + step/2, step))
+
+    def isHounsfield(self) -> bool:
+        # CT series hold air (about -1000 HU) and have a rescale intercept around -1024
+        return self.getPercentile(0.5) <= -900 and self.getPercentile(99.5) <= 4000
+
+    def getAutoWindowLevel(self, low: float = 1.0, high: float = 99.0) -> Tuple[float, float]:
+        # Window spanning the [low, high] percentiles; outside air is left out of CT volumes
+        minimum = -900.0 if self.isHounsfield() else None
+        (lower, upper) = (self.getPercentile(low, minimum), self.getPercentile(high, minimum))
+        return (max(upper - lower, 1.0), (upper + lower) / 2)
+
+    def getPresetWindowLevel(self, name: str) -> Tuple[float, float]:
+        # "auto" or one of WINDOW_PRESETS; CT presets fall back to auto for non-CT volumes
+        if name == "auto" or (name.startswith("ct-") and not self.isHounsfield()):
+            return self.getAutoWindowLevel()
+        if name not in WINDOW_PRESETS:
+            raise ValueError("Unknown window preset {}".format(name))
+        return WINDOW_PRESETS[name]
@@ -0,0 +1,229 @@
+# Parallel DICOM series loader (decodes slices straight into one preallocated volume buffer)
+
+import os
+import vtk
+import numpy as np
+import pydicom
+from vtkmodules.util import numpy_support
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Union, List, Tuple, Optional
+
+class Volume(object):
+    def __init__(self, array: np.ndarray, spacing: Union[List, Tuple], origin: Union[List, Tuple], direction: Optional[Union[List, Tuple]] = None) -> None:
+        # Voxels are stored as (z, y, x) so that x varies fastest, same as vtkImageData
+        self.array = array
+        self.spacing = tuple(float(s) for s in spacing)
+        self.origin = tuple(float(o) for o in origin)
+        # Row-major 3x3 direction cosines (x, y, z axes of the volume in patient coordinates)
+        self.direction = tuple(direction) if direction is not None else (1, 0, 0, 0, 1, 0, 0, 0, 1)
+        # Modality value = stored value * slope + intercept. Volumes kept in their stored form carry
+        # the series rescale here, volumes already in modality units keep the identity.
+        self.rescaleSlope = 1.0
+        self.rescaleIntercept = 0.0
+
+    def setRescale(self, slope: float, intercept: float) -> None:
+        self.rescaleSlope = float(slope)
+        self.rescaleIntercept = float(intercept)
+
+    def hasStoredValues(self) -> bool:
+        return self.rescaleSlope != 1 or self.rescaleIntercept != 0
+
+    def toModalityValues(self, values: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        # Lazy rescale for 2D reslice outputs or single values
+        if not self.hasStoredValues():
+            return values
+        return values * np.float32(self.rescaleSlope) + np.float32(self.rescaleIntercept)
+
+    def toStoredValues(self, values: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        if not self.hasStoredValues():
+            return values
+        return (values - self.rescaleIntercept) / self.rescaleSlope
+
+    def getDimensions(self) -> Tuple[int, int, int]:
+        (z, y, x) = self.array.shape
+        return (x, y, z)
+
+    def getExtent(self) -> Tuple[int, int, int, int, int, int]:
+        (x, y, z) = self.getDimensions()
+        return (0, x - 1, 0, y - 1, 0, z - 1)
+
+    def getNumberOfBytes(self) -> int:
+        return self.array.nbytes
+
+    def toImageData(self) -> vtk.vtkImageData:
+        # Wrap the buffer without copying, numpy_to_vtk keeps a reference to the array
+        array = np.ascontiguousarray(self.array)
+        scalars = numpy_support.numpy_to_vtk(array.reshape(-1), deep=False)
+        scalars.SetName("DICOMImage")
+        imageData = vtk.vtkImageData()
+        imageData.SetDimensions(self.getDimensions())
+        imageData.SetSpacing(self.spacing)
+        imageData.SetOrigin(self.origin)
+        imageData.GetPointData().SetScalars(scalars)
+        return imageData
+
+def imageDataToVolume(imageData: vtk.vtkImageData) -> Volume:
+    # Inverse of Volume.toImageData: the (z, y, x) array is a view on the VTK scalars, nothing is copied
+    scalars = imageData.GetPointData().GetScalars()
+    if scalars is None:
+        raise ValueError("Image data has no scalars")
+    (nx, ny, nz) = imageData.GetDimensions()
+    array = numpy_support.vtk_to_numpy(scalars).reshape(nz, ny, nx)
+    volume = Volume(array, imageData.GetSpacing(), imageData.GetOrigin())
+    # vtk_to_numpy does not hold a reference to the VTK array
+    volume.vtkScalars = scalars
+    return volume
+
+def listDicomFiles(path_to_dir: str) -> List[str]:
+    files = []
+    for name in sorted(os.listdir(path_to_dir)):
+        path = os.path.join(path_to_dir, name)
+        if os.path.isfile(path) and not name.startswith("."):
+            files.append(path)
+    return files
+
+def readSliceHeader(path: str) -> Optional[pydicom.Dataset]:
+    try:
+        header = pydicom.dcmread(path, stop_before_pixels=True)
+    except pydicom.errors.InvalidDicomError:
+        return None
+    if "ImagePositionPatient" not in header or "PixelSpacing" not in header:
+        return None
+    return header
+
+def sliceNormal(orientation: Union[List, Tuple]) -> Tuple[float, float, float]:
+    row = [float(v) for v in orientation[:3]]
+    col = [float(v) for v in orientation[3:6]]
+    return (
+        row[1] * col[2] - row[2] * col[1],
+        row[2] * col[0] - row[0] * col[2],
+        row[0] * col[1] - row[1] * col[0]
+    )
+
+def slicePosition(header: pydicom.Dataset) -> float:
+    # Distance of the slice along the slice normal, used to sort the series
+    normal = sliceNormal(header.get("ImageOrientationPatient", [1, 0, 0, 0, 1, 0]))
+    position = [float(v) for v in header.ImagePositionPatient]
+    return sum(normal[i] * position[i] for i in range(3))
+
+def sortSlices(paths: List[str], headers: List[pydicom.Dataset]) -> Tuple[List[str], List[pydicom.Dataset]]:
+    # Same order as vtkDICOMImageReader: slice 0 is the one furthest along the slice normal
+    pairs = [(slicePosition(header), path, header) for (path, header) in zip(paths, headers) if header is not None]
+    pairs.sort(key=lambda pair: pair[0], reverse=True)
+    return ([pair[1] for pair in pairs], [pair[2] for pair in pairs])
+
+def rescaleParameters(header: pydicom.Dataset) -> Tuple[float, float]:
+    return (float(header.get("RescaleSlope", 1.0)), float(header.get("RescaleIntercept", 0.0)))
+
+def volumeDtype(header: pydicom.Dataset) -> np.dtype:
+    # Same rule as vtkDICOMImageReader: stay integer unless the rescale needs fractions
+    (slope, intercept) = rescaleParameters(header)
+    if slope != int(slope) or intercept != int(intercept):
+        return np.dtype(np.float32)
+    if int(header.get("BitsAllocated", 16)) == 8 and slope == 1 and intercept == 0:
+        return np.dtype(np.uint8)
+    return np.dtype(np.int16)
+
+def storedDtype(header: pydicom.Dataset) -> np.dtype:
+    # The on-disk pixel type, without any rescale applied
+    bits = int(header.get("BitsAllocated", 16))
+    signed = int(header.get("PixelRepresentation", 0)) == 1
+    return np.dtype("{}{}".format("i" if signed else "u", max(1, bits // 8)))
+
+def hasUniformRescale(headers: List[pydicom.Dataset]) -> bool:
+    first = rescaleParameters(headers[0])
+    return all(rescaleParameters(header) == first for header in headers)
+
+def volumeGeometry(headers: List[pydicom.Dataset]) -> Tuple[Tuple, Tuple, Tuple]:
+    first = headers[0]
+    (rowSpacing, columnSpacing) = [float(v) for v in first.PixelSpacing]
+    if len(headers) > 1:
+        sliceSpacing = abs(slicePosition(headers[-1]) - slicePosition(first)) / (len(headers) - 1)
+    else:
+        sliceSpacing = float(first.get("SliceThickness", 1.0))
+    if sliceSpacing == 0:
+        sliceSpacing = float(first.get("SliceThickness", 1.0)) or 1.0
+    orientation = [float(v) for v in first.get("ImageOrientationPatient", [1, 0, 0, 0, 1, 0])]
+    # Rows are flipped (y runs bottom-up) and slices sorted against the normal, both axes are reversed
+    direction = tuple(orientation[:3]) + tuple(-v for v in orientation[3:6]) + tuple(-v for v in sliceNormal(orientation))
+    spacing = (columnSpacing, rowSpacing, sliceSpacing)
+    # vtkDICOMImageReader ignores ImagePositionPatient, the viewer's cameras expect its origin
+    origin = (0.0, 0.0, 0.0)
+    return (spacing, origin, direction)
+
+def decodeSlice(path: str, dtype: Union[str, np.dtype], rescale: bool = True) -> np.ndarray:
+    return decodeDataset(pydicom.dcmread(path), dtype, rescale)
+
+def decodeDataset(dataset: pydicom.Dataset, dtype: Union[str, np.dtype], rescale: bool = True) -> np.ndarray:
+    pixels = dataset.pixel_array
+    (slope, intercept) = rescaleParameters(dataset)
+    if rescale and (slope != 1 or intercept != 0):
+        pixels = pixels * slope + intercept
+    # vtkDICOMImageReader puts the last image row at y = 0
+    return np.flipud(pixels).astype(dtype, copy=False)
+
+class ParallelDICOMLoader(object):
+    def __init__(self, num_workers: Optional[int] = None, use_processes: bool = False, keep_stored_values: bool = False) -> None:
+        self.numWorkers = num_workers or os.cpu_count() or 1
+        self.useProcesses = use_processes
+        # Keep voxels in their stored (usually 16-bit) form and apply slope/intercept lazily
+        self.keepStoredValues = keep_stored_values
+
+    def getVolumeRescale(self, headers: List[pydicom.Dataset]) -> Tuple[float, float]:
+        # Rescale carried by the volume, slices with differing rescales have to be rescaled on decode
+        if self.keepStoredValues and hasUniformRescale(headers):
+            return rescaleParameters(headers[0])
+        return (1.0, 0.0)
+
+    def getVolumeDtype(self, headers: List[pydicom.Dataset]) -> np.dtype:
+        if self.getVolumeRescale(headers) != (1.0, 0.0):
+            return storedDtype(headers[0])
+        if not hasUniformRescale(headers):
+            return np.dtype(np.float32)
+        return volumeDtype(headers[0])
+
+    def createExecutor(self) -> Union[ThreadPoolExecutor, ProcessPoolExecutor]:
+        if self.useProcesses:
+            return ProcessPoolExecutor(max_workers=self.numWorkers)
+        return ThreadPoolExecutor(max_workers=self.numWorkers)
+
+    def readHeaders(self, paths: List[str]) -> Tuple[List[str], List[pydicom.Dataset]]:
+        # Header parsing is I/O bound, threads are enough even in process mode
+        with ThreadPoolExecutor(max_workers=self.numWorkers) as executor:
+            headers = list(executor.map(readSliceHeader, paths))
+        return sortSlices(paths, headers)
+
+    def allocateVolume(self, headers: List[pydicom.Dataset]) -> Volume:
+        first = headers[0]
+        (spacing, origin, direction) = volumeGeometry(headers)
+        array = np.empty((len(headers), int(first.Rows), int(first.Columns)), dtype=self.getVolumeDtype(headers))
+        volume = Volume(array, spacing, origin, direction)
+        volume.setRescale(*self.getVolumeRescale(headers))
+        return volume
+
+    def decodeInto(self, volume: Volume, paths: List[str], indices: Optional[List[int]] = None) -> None:
+        if indices is None:
+            indices = list(range(len(paths)))
+        dtype = volume.array.dtype
+        rescale = not volume.hasStoredValues()
+        if self.useProcesses:
+            # Slices come back pickled, the parent copies them into the buffer
+            with self.createExecutor() as executor:
+                for (index, pixels) in zip(indices, executor.map(decodeSlice, [paths[i] for i in indices], [dtype.str]*len(indices), [rescale]*len(indices), chunksize=8)):
+                    volume.array[index] = pixels
+        else:
+            def decodeSliceInto(index: int) -> None:
+                volume.array[index] = decodeSlice(paths[index], dtype, rescale)
+            with self.createExecutor() as executor:
+                list(executor.map(decodeSliceInto, indices))
+
+    def loadFiles(self, paths: List[str]) -> Volume:
+        (paths, headers) = self.readHeaders(paths)
+        if len(headers) == 0:
+            raise ValueError("No DICOM images found")
+        volume = self.allocateVolume(headers)
+        self.decodeInto(volume, paths)
+        return volume
+
+    def loadDirectory(self, path_to_dir: str) -> Volume:
+        return self.loadFiles(listDicomFiles(path_to_dir))
@@ -0,0 +1,115 @@
+# Multi-resolution pyramid of a loaded volume, coarse levels are resliced while the user drags
+
+import threading
+import vtk
+import numpy as np
+from typing import Callable, List, Tuple, Optional
+from volume_loader import Volume
+
+def downsampleVolume(volume: Volume, factor: int = 2, slab: int = 16) -> Volume:
+    # Block average over factor^3 voxels, axes shorter than the factor are kept as they are.
+    # A coarse voxel sits at the center of the fine voxels it averages, so the level covers the
+    # same world region as the full resolution volume.
+    (nz, ny, nx) = volume.array.shape
+    (fz, fy, fx) = [factor if n >= factor else 1 for n in (nz, ny, nx)]
+    (mz, my, mx) = (nz // fz, ny // fy, nx // fx)
+    integer = np.issubdtype(volume.array.dtype, np.integer)
+    array = np.empty((mz, my, mx), dtype=volume.array.dtype)
+    # Slab by slab keeps the float temporaries small
+    for z0 in range(0, mz, slab):
+        z1 = min(mz, z0 + slab)
+        block = volume.array[z0*fz:z1*fz, :my*fy, :mx*fx].reshape(z1 - z0, fz, my, fy, mx, fx)
+        mean = block.mean(axis=(1, 3, 5), dtype=np.float32)
+        array[z0:z1] = np.rint(mean) if integer else mean
+    (sx, sy, sz) = volume.spacing
+    (ox, oy, oz) = volume.origin
+    origin = (ox + (fx - 1)*sx/2, oy + (fy - 1)*sy/2, oz + (fz - 1)*sz/2)
+    coarse = Volume(array, (sx*fx, sy*fy, sz*fz), origin, volume.direction)
+    coarse.setRescale(volume.rescaleSlope, volume.rescaleIntercept)
+    return coarse
+
+class VolumePyramid(object):
+    def __init__(self, volume: Volume, factors: Tuple[int, ...] = (2, 4), imageData: Optional[vtk.vtkImageData] = None) -> None:
+        # Level 0 is the volume itself (imageData is its existing VTK wrapper, if any),
+        # level i is downsampled by factors[i - 1]
+        self.volume = volume
+        self.factors = sorted(int(f) for f in factors if int(f) > 1)
+        self.levels = [volume]
+        self.imageData = {0: imageData} if imageData is not None else {}
+        self.thread = None
+
+    def build(self) -> "VolumePyramid":
+        levels = [self.volume]
+        previous = 1
+        for factor in self.factors:
+            # Each level is reduced from the previous one, 4x costs 1/8 of the 2x pass
+            if factor % previous == 0:
+                levels.append(downsampleVolume(levels[-1], factor // previous))
+            else:
+                levels.append(downsampleVolume(self.volume, factor))
+            previous = factor
+        self.levels = levels
+        return self
+
+    def setLevels(self, levels: List[Volume]) -> "VolumePyramid":
+        # Coarse levels built earlier (e.g. read back from the volume cache), level 0 stays the volume
+        self.levels = [self.volume] + list(levels)
+        return self
+
+    def buildInBackground(self, on_finished: Callable[["VolumePyramid"], None]) -> threading.Thread:
+        def run() -> None:
+            self.build()
+            on_finished(self)
+
+        self.thread = threading.Thread(target=run, name="VolumePyramid", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def getNumberOfLevels(self) -> int:
+        return len(self.levels)
+
+    def getNumberOfBytes(self) -> int:
+        return sum(level.array.nbytes for level in self.levels[1:])
+
+    def getLevel(self, level: int) -> Volume:
+        return self.levels[min(level, len(self.levels) - 1)]
+
+    def getImageData(self, level: int) -> vtk.vtkImageData:
+        # The vtkImageData wrappers are created on first use, on the rendering thread
+        level = min(level, len(self.levels) - 1)
+        if level not in self.imageData:
+            self.imageData[level] = self.levels[level].toImageData()
+        return self.imageData[level]
+
+class LevelOfDetailSelector(object):
+    def __init__(self, frame_time: float = 1/30, smoothing: float = 0.5) -> None:
+        # frame_time is the reslice budget per interaction event in seconds
+        self.frameTime = frame_time
+        self.smoothing = smoothing
+        self.estimates = {}
+
+    def recordFrameTime(self, level: int, seconds: float) -> None:
+        if level in self.estimates:
+            seconds = self.smoothing*self.estimates[level] + (1 - self.smoothing)*seconds
+        self.estimates[level] = seconds
+
+    def estimateFrameTime(self, level: int) -> Optional[float]:
+        if level in self.estimates:
+            return self.estimates[level]
+        if len(self.estimates) == 0:
+            return None
+        # 2D outputs shrink by 4x per pyramid level, scale from the nearest measured level
+        nearest = min(self.estimates, key=lambda measured: abs(measured - level))
+        return self.estimates[nearest] * 4.0**(nearest - level)
+
+    def selectLevel(self, num_levels: int) -> int:
+        # Finest level whose estimated frame time meets the budget, the coarsest one otherwise
+        for level in range(num_levels):
+            estimate = self.estimateFrameTime(level)
+            if estimate is None or estimate <= self.frameTime:
+                return level
+        return num_levels - 1